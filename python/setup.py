@@ -57,6 +57,7 @@ setup(name="xrayspectrumanalyzer",
                         'Pillow',
                         'six',
                         'lmfit',
+                        'pySpectrumFileFormat',
                         ],
       setup_requires=['nose', 'coverage'],
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: tests.test_ImportTime
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Import checks of the reference data and fitting modules.
+
+The modules must not load matplotlib (pyplot for SpectrumAnalyzer). The cold import time is only
+checked if the environment variable XRAYSPECTRUMANALYZER_MAXIMUM_IMPORT_TIME_s gives the maximum time.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+import logging
+import os.path
+import sys
+import subprocess
+import json
+
+# Third party modules.
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+MAXIMUM_IMPORT_TIME_ENVIRONMENT = "XRAYSPECTRUMANALYZER_MAXIMUM_IMPORT_TIME_s"
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+startTime = time.perf_counter()
+try:
+    import %s
+except ImportError as message:
+    print(json.dumps({"error": str(message)}))
+else:
+    modules = [name for name in sys.modules if name == "matplotlib" or name.startswith("matplotlib.")]
+    print(json.dumps({"time_s": time.perf_counter() - startTime, "modules": modules}))
+"""
+
+def measureImport(moduleName):
+    """
+    Import `moduleName` in a new interpreter and return the import time and the matplotlib modules loaded.
+    """
+    projectPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", _IMPORT_SCRIPT % (moduleName)], cwd=projectPath)
+    return json.loads(output.decode().splitlines()[-1])
+
+class TestImportTime(unittest.TestCase):
+
+    def _checkImport(self, moduleName, forbiddenModules):
+        # Each module is skipped alone if one of its dependencies is missing.
+        with self.subTest(moduleName=moduleName):
+            result = measureImport(moduleName)
+            if "error" in result:
+                self.skipTest("Import %s failed: %s" % (moduleName, result["error"]))
+
+            logging.info("Import %s: %.3f s", moduleName, result["time_s"])
+            for forbiddenModule in forbiddenModules:
+                self.assertNotIn(forbiddenModule, result["modules"], moduleName)
+
+            # The import time depends on the load of the machine, it is checked only on request.
+            maximumImportTime_s = os.environ.get(MAXIMUM_IMPORT_TIME_ENVIRONMENT)
+            if maximumImportTime_s:
+                self.assertLess(result["time_s"], float(maximumImportTime_s), moduleName)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_ReferenceDataModules(self):
+        for moduleName in ["xrayspectrumanalyzer",
+                           "xrayspectrumanalyzer.tools.ElementProperties",
+                           "xrayspectrumanalyzer.tools.XRayTransitionData",
+                           "xrayspectrumanalyzer.ui.console.XrayLineReferenceManager"]:
+            self._checkImport(moduleName, ["matplotlib"])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitModules(self):
+        for moduleName in ["xrayspectrumanalyzer.tools.fitTools",
+                           "xrayspectrumanalyzer.tools.FitGaussianFunction",
+                           "xrayspectrumanalyzer.tools.FitPolynomialFunction",
+                           "xrayspectrumanalyzer.tools.FitMultiGaussianFunction",
+                           "xrayspectrumanalyzer.tools.FitSparseSpectrumFunction"]:
+            self._checkImport(moduleName, ["matplotlib"])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_SpectrumAnalyzer(self):
+        # lmfit loads parts of matplotlib, but pyplot should not be loaded.
+        self._checkImport("xrayspectrumanalyzer.ui.console.SpectrumAnalyzer",
+                          ["matplotlib.pyplot", "matplotlib.text"])
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.EnergyAxis as EnergyAxis
+
+# Globals and constants variables.
+
+class TestEnergyAxis(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.xData = np.arange(-10, 1014)*0.01
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_getEnergySlice(self):
+        energyRanges_keV = [(0.0, 1.0), (1.6, 1.9), (1.605, 1.895), (-1.0, 20.0), (20.0, 30.0), (-2.0, -1.0), (2.0, 1.0), (1.5, 1.5)]
+        for eMin_keV, eMax_keV in energyRanges_keV:
+            energySlice = EnergyAxis.getEnergySlice(self.xData, eMin_keV, eMax_keV)
+
+            inside = np.logical_and(self.xData >= eMin_keV, self.xData <= eMax_keV)
+            np.testing.assert_array_equal(self.xData[inside], self.xData[energySlice])
+            self.assertTrue(EnergyAxis.isEnergySlice(self.xData, energySlice, eMin_keV, eMax_keV))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_isEnergySlice(self):
+        energySlice = EnergyAxis.getEnergySlice(self.xData, 1.6, 1.9)
+        self.assertEqual(slice(170, 200), energySlice)
+
+        self.assertTrue(EnergyAxis.isEnergySlice(self.xData.copy(), energySlice, 1.6, 1.9))
+        self.assertFalse(EnergyAxis.isEnergySlice(self.xData + 0.015, energySlice, 1.6, 1.9))
+        self.assertFalse(EnergyAxis.isEnergySlice(self.xData, energySlice, 1.6, 1.95))
+        self.assertFalse(EnergyAxis.isEnergySlice(self.xData[:180], energySlice, 1.6, 1.9))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_EnergySliceCache(self):
+        energySlices = EnergyAxis.EnergySliceCache()
+
+        energySlice = energySlices.getSlice(self.xData, 1.6, 1.9)
+        self.assertIs(energySlice, energySlices.getSlice(self.xData.copy(), 1.6, 1.9))
+
+        xData = self.xData*1.01
+        energySlice = energySlices.getSlice(xData, 1.6, 1.9)
+        self.assertEqual(EnergyAxis.getEnergySlice(xData, 1.6, 1.9), energySlice)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_WindowIntegrator(self):
+        yData = np.random.RandomState(0).rand(3, 4, len(self.xData))
+        windowIntegrator = EnergyAxis.WindowIntegrator(self.xData, yData)
+
+        e1s_keV = np.array([0.0, 1.6, 1.605, -1.0, 20.0, 2.0])
+        e2s_keV = np.array([1.0, 1.9, 1.895, 20.0, 30.0, 1.0])
+        integrals = windowIntegrator.integrate(e1s_keV, e2s_keV)
+        self.assertEqual((3, 4, len(e1s_keV)), integrals.shape)
+
+        for indexWindow, (e1_keV, e2_keV) in enumerate(zip(e1s_keV, e2s_keV)):
+            inside = np.logical_and(self.xData >= e1_keV, self.xData <= e2_keV)
+            np.testing.assert_allclose(np.sum(yData[..., inside], axis=-1), integrals[..., indexWindow], atol=1.0e-12)
+            self.assertAlmostEqual(np.sum(yData[1, 2, inside]), windowIntegrator.integrate(e1_keV, e2_keV, index=(1, 2)))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_WindowIntegratorFractional(self):
+        yData = np.random.RandomState(0).rand(2, len(self.xData))
+        windowIntegrator = EnergyAxis.WindowIntegrator(self.xData, yData)
+
+        # Windows on the channel edges include whole channels.
+        np.testing.assert_allclose(np.sum(yData, axis=-1), windowIntegrator.integrate(-1.0, 20.0, fractional=True))
+        np.testing.assert_allclose(np.sum(yData[:, 170:201], axis=-1), windowIntegrator.integrate(1.595, 1.905, fractional=True))
+
+        # Half of a channel and a quarter of the next one.
+        integral = windowIntegrator.integrate(1.6, 1.6075, index=0, fractional=True)
+        self.assertAlmostEqual(0.5*yData[0, 170] + 0.25*yData[0, 171], integral)
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
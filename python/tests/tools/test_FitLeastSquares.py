@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.FitLeastSquares as FitLeastSquares
+from xrayspectrumanalyzer.tools.FitMultiGaussianFunction import MultiGaussianFunction
+
+# Globals and constants variables.
+
+class TestFitLeastSquares(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.x = np.linspace(0.0, 2.0, 201)
+        self.names = ("a", "b", "area1", "area2", "position1", "position2", "sigma1", "sigma2")
+        self.values = np.array([12.0, -3.0, 1000.0, 250.0, 0.52, 0.70, 0.025, 0.03])
+        self.lowerBounds = np.array([-np.inf, -np.inf, 0.0, 0.0, 0.50, 0.68, 0.0, -np.inf])
+        self.upperBounds = np.array([np.inf, np.inf, np.inf, np.inf, 0.54, 0.72, np.inf, 0.1])
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def _functionModel(self, values, x):
+        return MultiGaussianFunction(values[2:4], values[4:6], values[6:8], a=values[0], b=values[1])(x)
+
+    def _functionJacobian(self, values, x):
+        derivativeAreas, derivativePositions, derivativeSigmas = MultiGaussianFunction(values[2:4], values[4:6], values[6:8]).derivatives(x)
+        return np.vstack((np.ones_like(x), x, derivativeAreas, derivativePositions, derivativeSigmas))
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_BoundsTransform(self):
+        transform = FitLeastSquares.BoundsTransform(self.lowerBounds, self.upperBounds)
+        internalValues = transform.toInternal(self.values)
+        values, derivatives = transform.fromInternal(internalValues)
+        np.testing.assert_allclose(self.values, values, rtol=1.0e-12)
+
+        step = 1.0e-6
+        valuesPlus, _derivatives = transform.fromInternal(internalValues + step)
+        valuesMinus, _derivatives = transform.fromInternal(internalValues - step)
+        np.testing.assert_allclose((valuesPlus - valuesMinus)/(2.0*step), derivatives, rtol=1.0e-6, atol=1.0e-9)
+
+        values, _derivatives = transform.fromInternal(transform.toInternal(self.values + 1.0))
+        np.testing.assert_allclose([13.0, -2.0, 1001.0, 251.0, 0.54, 0.72, 1.025, 0.1], values, rtol=1.0e-12)
+
+        valuesBatch = np.vstack((self.values, self.values + 1.0))
+        values, derivatives = transform.fromInternal(transform.toInternal(valuesBatch))
+        self.assertEqual((2, len(self.values)), derivatives.shape)
+        np.testing.assert_allclose(self.values, values[0], rtol=1.0e-12)
+        np.testing.assert_allclose([13.0, -2.0, 1001.0, 251.0, 0.54, 0.72, 1.025, 0.1], values[1], rtol=1.0e-12)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_Minimize(self):
+        data = self._functionModel(self.values, self.x)
+        vary = np.ones(len(self.names), dtype=bool)
+        vary[1] = False
+        guesses = np.array([10.0, -3.0, 800.0, 300.0, 0.53, 0.69, 0.03, 0.03])
+
+        result = FitLeastSquares.minimize(self.names, guesses, vary, self.lowerBounds, self.upperBounds,
+                                          self._functionModel, self._functionJacobian, self.x, data)
+        self.assertTrue(result.success)
+        self.assertEqual(list(self.names), list(result.params))
+        np.testing.assert_allclose(self.values, [parameter.value for parameter in result.params.values()], rtol=1.0e-6)
+        self.assertEqual(0.0, result.params["b"].stderr)
+        self.assertEqual(7, result.nvarys)
+        self.assertEqual(len(self.x) - 7, result.nfree)
+        self.assertAlmostEqual(0.0, result.redchi)
+
+        result = FitLeastSquares.minimize(self.names, guesses, vary, self.lowerBounds, self.upperBounds,
+                                          self._functionModel, self._functionJacobian, self.x, data, maximumEvaluations=2)
+        self.assertFalse(result.success)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_MinimizeBatch(self):
+        def functionModel(values, x):
+            return np.array([self._functionModel(valuesProblem, x) for valuesProblem in values])
+
+        def functionJacobian(values, x):
+            return np.array([self._functionJacobian(valuesProblem, x) for valuesProblem in values])
+
+        scales = np.array([1.0, 0.3, 2.0])
+        valuesProblems = np.tile(self.values, (3, 1))
+        valuesProblems[:, 2:4] *= scales[:, np.newaxis]
+        valuesProblems[1, 4] = 0.51
+        noise = 0.5*np.sin(37.0*self.x)
+        data = functionModel(valuesProblems, self.x) + noise
+        vary = np.ones(len(self.names), dtype=bool)
+        vary[1] = False
+        guesses = np.tile([10.0, -3.0, 800.0, 300.0, 0.53, 0.69, 0.03, 0.03], (3, 1))
+
+        results = FitLeastSquares.minimizeBatch(self.names, guesses, vary, self.lowerBounds, self.upperBounds,
+                                                functionModel, functionJacobian, self.x, data)
+        self.assertEqual(3, len(results))
+        for index, result in enumerate(results):
+            expected = FitLeastSquares.minimize(self.names, guesses[index], vary, self.lowerBounds, self.upperBounds,
+                                                self._functionModel, self._functionJacobian, self.x, data[index])
+            self.assertTrue(result.success)
+            self.assertEqual(list(self.names), list(result.params))
+            np.testing.assert_allclose([parameter.value for parameter in expected.params.values()],
+                                       [parameter.value for parameter in result.params.values()], rtol=1.0e-5)
+            np.testing.assert_allclose([parameter.stderr for parameter in expected.params.values()],
+                                       [parameter.stderr for parameter in result.params.values()], rtol=1.0e-3)
+            self.assertAlmostEqual(expected.chisqr, result.chisqr, delta=1.0e-6*expected.chisqr)
+            self.assertEqual(7, result.nvarys)
+            self.assertEqual(-3.0, result.params["b"].value)
+
+        results = FitLeastSquares.minimizeBatch(self.names, guesses, vary, self.lowerBounds, self.upperBounds,
+                                                functionModel, functionJacobian, self.x, data, maximumEvaluations=2)
+        self.assertEqual([False]*3, [result.success for result in results])
+        self.assertEqual([2]*3, [result.nfev for result in results])
+
+        # With a wrong Jacobian, no step reduces the chi-square: the fits stall and are not successful.
+        def functionJacobianWrong(values, x):
+            return -functionJacobian(values, x)
+        results = FitLeastSquares.minimizeBatch(self.names, guesses, vary, self.lowerBounds, self.upperBounds,
+                                                functionModel, functionJacobianWrong, self.x, data)
+        self.assertEqual([False]*3, [result.success for result in results])
+        self.assertEqual(["The chi-square cannot be reduced."]*3, [result.message for result in results])
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.FitMultiGaussianFunction as FitMultiGaussianFunction
+from xrayspectrumanalyzer.tools.FitGaussianFunction import GaussianFunction
+from xrayspectrumanalyzer.tools.FitPolynomialFunction import PolynomialFirstDegreeFunction
+
+# Globals and constants variables.
+
+class TestFitMultiGaussianFunction(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.x = np.linspace(0.0, 2.0, 201)
+        self.areas = [1000.0, 250.0, 40.0]
+        self.positions = [0.52, 0.70, 1.74]
+        self.sigmas = [0.025, 0.03, 0.035]
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_MultiGaussianFunction(self):
+        function = FitMultiGaussianFunction.MultiGaussianFunction(self.areas, self.positions, self.sigmas, a=12.0, b=-3.0)
+        self.assertEqual(3, function.numberPeaks)
+
+        peaks = function.peaks(self.x)
+        self.assertEqual((3, len(self.x)), peaks.shape)
+
+        yExpected = PolynomialFirstDegreeFunction(a=12.0, b=-3.0)(self.x)
+        for indexPeak in range(3):
+            yPeak = GaussianFunction(self.areas[indexPeak], self.positions[indexPeak], self.sigmas[indexPeak])(self.x)
+            np.testing.assert_allclose(yPeak, peaks[indexPeak], atol=1.0e-12)
+            yExpected += yPeak
+
+        np.testing.assert_allclose(yExpected, function(self.x))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_UnitPeaks(self):
+        function = FitMultiGaussianFunction.MultiGaussianFunction(self.areas, self.positions, self.sigmas)
+        unitPeaks = function.unitPeaks(self.x)
+
+        np.testing.assert_allclose(np.ones(3), np.sum(unitPeaks, axis=1)*(self.x[1] - self.x[0]), rtol=1.0e-6)
+        np.testing.assert_allclose(function.peaks(self.x), np.array(self.areas)[:, np.newaxis]*unitPeaks)
+        for index in range(function.numberPeaks):
+            np.testing.assert_array_equal(function.peaks(self.x)[index], function.peak(self.x, index))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_Derivatives(self):
+        function = FitMultiGaussianFunction.MultiGaussianFunction(self.areas, self.positions, self.sigmas, a=12.0, b=-3.0)
+        derivatives = function.derivatives(self.x)
+
+        for indexParameter, name in enumerate(["areas", "positions", "sigmas"]):
+            for indexPeak in range(3):
+                values = getattr(function, name)
+                value = values[indexPeak]
+                step = value*1.0e-6
+
+                values[indexPeak] = value + step
+                yPlus = function(self.x)
+                values[indexPeak] = value - step
+                yMinus = function(self.x)
+                values[indexPeak] = value
+
+                derivativeExpected = (yPlus - yMinus)/(2.0*step)
+                np.testing.assert_allclose(derivativeExpected, derivatives[indexParameter][indexPeak], rtol=1.0e-5, atol=1.0e-3)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_SolveLinearParameters(self):
+        function = FitMultiGaussianFunction.MultiGaussianFunction(self.areas, self.positions, self.sigmas, a=12.0, b=-3.0)
+        y = function(self.x)
+
+        function = FitMultiGaussianFunction.MultiGaussianFunction(np.zeros(3), self.positions, self.sigmas)
+        function.solveLinearParameters(self.x, y)
+        self.assertAlmostEqual(12.0, function.a, places=6)
+        self.assertAlmostEqual(-3.0, function.b, places=6)
+        np.testing.assert_allclose(self.areas, function.areas, rtol=1.0e-6)
+
+        function = FitMultiGaussianFunction.MultiGaussianFunction(np.zeros(3), self.positions, self.sigmas, a=12.0, b=-3.0)
+        function.solveLinearParameters(self.x, y, isBackgroundFixed=True)
+        self.assertEqual(12.0, function.a)
+        self.assertEqual(-3.0, function.b)
+        np.testing.assert_allclose(self.areas, function.areas, rtol=1.0e-6)
+
+        function = FitMultiGaussianFunction.MultiGaussianFunction(np.zeros(3), self.positions, self.sigmas)
+        function.solveLinearParameters(self.x, 20.0 - function.unitPeaks(self.x)[2])
+        self.assertEqual(0.0, function.areas[2])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_ProjectedDerivatives(self):
+        function = FitMultiGaussianFunction.MultiGaussianFunction(self.areas, self.positions, self.sigmas, a=12.0, b=-3.0)
+        derivativePositions, derivativeSigmas = function.projectedDerivatives(self.x)
+        self.assertEqual((3, len(self.x)), derivativePositions.shape)
+        self.assertEqual((3, len(self.x)), derivativeSigmas.shape)
+
+        basis = np.vstack((np.ones_like(self.x), self.x, function.unitPeaks(self.x)))
+        np.testing.assert_allclose(0.0, np.dot(basis, derivativePositions.T), atol=1.0e-6)
+        np.testing.assert_allclose(0.0, np.dot(basis, derivativeSigmas.T), atol=1.0e-6)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_BatchMultiGaussianFunction(self):
+        scales = np.array([1.0, 0.5, 2.0, 0.0])
+        shifts = np.array([0.0, 0.01, -0.005, 0.0])
+        areas = scales[:, np.newaxis]*self.areas
+        positions = shifts[:, np.newaxis] + self.positions
+        sigmas = np.tile(self.sigmas, (4, 1))
+        function = FitMultiGaussianFunction.BatchMultiGaussianFunction(areas, positions, sigmas, a=12.0*scales, b=-3.0*scales)
+        self.assertEqual(4, function.numberSpectra)
+        self.assertEqual((4, len(self.x)), function(self.x).shape)
+        self.assertEqual((4, 3, len(self.x)), function.peaks(self.x).shape)
+
+        derivatives = function.derivatives(self.x)
+        for index in range(4):
+            functionSpectrum = function.getFunction(index)
+            np.testing.assert_allclose(functionSpectrum(self.x), function(self.x)[index])
+            np.testing.assert_allclose(functionSpectrum.background(self.x), function.background(self.x)[index])
+            for derivative, derivativeSpectrum in zip(derivatives, functionSpectrum.derivatives(self.x)):
+                np.testing.assert_allclose(derivativeSpectrum, derivative[index])
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+import os.path
+import tempfile
+import shutil
+import pickle
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.FitResultCache as FitResultCache
+
+# Globals and constants variables.
+
+class TestFitResultCache(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.path = tempfile.mkdtemp()
+        self.configuration = {"elements": ["Si", "O"], "detector": [40.0, 0.12], "maximumEnergy_keV": None}
+        self.data = np.arange(10.0)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+        shutil.rmtree(self.path)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_CreateKey(self):
+        key = FitResultCache.createKey(self.configuration, self.data)
+        self.assertEqual(key, FitResultCache.createKey(dict(self.configuration), np.arange(10, dtype=np.int32)))
+        self.assertEqual(key, FitResultCache.createKey({"maximumEnergy_keV": None, "detector": [40.0, 0.12], "elements": ["Si", "O"]}, self.data))
+
+        self.assertNotEqual(key, FitResultCache.createKey(self.configuration, self.data + 1.0e-9))
+        self.assertNotEqual(key, FitResultCache.createKey(self.configuration, self.data.reshape(2, 5)))
+        self.assertNotEqual(key, FitResultCache.createKey(dict(self.configuration, detector=[40.0, 0.13]), self.data))
+        self.assertNotEqual(key, FitResultCache.createKey(self.configuration, self.data[:5], self.data[5:]))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_GetSet(self):
+        cache = FitResultCache.FitResultCache(self.path)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(1, cache.numberMisses)
+
+        cache.set("a", ([1.0, 2.0], "label"))
+        self.assertEqual(([1.0, 2.0], "label"), cache.get("a"))
+        self.assertEqual(1, cache.numberHits)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(os.path.getsize(cache.getFilepath("a")), cache.size_bytes)
+
+        # The entries are kept in the path for another cache, or another process.
+        cache = pickle.loads(pickle.dumps(FitResultCache.FitResultCache(self.path)))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(([1.0, 2.0], "label"), cache.get("a"))
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get("a"))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_LeastRecentlyUsed(self):
+        value = np.zeros(1000)
+        cache = FitResultCache.FitResultCache(self.path, maximumSize_MB=0.020)
+        cache.set("a", value)
+        entrySize_bytes = cache.size_bytes
+        cache = FitResultCache.FitResultCache(self.path, maximumSize_MB=2.5*entrySize_bytes*1.0e-6)
+
+        cache.set("b", value)
+        self.assertIsNotNone(cache.get("a"))
+        cache.set("c", value)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse(os.path.isfile(cache.getFilepath("b")))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.size_bytes, cache.maximumSize_MB*1.0e6)
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
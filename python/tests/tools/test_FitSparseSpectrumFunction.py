@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.FitSparseSpectrumFunction as FitSparseSpectrumFunction
+from xrayspectrumanalyzer.tools.FitGaussianFunction import GaussianFunction
+
+# Globals and constants variables.
+
+class TestFitSparseSpectrumFunction(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.x = np.linspace(0.0, 4.0, 401)
+        self.knots = np.array([0.0, 1.0, 2.5, 4.0])
+        self.areas = np.array([1000.0, 250.0])
+        self.positions = np.array([0.52, 1.74])
+        self.sigmas = np.array([0.025, 0.035])
+        windowHalfWidth = 5.0*self.sigmas
+        self.function = FitSparseSpectrumFunction.SparseSpectrumFunction(self.x, self.knots,
+                                                                         self.positions - windowHalfWidth,
+                                                                         self.positions + windowHalfWidth)
+        self.knotValues = np.array([20.0, 10.0, 12.0, 4.0])
+        self.values = np.concatenate((self.knotValues, self.areas, self.positions, self.sigmas))
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_SparseSpectrumFunction(self):
+        self.assertEqual(4 + 3*2, self.function.numberParameters)
+
+        background = self.function.background(self.values)
+        np.testing.assert_allclose(np.interp(self.x, self.knots, self.knotValues), background)
+
+        yExpected = background.copy()
+        for indexPeak in range(2):
+            yPeak = GaussianFunction(self.areas[indexPeak], self.positions[indexPeak], self.sigmas[indexPeak])(self.x)
+            window, yPeakWindow = self.function.peak(self.values, indexPeak)
+            np.testing.assert_allclose(yPeak[window], yPeakWindow)
+            self.assertAlmostEqual(1.0, np.sum(yPeakWindow)/np.sum(yPeak), places=5)
+            yExpected[window] += yPeakWindow
+
+        np.testing.assert_allclose(yExpected, self.function(self.values))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_Jacobian(self):
+        jacobian = self.function.jacobian(self.values)
+        self.assertEqual((len(self.x), self.function.numberParameters), jacobian.shape)
+        self.assertLess(jacobian.nnz, 0.25*jacobian.shape[0]*jacobian.shape[1])
+
+        jacobian = jacobian.toarray()
+        for indexParameter in range(self.function.numberParameters):
+            step = max(abs(self.values[indexParameter])*1.0e-6, 1.0e-6)
+            valuesPlus = self.values.copy()
+            valuesPlus[indexParameter] += step
+            valuesMinus = self.values.copy()
+            valuesMinus[indexParameter] -= step
+
+            derivativeExpected = (self.function(valuesPlus) - self.function(valuesMinus))/(2.0*step)
+            np.testing.assert_allclose(derivativeExpected, jacobian[:, indexParameter], rtol=1.0e-5, atol=1.0e-2)
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+""" """
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+import os.path
+import tempfile
+import shutil
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.tools.SpectrumCube as SpectrumCube
+
+# Globals and constants variables.
+
+class TestSpectrumCube(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.path = tempfile.mkdtemp()
+        self.data = np.arange(5*7*11, dtype=np.uint16).reshape(5, 7, 11)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+        shutil.rmtree(self.path)
+
+    def testSkeleton(self):
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_SpectrumCube(self):
+        for recordBy in [SpectrumCube.RECORD_BY_VECTOR, SpectrumCube.RECORD_BY_IMAGE]:
+            rplFilepath = os.path.join(self.path, "cube_%s.rpl" % (recordBy))
+            SpectrumCube.writeRplCube(rplFilepath, self.data, recordBy, energyOffset_keV=-0.1, energyScale_keV=0.02)
+            self.assertTrue(os.path.isfile(os.path.join(self.path, "cube_%s.raw" % (recordBy))))
+
+            cube = SpectrumCube.SpectrumCube(rplFilepath)
+            self.assertEqual((5, 7, 11), (cube.numberRows, cube.numberColumns, cube.numberChannels))
+            np.testing.assert_allclose(-0.1 + 0.02*np.arange(11), cube.getEnergies_keV())
+            np.testing.assert_array_equal(self.data[3, 4], cube.getSpectrum(3, 4))
+
+            np.testing.assert_array_equal(self.data[2], cube.getBinnedRow(2))
+            self.assertEqual((2, 3), cube.getMapShape(2))
+            expected = self.data[2:4, 0:6].reshape(2, 3, 2, 11).sum(axis=(0, 2))
+            np.testing.assert_array_equal(expected, cube.getBinnedRow(1, 2))
+            expected = self.data[2:4, 2:6].reshape(1, 2, 2, 2, 11).sum(axis=(1, 3))
+            np.testing.assert_array_equal(expected, cube.getBinnedTile((1, 2, 1, 3), 2))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_ReadRplHeader(self):
+        rplFilepath = os.path.join(self.path, "cube.rpl")
+        with open(rplFilepath, 'w') as rplFile:
+            rplFile.write("key\tvalue\nwidth\t7\nheight\t5\ndepth\t11\noffset\t0\ndata-length\t2\n")
+            rplFile.write("data-type\tunsigned\nbyte-order\tlittle-endian\nrecord-by\tvector\nev-per-chan\t10\n")
+        self.data.astype('<u2').tofile(os.path.join(self.path, "cube.raw"))
+
+        header = SpectrumCube.readRplHeader(rplFilepath)
+        self.assertEqual(7, header["width"])
+        self.assertEqual("little-endian", header["byte-order"])
+        self.assertNotIn("key", header)
+
+        cube = SpectrumCube.SpectrumCube(rplFilepath)
+        np.testing.assert_allclose(0.01*np.arange(11), cube.getEnergies_keV())
+        np.testing.assert_array_equal(self.data[4, 6], cube.getSpectrum(4, 6))
+
+        cube = SpectrumCube.SpectrumCube(rplFilepath, energyOffset_keV=0.5)
+        self.assertAlmostEqual(0.5, cube.getEnergies_keV()[0])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_Tiles(self):
+        tiles = SpectrumCube.getTiles((5, 7), 3)
+        self.assertEqual([(0, 3, 0, 3), (0, 3, 3, 6), (0, 3, 6, 7), (3, 5, 0, 3), (3, 5, 3, 6), (3, 5, 6, 7)], tiles)
+
+        self.assertEqual(10, SpectrumCube.computeTileSize((1000, 1000), 1000, 1, 1, maximumMemory_MB=0.8))
+        self.assertEqual(5, SpectrumCube.computeTileSize((1000, 1000), 1000, 2, 1, maximumMemory_MB=0.8))
+        self.assertEqual(5, SpectrumCube.computeTileSize((1000, 1000), 1000, 1, 4, maximumMemory_MB=0.8))
+        self.assertEqual(4, SpectrumCube.computeTileSize((8, 8), 1000, 1, 1))
+        self.assertEqual(1, SpectrumCube.computeTileSize((8, 8), 1000, 1, 1, maximumMemory_MB=1.0e-6))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_TileManifest(self):
+        filepath = os.path.join(self.path, "cube_tiles.json")
+        description = {"cube": "cube.rpl", "binning": 2, "shape": (2, 3)}
+        manifest = SpectrumCube.TileManifest(filepath, description)
+        self.assertFalse(manifest.isResumed)
+        manifest.addTile((0, 1, 0, 3))
+        self.assertTrue(os.path.isfile(filepath))
+
+        manifest = SpectrumCube.TileManifest(filepath, description)
+        self.assertTrue(manifest.isResumed)
+        self.assertTrue(manifest.isDone((0, 1, 0, 3)))
+        self.assertFalse(manifest.isDone((1, 2, 0, 3)))
+
+        manifest = SpectrumCube.TileManifest(filepath, {"cube": "cube.rpl", "binning": 1, "shape": (5, 7)})
+        self.assertFalse(manifest.isResumed)
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
@@ -20,9 +20,14 @@
 # Standard library modules.
 import unittest
 import os.path
+import tempfile
+import warnings
+import shutil
+import time
 
 # Third party modules.
 from nose import SkipTest
+import numpy as np
 
 # Local modules.
 from xrayspectrumanalyzer import get_current_module_path
@@ -199,6 +204,155 @@ class TestXRayTransitionData(unittest.TestCase):
         self.assertEqual(len(transitionsEnergies_eV.keys()), 3)
         self.assertEqual(transitionsEnergies_eV['Ma1'], 2121.8)
 
+    def testReadTable(self):
+        path = tempfile.mkdtemp()
+        cachePath = os.path.join(path, "cache")
+        os.environ[XRayTransitionData.CACHE_PATH_VARIABLE] = cachePath
+        try:
+            dataPath = get_current_module_path(XRayTransitionData.__file__, "../../../data/")
+            filename = os.path.join(path, "XrayDataLine.csv")
+            shutil.copy(os.path.join(dataPath, "XrayDataLine.csv"), filename)
+
+            table = XRayTransitionData.readTable(filename, XRayTransitionData.LINE_DTYPE, XRayTransitionData.readLineRows)
+            rows = XRayTransitionData.readLineRows(filename)
+            self.assertEqual(len(rows), len(table))
+            self.assertEqual(rows, table.tolist())
+
+            cacheFilenames = [name for name in os.listdir(cachePath) if name.endswith(".npy")]
+            self.assertEqual(1, len(cacheFilenames))
+            self.assertEqual(["XrayDataLine.csv", "cache"], sorted(os.listdir(path)))
+
+            self.assertIs(table, XRayTransitionData.readTable(filename, XRayTransitionData.LINE_DTYPE, XRayTransitionData.readLineRows))
+
+            XRayTransitionData._tables.clear()
+            table = XRayTransitionData.readTable(filename, XRayTransitionData.LINE_DTYPE, XRayTransitionData.readLineRows)
+            self.assertIsInstance(table, np.memmap)
+            self.assertEqual(rows, table.tolist())
+
+            with open(filename, 'a') as csvFile:
+                csvFile.write('3,60.0,0.5,"Zz1"\n')
+            modificationTime = time.time() + 10.0
+            os.utime(filename, (modificationTime, modificationTime))
+
+            table = XRayTransitionData.readTable(filename, XRayTransitionData.LINE_DTYPE, XRayTransitionData.readLineRows)
+            self.assertEqual(len(rows) + 1, len(table))
+            self.assertEqual((3, 60.0, 0.5, "Zz1"), table[-1].tolist())
+
+            newCacheFilenames = [name for name in os.listdir(cachePath) if name.endswith(".npy")]
+            self.assertEqual(1, len(newCacheFilenames))
+            self.assertNotEqual(cacheFilenames, newCacheFilenames)
+
+            # The temporary directory is used when the user cache directory cannot be written.
+            XRayTransitionData._tables.clear()
+            os.environ[XRayTransitionData.CACHE_PATH_VARIABLE] = os.path.join(filename, "cache")
+            temporaryPath = tempfile.tempdir
+            tempfile.tempdir = os.path.join(path, "tmp")
+            os.makedirs(tempfile.tempdir)
+            try:
+                table = XRayTransitionData.readTable(filename, XRayTransitionData.LINE_DTYPE, XRayTransitionData.readLineRows)
+                self.assertEqual(len(rows) + 1, len(table))
+                self.assertEqual(newCacheFilenames, os.listdir(os.path.join(tempfile.tempdir, "xrayspectrumanalyzer")))
+            finally:
+                tempfile.tempdir = temporaryPath
+        finally:
+            del os.environ[XRayTransitionData.CACHE_PATH_VARIABLE]
+            XRayTransitionData._tables.clear()
+            shutil.rmtree(path)
+
+        # self.fail("Test if the TestCase is working.")
+
+
+    def testGetTransitionEnergies_eV(self):
+        atomicNumbers = [6, 6, 79, 79, 79, "Ti", "V"]
+        transitionNames = ['Ka1', 'Ka2', 'Ma2', 'Lb5', 'M3N1', 'Ka', 'Ka']
+        energies_eV = self.xrayData.getTransitionEnergies_eV(atomicNumbers, transitionNames)
+
+        self.assertEqual(len(transitionNames), len(energies_eV))
+        for atomicNumber, transitionName, energy_eV in zip(atomicNumbers, transitionNames, energies_eV):
+            self.assertEqual(self.xrayData.getTransitionEnergy_eV(atomicNumber, transitionName), energy_eV)
+
+        self.assertEqual([281.7700, 281.7700, 2117.9000, 11914.0000, 1980.8000, 4510.0, 4950.9], energies_eV.tolist())
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            energies_eV = self.xrayData.getTransitionEnergies_eV([6, 200], ['Ka1', 'Ka1'])
+        self.assertEqual([281.7700, 0.0], energies_eV.tolist())
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testGetTransitionFractions(self):
+        transitionNames = ['Ka1', 'Ka2', 'Mb', 'Lb1', 'M3N1']
+        fractions = self.xrayData.getTransitionFractions([6, 6, 79, 79, 79], transitionNames)
+
+        self.assertEqual([1.00000, 0.50000, 0.59443, 0.40151, 0.02901], fractions.tolist())
+        self.assertRaises(KeyError, self.xrayData.getTransitionFractions, [6, 6], ['Ka1', 'Lb1'])
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testExtractTransitionKey(self):
+        self.assertEqual('Ka1', self.xrayData.extractTransitionKey(6, 'Ka'))
+        self.assertEqual('Ka1', self.xrayData.extractTransitionKey(22, 'Ka'))
+        self.assertEqual('Zz', self.xrayData.extractTransitionKey(22, 'Zz'))
+        self.assertEqual(self.xrayData.getTransition(79)[0], self.xrayData.extractTransitionKey(79, ''))
+
+        # self.fail("Test if the TestCase is working.")
+
+
+    def testGetLinesInEnergyRange(self):
+        lines = self.xrayData.getLinesInEnergyRange(6380.0, 6410.0, [26])
+        self.assertEqual([(26, 'Ka2', 6390.1), (26, 'Ka1', 6403.0)], lines)
+
+        lines = self.xrayData.getLinesInEnergyRange(1739.0, 1740.0)
+        self.assertEqual([(14, 'Ka2', 1739.0), (14, 'Ka1', 1740.0)], lines)
+
+        lines = self.xrayData.getLinesInEnergyRange(0.0, 1.0e6)
+        self.assertEqual(len(self.xrayData.lineEnergyIndex), len(lines))
+        energies_eV = [energy_eV for _atomicNumber, _transition, energy_eV in lines]
+        self.assertEqual(sorted(energies_eV), energies_eV)
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testGetNearestLines(self):
+        lines = self.xrayData.getNearestLines(1740.2, 1.5)
+        self.assertEqual([(14, 'Ka1', 1740.0), (75, 'M3N1', 1741.3), (14, 'Ka2', 1739.0)], lines)
+
+        self.assertEqual([], self.xrayData.getNearestLines(1740.2, 15.0, [26]))
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testGetNearestEdges(self):
+        self.assertEqual([(14, 'K', 1838.8), (66, 'MII', 1841.7)], self.xrayData.getNearestEdges(1839.0, 5.0))
+        self.assertEqual([(6, 'K', 283.79)], self.xrayData.getEdgesInEnergyRange(280.0, 290.0, [6, 13]))
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testGetTransitionFromEnergy(self):
+        self.assertEqual('Ka1', self.xrayData.getTransitionFromEnergy(6, 281.0))
+        self.assertEqual('Ka1', self.xrayData.getTransitionFromEnergy(26, 6400.0))
+        self.assertEqual('Ka2', self.xrayData.getTransitionFromEnergy(26, 6388.0, limit_eV=5.0))
+        self.assertEqual(None, self.xrayData.getTransitionFromEnergy(26, 100.0))
+
+        self.assertEqual('K', self.xrayData.getSubshellFromEnergy(6, 290.0))
+        self.assertEqual(None, self.xrayData.getSubshellFromEnergy(6, 500.0))
+
+        # self.fail("Test if the TestCase is working.")
+
+    def testEnergyIndex(self):
+        energyIndex = XRayTransitionData.EnergyIndex([1, 2, 3, 4], ['a', 'b', 'c', 'd'], [30.0, 10.0, 20.0, 20.0])
+        self.assertEqual([10.0, 20.0, 20.0, 30.0], energyIndex.energies_eV.tolist())
+        self.assertEqual([1, 2, 3, 0], energyIndex.order.tolist())
+
+        starts, stops = energyIndex.getRangeBounds(np.array([0.0, 15.0, 20.0]), np.array([5.0, 25.0, 20.0]))
+        self.assertEqual([0, 1, 1], starts.tolist())
+        self.assertEqual([0, 3, 3], stops.tolist())
+
+        starts, stops = energyIndex.getRangeBounds(20.0, 20.0, isOpen=True)
+        self.assertEqual(stops, starts)
+
+        self.assertEqual([(3, 'c', 20.0)], energyIndex.getEntries(energyIndex.getIndicesInRange(15.0, 25.0, [3])))
+
+        # self.fail("Test if the TestCase is working.")
+
 
 if __name__ == '__main__':  # pragma: no cover
     import nose
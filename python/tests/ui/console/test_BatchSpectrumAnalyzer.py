@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: tests.ui.console.test_BatchSpectrumAnalyzer
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Tests for the module `BatchSpectrumAnalyzer`.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import unittest
+import os
+import tempfile
+import shutil
+import csv
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+import xrayspectrumanalyzer.ui.console.BatchSpectrumAnalyzer as BatchSpectrumAnalyzer
+import xrayspectrumanalyzer.ui.console.SpectrumAnalyzer as SpectrumAnalyzer
+
+# Globals and constants variables.
+
+class TestBatchSpectrumAnalyzer(unittest.TestCase):
+    """
+    TestCase class for the module `BatchSpectrumAnalyzer`.
+    """
+
+    def setUp(self):
+        """
+        Setup method.
+        """
+
+        unittest.TestCase.setUp(self)
+
+        self.path = tempfile.mkdtemp()
+        self.outputPath = os.path.join(self.path, "output")
+
+        self.spectrumFilepaths = []
+        for index, siliconArea in enumerate([5000.0, 2000.0, 800.0]):
+            spectrumFilepath = os.path.join(self.path, "spectrum%i.msa" % (index))
+            self._writeSpectrum(spectrumFilepath, siliconArea)
+            self.spectrumFilepaths.append(spectrumFilepath)
+
+        self.badSpectrumFilepath = os.path.join(self.path, "spectrumBad.msa")
+
+    def tearDown(self):
+        """
+        Teardown method.
+        """
+
+        unittest.TestCase.tearDown(self)
+
+        shutil.rmtree(self.path)
+
+    def _writeSpectrum(self, spectrumFilepath, siliconArea):
+        xData = np.arange(1, 401)*0.01
+        sigma_keV = SpectrumAnalyzer.DetectorFunction(40.0, 0.12).getSigma_keV(1.74)
+        yData = 100.0 - 10.0*xData + siliconArea*np.exp(-(xData - 1.74)**2/(2.0*sigma_keV**2))
+
+        keywords = [("FORMAT", "EMSA/MAS Spectral Data File"), ("VERSION", "1.0"), ("TITLE", "Si"),
+                    ("DATE", "01-JAN-2016"), ("TIME", "00:00"), ("OWNER", "test"),
+                    ("NPOINTS", "%i" % len(xData)), ("NCOLUMNS", "1"), ("XUNITS", "keV"), ("YUNITS", "counts"),
+                    ("DATATYPE", "XY"), ("XPERCHAN", "0.01"), ("OFFSET", "0.0"), ("SPECTRUM", "")]
+
+        with open(spectrumFilepath, 'w') as spectrumFile:
+            for keyword, value in keywords:
+                spectrumFile.write("#%-12s: %s\n" % (keyword, value))
+            for x, y in zip(xData, yData):
+                spectrumFile.write("%f, %f\n" % (x, y))
+            spectrumFile.write("#%-12s: \n" % ("ENDOFDATA"))
+
+    def _createBatchSpectrumAnalyzer(self, numberWorkers):
+        batchSpectrumAnalyzer = BatchSpectrumAnalyzer.BatchSpectrumAnalyzer(self.outputPath, numberWorkers=numberWorkers)
+        batchSpectrumAnalyzer.addElement("Si")
+        batchSpectrumAnalyzer.setDetector(40.0, 0.12)
+        batchSpectrumAnalyzer.addRoi("Roi Si", (1.6, 1.9))
+
+        return batchSpectrumAnalyzer
+
+    def testSkeleton(self):
+        """
+        First test to check if the testcase is working with the testing framework.
+        """
+
+        #self.fail("Test if the testcase is working.")
+        self.assertTrue(True)
+
+    def test_Analyze(self):
+        spectrumFilepaths = [self.spectrumFilepaths[0], self.badSpectrumFilepath] + self.spectrumFilepaths[1:]
+
+        results = {}
+        for numberWorkers in [1, 2]:
+            batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(numberWorkers)
+            rows = batchSpectrumAnalyzer.analyze(spectrumFilepaths)
+
+            self.assertEqual(self.spectrumFilepaths, [row[0] for row in rows])
+            self.assertEqual(["Si Ka1"]*3, [row[1] for row in rows])
+            self.assertEqual([self.badSpectrumFilepath], list(batchSpectrumAnalyzer.errors))
+
+            counts = [row[2] for row in rows]
+            self.assertGreater(counts[0], counts[1])
+            self.assertGreater(counts[1], counts[2])
+            results[numberWorkers] = rows
+
+        np.testing.assert_allclose([row[2:] for row in results[1]], [row[2:] for row in results[2]])
+
+        with open(os.path.join(self.outputPath, "PeakIntensities.csv")) as resultsFile:
+            lines = list(csv.reader(resultsFile))
+        self.assertEqual(["Spectrum"] + SpectrumAnalyzer.PEAK_INTENSITIES_HEADER, lines[0])
+        self.assertEqual(4, len(lines))
+
+        with open(os.path.join(self.outputPath, "Errors.csv")) as errorsFile:
+            lines = list(csv.reader(errorsFile))
+        self.assertEqual(2, len(lines))
+        self.assertEqual(self.badSpectrumFilepath, lines[1][0])
+
+        self.assertEqual(["Errors.csv", "PeakIntensities.csv"], sorted(os.listdir(self.outputPath)))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeReuseAnalyzer(self):
+        batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(1)
+        configuration = batchSpectrumAnalyzer.getConfiguration()
+
+        originalCreateSpectrumAnalyzer = BatchSpectrumAnalyzer.createSpectrumAnalyzer
+        calls = []
+        def createSpectrumAnalyzer(*args, **kwargs):
+            calls.append(args)
+            return originalCreateSpectrumAnalyzer(*args, **kwargs)
+        BatchSpectrumAnalyzer.createSpectrumAnalyzer = createSpectrumAnalyzer
+        try:
+            results = list(batchSpectrumAnalyzer._analyzeSpectra(configuration, self.spectrumFilepaths))
+        finally:
+            BatchSpectrumAnalyzer.createSpectrumAnalyzer = originalCreateSpectrumAnalyzer
+        self.assertEqual(1, len(calls))
+
+        for spectrumFilepath, (peakIntensityTable, error) in zip(self.spectrumFilepaths, results):
+            self.assertIsNone(error)
+            peakIntensityTableRef, errorRef = BatchSpectrumAnalyzer.analyzeSpectrum(configuration, spectrumFilepath)
+            self.assertIsNone(errorRef)
+            self.assertEqual(list(peakIntensityTableRef.labels), list(peakIntensityTable.labels))
+            np.testing.assert_allclose(peakIntensityTableRef.getRow(0)[1:], peakIntensityTable.getRow(0)[1:])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzePendingSpectra(self):
+        batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(2)
+        spectrumFilepaths = self.spectrumFilepaths*4
+        configuration = batchSpectrumAnalyzer.getConfiguration()
+
+        submittedFilepaths = []
+        def iterSpectrumFilepaths():
+            for spectrumFilepath in spectrumFilepaths:
+                submittedFilepaths.append(spectrumFilepath)
+                yield spectrumFilepath
+
+        results = batchSpectrumAnalyzer._analyzeSpectra(configuration, iterSpectrumFilepaths())
+        self.assertIsNone(next(results)[1])
+        self.assertEqual(2*BatchSpectrumAnalyzer.PENDING_SPECTRA_PER_WORKER + 1, len(submittedFilepaths))
+
+        results = list(results)
+        self.assertEqual(len(spectrumFilepaths) - 1, len(results))
+        self.assertEqual([None]*len(results), [error for peakIntensityTable, error in results])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeIter(self):
+        batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(1)
+        resultsFilepath = os.path.join(self.outputPath, "PeakIntensities.csv")
+
+        results = batchSpectrumAnalyzer.analyzeIter(self.spectrumFilepaths + [self.badSpectrumFilepath])
+        spectrumFilepath, peakIntensityTable, error = next(results)
+        self.assertEqual(self.spectrumFilepaths[0], spectrumFilepath)
+        self.assertEqual(["Si Ka1"], list(peakIntensityTable.labels))
+        self.assertIsNone(error)
+        with open(resultsFilepath) as resultsFile:
+            lines = list(csv.reader(resultsFile))
+        self.assertEqual(2, len(lines))
+        self.assertEqual([spectrumFilepath, "Si Ka1"], lines[1][:2])
+
+        results = list(results)
+        self.assertEqual(self.spectrumFilepaths[1:] + [self.badSpectrumFilepath], [result[0] for result in results])
+        self.assertEqual(0, len(results[-1][1]))
+        self.assertIsNotNone(results[-1][2])
+        with open(resultsFilepath) as resultsFile:
+            lines = list(csv.reader(resultsFile))
+        self.assertEqual(4, len(lines))
+        self.assertTrue(os.path.exists(os.path.join(self.outputPath, "Errors.csv")))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitResultCache(self):
+        batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(2)
+        batchSpectrumAnalyzer.fitResultCachePath = os.path.join(self.path, "cache")
+        rows = batchSpectrumAnalyzer.analyze(self.spectrumFilepaths)
+        self.assertEqual(3, len(os.listdir(os.path.join(self.path, "cache"))))
+
+        rowsCached = batchSpectrumAnalyzer.analyze(self.spectrumFilepaths)
+        self.assertEqual(rows, rowsCached)
+        self.assertEqual(3, len(os.listdir(os.path.join(self.path, "cache"))))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeGlob(self):
+        batchSpectrumAnalyzer = self._createBatchSpectrumAnalyzer(1)
+        rows = batchSpectrumAnalyzer.analyze(os.path.join(self.path, "spectrum[0-9].msa"))
+
+        self.assertEqual(self.spectrumFilepaths, [row[0] for row in rows])
+        self.assertEqual({}, batchSpectrumAnalyzer.errors)
+        self.assertFalse(os.path.exists(os.path.join(self.outputPath, "Errors.csv")))
+
+        #self.fail("Test if the testcase is working.")
+
+if __name__ == '__main__':  #pragma: no cover
+    import nose
+    nose.runmodule()
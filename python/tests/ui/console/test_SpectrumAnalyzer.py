@@ -24,16 +24,28 @@ Tests for the module `SpectrumAnalyzer`.
 
 # Standard library modules.
 import unittest
+import os
 import logging
+import tempfile
+import shutil
+import pickle
+import csv
+import json
 
 # Third party modules.
+import numpy as np
 
 # Local modules.
 
 # Project modules
-import xrayspectrumanalyzer.ui.console.SpectrumAnalyzer
+import xrayspectrumanalyzer.ui.console.SpectrumAnalyzer as SpectrumAnalyzer
+import xrayspectrumanalyzer.ui.console.XrayLineReferenceManager as XrayLineReferenceManager
+import xrayspectrumanalyzer.tools.FitMultiGaussianFunction as FitMultiGaussianFunction
+import xrayspectrumanalyzer.tools.SpectrumCube as SpectrumCube
+import xrayspectrumanalyzer.tools.FitResultCache as FitResultCache
 
 # Globals and constants variables.
+ROIS = {"Roi O": (0.4, 0.65), "Roi Si": (1.6, 1.9), "Roi Background": (3.0, 3.5)}
 
 class TestSpectrumAnalyzer(unittest.TestCase):
     """
@@ -47,6 +59,13 @@ class TestSpectrumAnalyzer(unittest.TestCase):
 
         unittest.TestCase.setUp(self)
 
+        self.path = tempfile.mkdtemp()
+        self.outputPath = os.path.join(self.path, "output")
+        os.makedirs(self.outputPath)
+
+        self.xData, self.yData = self._createSpectrum()
+        self.spectrumFilepath = self._writeSpectrum(self.xData, self.yData)
+
     def tearDown(self):
         """
         Teardown method.
@@ -54,6 +73,53 @@ class TestSpectrumAnalyzer(unittest.TestCase):
 
         unittest.TestCase.tearDown(self)
 
+        shutil.rmtree(self.path)
+
+    def _createSpectrumAnalyzer(self, roiLabels=(), headless=True):
+        """
+        Return an analyzer of the Si and O lines of the synthetic spectrum, with the ROIs of :data:`ROIS` in `roiLabels`.
+        """
+        spectrumAnalyzer = SpectrumAnalyzer.SpectrumAnalyzer(outputPath=self.outputPath, headless=headless)
+        spectrumAnalyzer.addElement("Si")
+        spectrumAnalyzer.addElement("O")
+        spectrumAnalyzer.setDetector(40.0, 0.12)
+        for roiLabel in roiLabels:
+            spectrumAnalyzer.addRoi(roiLabel, ROIS[roiLabel])
+
+        return spectrumAnalyzer
+
+    def _createSpectrum(self):
+        lineReferenceManager = XrayLineReferenceManager.XrayLineReferenceManager()
+        lineReferenceManager.addElement("Si")
+        lineReferenceManager.addElement("O")
+
+        xData = np.arange(1, 401)/100.0
+        yData = 100.0 - 10.0*xData
+        detector = SpectrumAnalyzer.DetectorFunction(40.0, 0.12)
+        for position_keV, fraction, _label in lineReferenceManager.getMajorLines():
+            sigma_keV = detector.getSigma_keV(position_keV)
+            yData += 5000.0*fraction*np.exp(-(xData - position_keV)**2/(2.0*sigma_keV**2))
+
+        # Integer counts, the spectrum written by _writeSpectrum is read back unchanged.
+        return xData, np.round(yData)
+
+    def _writeSpectrum(self, xData, yData, filename="synthetic.msa"):
+        spectrumFilepath = os.path.join(self.path, filename)
+
+        keywords = [("FORMAT", "EMSA/MAS Spectral Data File"), ("VERSION", "1.0"), ("TITLE", "Synthetic"),
+                    ("DATE", "01-JAN-2016"), ("TIME", "00:00"), ("OWNER", "test"),
+                    ("NPOINTS", "%i" % len(xData)), ("NCOLUMNS", "1"), ("XUNITS", "keV"), ("YUNITS", "counts"),
+                    ("DATATYPE", "XY"), ("XPERCHAN", "%f" % (xData[1] - xData[0])), ("OFFSET", "%f" % (xData[0])), ("SPECTRUM", "")]
+
+        with open(spectrumFilepath, 'w') as spectrumFile:
+            for keyword, value in keywords:
+                spectrumFile.write("#%-12s: %s\n" % (keyword, value))
+            for x, y in zip(xData, yData):
+                spectrumFile.write("%.6f, %.6f\n" % (x, y))
+            spectrumFile.write("#%-12s: \n" % ("ENDOFDATA"))
+
+        return spectrumFilepath
+
     def testSkeleton(self):
         """
         First test to check if the testcase is working with the testing framework.
@@ -62,6 +128,673 @@ class TestSpectrumAnalyzer(unittest.TestCase):
         #self.fail("Test if the testcase is working.")
         self.assert_(True)
 
+    def test_DetectorFunctionSigmaDerivatives(self):
+        electronicNoise_eV = 40.0
+        FanoFactor = 0.12
+        xrayEnergy_keV = 1.74
+        detector = SpectrumAnalyzer.DetectorFunction(electronicNoise_eV, FanoFactor)
+        derivatives = detector.getSigmaDerivatives_keV(xrayEnergy_keV)
+
+        step = 1.0e-6
+        sigmasPlus = [SpectrumAnalyzer.DetectorFunction(electronicNoise_eV + step, FanoFactor).getSigma_keV(xrayEnergy_keV),
+                      SpectrumAnalyzer.DetectorFunction(electronicNoise_eV, FanoFactor + step).getSigma_keV(xrayEnergy_keV),
+                      detector.getSigma_keV(xrayEnergy_keV + step)]
+        sigmasMinus = [SpectrumAnalyzer.DetectorFunction(electronicNoise_eV - step, FanoFactor).getSigma_keV(xrayEnergy_keV),
+                       SpectrumAnalyzer.DetectorFunction(electronicNoise_eV, FanoFactor - step).getSigma_keV(xrayEnergy_keV),
+                       detector.getSigma_keV(xrayEnergy_keV - step)]
+
+        for derivative, sigmaPlus, sigmaMinus in zip(derivatives, sigmasPlus, sigmasMinus):
+            self.assertAlmostEqual((sigmaPlus - sigmaMinus)/(2.0*step), derivative, places=6)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_DetectorFunctionArrays(self):
+        xrayEnergies_keV = np.array([0.525, 1.74, 6.4])
+        electronicNoises_eV = np.array([30.0, 40.0])
+        detector = SpectrumAnalyzer.DetectorFunction(electronicNoises_eV[:, np.newaxis], 0.12)
+
+        sigmas_keV = detector.getSigma_keV(xrayEnergies_keV)
+        derivatives = detector.getSigmaDerivatives_keV(xrayEnergies_keV)
+        self.assertEqual((2, 3), sigmas_keV.shape)
+        for indexNoise, electronicNoise_eV in enumerate(electronicNoises_eV):
+            detectorScalar = SpectrumAnalyzer.DetectorFunction(electronicNoise_eV, 0.12)
+            for indexEnergy, xrayEnergy_keV in enumerate(xrayEnergies_keV):
+                self.assertEqual(detectorScalar.getSigma_keV(xrayEnergy_keV), sigmas_keV[indexNoise, indexEnergy])
+                for derivative, derivativeScalar in zip(derivatives, detectorScalar.getSigmaDerivatives_keV(xrayEnergy_keV)):
+                    self.assertEqual(derivativeScalar, np.broadcast_to(derivative, (2, 3))[indexNoise, indexEnergy])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_RoiData(self):
+        roi = SpectrumAnalyzer.Roi("Roi Si", (1.6, 1.9))
+        xData = np.arange(1, 401)*0.01
+        yData = 100.0 - 10.0*xData
+
+        xRoi, yRoi = roi.getRoiData(xData, yData)
+        maskArray = np.ma.masked_outside(xData, 1.6, 1.9)
+        np.testing.assert_array_equal(xData[~maskArray.mask], xRoi)
+        np.testing.assert_array_equal(yData[~maskArray.mask], yRoi)
+        self.assertTrue(np.shares_memory(xData, xRoi))
+        self.assertTrue(np.shares_memory(yData, yRoi))
+
+        peakIntensity = SpectrumAnalyzer.PeakIntensity(xRoi, yRoi, np.ones_like(yRoi), 1.74, 0.03, "Si Ka1")
+        maskArray = np.ma.masked_outside(xRoi, 1.74 - 0.05, 1.74 + 0.05)
+        self.assertAlmostEqual(np.sum(yRoi[~maskArray.mask]), peakIntensity.countsFromFixedWidth(0.1))
+        self.assertAlmostEqual(np.sum(~maskArray.mask), peakIntensity.countsBackgroundFromFixedWidth(0.1))
+
+        yBackground = np.ones_like(yRoi)
+        model = FitMultiGaussianFunction.MultiGaussianFunction([500.0, 1000.0], [1.70, 1.74], [0.03, 0.03])
+        peakCurves = SpectrumAnalyzer.RoiPeakCurves(xRoi, yBackground, model)
+        peakIntensity = SpectrumAnalyzer.PeakIntensity(xRoi, None, yBackground, 1.74, 0.03, "Si Ka1", peakCurves, 1)
+        self.assertIs(xRoi, peakIntensity.xData)
+        self.assertIs(yBackground, peakIntensity.yBackground)
+        yPeak = model.peaks(xRoi)[1]
+        np.testing.assert_array_equal(yPeak, peakIntensity.yData)
+        self.assertAlmostEqual(np.sum(yPeak), peakIntensity.counts)
+        self.assertAlmostEqual(np.sum(yPeak[~maskArray.mask]), peakIntensity.countsFromFixedWidth(0.1))
+        self.assertAlmostEqual(np.sum(~maskArray.mask), peakIntensity.countsBackgroundFromFixedWidth(0.1))
+        self.assertFalse(hasattr(peakIntensity, "__dict__"))
+
+        peakIntensity.yBackground = 2.0*yBackground
+        np.testing.assert_array_equal(yPeak, peakIntensity.yData)
+        self.assertAlmostEqual(2.0*np.sum(~maskArray.mask), peakIntensity.countsBackgroundFromFixedWidth(0.1))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_PeakIntensityTable(self):
+        xRoi = np.arange(160, 191)*0.01
+        yBackground = np.ones_like(xRoi)
+        model = FitMultiGaussianFunction.MultiGaussianFunction([500.0, 1000.0], [1.70, 1.74], [0.03, 0.03])
+        peakCurves = SpectrumAnalyzer.RoiPeakCurves(xRoi, yBackground, model)
+        peakIntensities = [SpectrumAnalyzer.PeakIntensity(xRoi, None, yBackground, position_keV, 0.03, label, peakCurves, index)
+                           for index, (position_keV, label) in enumerate([(1.70, "Si Ka2"), (1.74, "Si Ka1")])]
+
+        table = SpectrumAnalyzer.createPeakIntensityTable(peakIntensities)
+        self.assertEqual(2, len(table))
+        self.assertEqual(["Si Ka2", "Si Ka1"], list(table.labels))
+        for index, peakIntensity in enumerate(peakIntensities):
+            row = SpectrumAnalyzer.getPeakIntensityRow(peakIntensity)
+            self.assertEqual(row[0], table.getRow(index)[0])
+            np.testing.assert_allclose(row[1:], table.getRow(index)[1:])
+        self.assertEqual(len(SpectrumAnalyzer.PEAK_INTENSITIES_HEADER), len(table.getRows()[0]))
+
+        table = pickle.loads(pickle.dumps(table))
+        self.assertEqual(["Si Ka2", "Si Ka1"], list(table.labels))
+
+        peakIntensities = pickle.loads(pickle.dumps(peakIntensities))
+        self.assertIs(peakIntensities[0].yBackground, peakIntensities[1].yBackground)
+        np.testing.assert_array_equal(model.peaks(xRoi)[0], peakIntensities[0].yData)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_PeakIntensityWriter(self):
+        xRoi = np.arange(160, 191)*0.01
+        yBackground = np.ones_like(xRoi)
+        model = FitMultiGaussianFunction.MultiGaussianFunction([500.0, 1000.0], [1.70, 1.74], [0.03, 0.03])
+        peakCurves = SpectrumAnalyzer.RoiPeakCurves(xRoi, yBackground, model)
+        peakIntensities = [SpectrumAnalyzer.PeakIntensity(xRoi, None, yBackground, position_keV, 0.03, label, peakCurves, index)
+                           for index, (position_keV, label) in enumerate([(1.70, "Si Ka2"), (1.74, "Si Ka1")])]
+
+        filepath = os.path.join(self.outputPath, "results.csv")
+        with SpectrumAnalyzer.PeakIntensityWriter(filepath, ["Spectrum"] + SpectrumAnalyzer.PEAK_INTENSITIES_HEADER) as writer:
+            writer.writePeakIntensities(peakIntensities[:1], prefix=["spectrum1"])
+            with open(filepath) as resultsFile:
+                lines = list(csv.reader(resultsFile))
+            self.assertEqual(2, len(lines))
+            self.assertEqual(["spectrum1", "Si Ka2"], lines[1][:2])
+
+            writer.writePeakIntensities(peakIntensities, prefix=["spectrum2"])
+            self.assertEqual(3, writer.numberRows)
+
+        with open(filepath) as resultsFile:
+            lines = list(csv.reader(resultsFile))
+        self.assertEqual(["Spectrum"] + SpectrumAnalyzer.PEAK_INTENSITIES_HEADER, lines[0])
+        self.assertEqual(["spectrum2", "Si Ka1"], lines[3][:2])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitSpectrumPeaks(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        spectrumAnalyzer.fitMethod = SpectrumAnalyzer.FIT_METHOD_SPECTRUM
+
+        peakIntensities = spectrumAnalyzer.fitSpectrumData(self.xData, self.yData)
+        labels = [peakIntensity.label for peakIntensity in peakIntensities]
+        self.assertIn("Si Ka1", labels)
+        self.assertIn("O Ka1", labels)
+
+        for peakIntensity in peakIntensities:
+            if peakIntensity.label == "Si Ka1":
+                self.assertAlmostEqual(1.74, peakIntensity.position_keV, delta=0.01)
+
+        self.assertEqual([(SpectrumAnalyzer.ROI_SPECTRUM, labels)],
+                         [(roiLabel, [peakIntensity.label for peakIntensity in peakIntensitiesRoi])
+                          for roiLabel, peakIntensitiesRoi in spectrumAnalyzer.fitSpectrumIter(self.spectrumFilepath)])
+        peakIntensities = spectrumAnalyzer.fitRoi("Roi Si")
+        self.assertEqual(["Si Ka1"], [peakIntensity.label for peakIntensity in peakIntensities])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_Headless(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+
+        peakIntensities = spectrumAnalyzer.fitSpectrum(self.spectrumFilepath)
+        self.assertEqual(["Si Ka1"], [peakIntensity.label for peakIntensity in peakIntensities])
+        self.assertEqual([], os.listdir(self.outputPath))
+
+        spectrumAnalyzer.saveFitFigures()
+        self.assertEqual(["synthetic_Roi_Si.png"], os.listdir(self.outputPath))
+
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi O"], headless=False)
+        spectrumAnalyzer.analyze(self.spectrumFilepath)
+        self.assertEqual(["synthetic.csv", "synthetic_Roi_O.png", "synthetic_Roi_Si.png"], sorted(os.listdir(self.outputPath)))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_ExportRois(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"], headless=False)
+        spectrumAnalyzer.exportRois = True
+        spectrumAnalyzer.fitSpectrum(self.spectrumFilepath)
+
+        # One file for each line of the figure.
+        dataFilenames = sorted(filename for filename in os.listdir(self.outputPath) if filename.endswith(".csv"))
+        self.assertEqual(["synthetic_Roi_Si_axe0_Data.csv", "synthetic_Roi_Si_axe0_Fit LB.csv", "synthetic_Roi_Si_axe0_Fit Si Ka1.csv",
+                          "synthetic_Roi_Si_axe0_Fit.csv", "synthetic_Roi_Si_axe1_Residual.csv"], dataFilenames)
+        with open(os.path.join(self.outputPath, "synthetic_Roi_Si_axe0_Data.csv")) as dataFile:
+            rows = list(csv.reader(dataFile))
+        self.assertEqual(["X", "Y"], rows[0])
+        xRoi, yRoi = SpectrumAnalyzer.Roi("Roi Si", ROIS["Roi Si"]).getRoiData(self.xData, self.yData)
+        np.testing.assert_allclose(np.array([xRoi, yRoi]).T, np.array(rows[1:], dtype=float))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitRoisParallel(self):
+        roiNames = ["Roi O", "Roi Si", "Roi Background"]
+        spectrumFilepathOther = self._writeSpectrum(self.xData, 2.0*self.yData, "synthetic2.msa")
+        results = {}
+        for numberRoiWorkers in [1, 2]:
+            spectrumAnalyzer = self._createSpectrumAnalyzer(roiNames)
+            spectrumAnalyzer.numberRoiWorkers = numberRoiWorkers
+
+            peakIntensitiesIter = spectrumAnalyzer.fitSpectrumIter(self.spectrumFilepath)
+            roiLabel, peakIntensities = next(peakIntensitiesIter)
+            self.assertEqual(("Roi O", ["O Ka1"]), (roiLabel, [peakIntensity.label for peakIntensity in peakIntensities]))
+            peakIntensitiesIter.close()
+
+            peakIntensitiesRois = list(spectrumAnalyzer.fitSpectrumIter(self.spectrumFilepath))
+            self.assertEqual([("Roi O", ["O Ka1"]), ("Roi Si", ["Si Ka1"]), ("Roi Background", [])],
+                             [(roiLabel, [peakIntensity.label for peakIntensity in peakIntensities]) for roiLabel, peakIntensities in peakIntensitiesRois])
+            self.assertEqual(numberRoiWorkers, spectrumAnalyzer.numberRoiWorkers)
+
+            # The fits done by the workers are kept for their figures.
+            spectrumAnalyzer.saveFitFigures()
+            self.assertEqual(["synthetic_Roi_Background.png", "synthetic_Roi_O.png", "synthetic_Roi_Si.png"], sorted(os.listdir(self.outputPath)))
+            for filename in os.listdir(self.outputPath):
+                os.remove(os.path.join(self.outputPath, filename))
+
+            results[numberRoiWorkers] = [[peakIntensity.counts for peakIntensity in peakIntensities] for _roiLabel, peakIntensities in peakIntensitiesRois]
+
+            if numberRoiWorkers == 1:
+                continue
+
+            # The pool of workers is kept for the next spectra, and created again for another configuration.
+            with spectrumAnalyzer:
+                executor = spectrumAnalyzer.getRoiExecutor()
+                spectrumAnalyzer.fitSpectrum(spectrumFilepathOther)
+                self.assertIs(executor, spectrumAnalyzer.getRoiExecutor())
+
+                spectrumAnalyzerCopy = pickle.loads(pickle.dumps(spectrumAnalyzer))
+                self.assertEqual(spectrumAnalyzer.getFitConfiguration(), spectrumAnalyzerCopy.getFitConfiguration())
+
+                spectrumAnalyzer.setDetector(45.0, 0.12)
+                spectrumAnalyzer.fitSpectrum(self.spectrumFilepath)
+                self.assertIsNot(executor, spectrumAnalyzer.getRoiExecutor())
+
+        self.assertEqual(results[1], results[2])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitBackend(self):
+        for fitMethod in [SpectrumAnalyzer.FIT_METHOD_PEAK, SpectrumAnalyzer.FIT_METHOD_PEAK_FAMILY, SpectrumAnalyzer.FIT_METHOD_ROI]:
+            results = {}
+            for fitBackend in [SpectrumAnalyzer.FIT_BACKEND_LMFIT, SpectrumAnalyzer.FIT_BACKEND_LEAST_SQUARES]:
+                spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+                spectrumAnalyzer.fitMethod = fitMethod
+                spectrumAnalyzer.fitBackend = fitBackend
+
+                peakIntensities = spectrumAnalyzer.fitSpectrumData(self.xData, self.yData)
+                results[fitBackend] = [[peakIntensity.counts, peakIntensity.countsBackground, peakIntensity.position_keV, peakIntensity.fwhm_eV]
+                                       for peakIntensity in peakIntensities]
+
+            np.testing.assert_allclose(results[SpectrumAnalyzer.FIT_BACKEND_LMFIT], results[SpectrumAnalyzer.FIT_BACKEND_LEAST_SQUARES],
+                                       rtol=1.0e-6, err_msg=fitMethod)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitPeaksProjection(self):
+        results = []
+        minimizeModel = SpectrumAnalyzer._minimizeModel
+        def minimizeModelResults(*args):
+            result = minimizeModel(*args)
+            results.append(result)
+            return result
+
+        numberSolves = []
+        solveLinearParameters = FitMultiGaussianFunction.MultiGaussianFunction.solveLinearParameters
+        def countSolveLinearParameters(model, *args):
+            numberSolves.append(1)
+            return solveLinearParameters(model, *args)
+
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        spectrumAnalyzer.fitMethod = SpectrumAnalyzer.FIT_METHOD_PEAK_PROJECTION
+        SpectrumAnalyzer._minimizeModel = minimizeModelResults
+        FitMultiGaussianFunction.MultiGaussianFunction.solveLinearParameters = countSolveLinearParameters
+        try:
+            peakIntensities = spectrumAnalyzer.fitSpectrumData(self.xData, self.yData)
+        finally:
+            SpectrumAnalyzer._minimizeModel = minimizeModel
+            FitMultiGaussianFunction.MultiGaussianFunction.solveLinearParameters = solveLinearParameters
+
+        self.assertEqual(["Si Ka1"], [peakIntensity.label for peakIntensity in peakIntensities])
+        self.assertAlmostEqual(1.74, peakIntensities[0].position_keV, delta=0.01)
+
+        # One linear solve for each trial, not one more for each Jacobian.
+        self.assertEqual(1, len(results))
+        self.assertLessEqual(len(numberSolves), results[0].nfev + 1)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitResultCache(self):
+        xData, yData = self.xData, self.yData
+        roi = SpectrumAnalyzer.Roi("Roi Si", ROIS["Roi Si"])
+        for fitMethod in [SpectrumAnalyzer.FIT_METHOD_PEAK, SpectrumAnalyzer.FIT_METHOD_SPECTRUM]:
+            cachePath = os.path.join(self.path, "cache_%s" % (fitMethod))
+            spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+            spectrumAnalyzer.fitMethod = fitMethod
+            spectrumAnalyzer.fitResultCache = FitResultCache.FitResultCache(cachePath)
+            expected = [(peakIntensity.label, peakIntensity.counts, peakIntensity.fwhm_eV) for peakIntensity in spectrumAnalyzer.fitSpectrum(self.spectrumFilepath)]
+            self.assertEqual(1, len(spectrumAnalyzer.fitResultCache))
+            self.assertEqual(0, spectrumAnalyzer.fitResultCache.numberHits)
+
+            # A hit gives the same peak intensities and ROI fit, without a fit.
+            spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si", "Roi O"] if fitMethod == SpectrumAnalyzer.FIT_METHOD_SPECTRUM else ["Roi Si"])
+            spectrumAnalyzer.fitMethod = fitMethod
+            spectrumAnalyzer.fitResultCache = FitResultCache.FitResultCache(cachePath)
+            peakIntensities = spectrumAnalyzer.fitSpectrum(self.spectrumFilepath)
+            self.assertEqual(expected, [(peakIntensity.label, peakIntensity.counts, peakIntensity.fwhm_eV) for peakIntensity in peakIntensities])
+            self.assertEqual(1, spectrumAnalyzer.fitResultCache.numberHits)
+            spectrumAnalyzer.saveFitFigures()
+            roiLabel = "Roi Si" if fitMethod == SpectrumAnalyzer.FIT_METHOD_PEAK else SpectrumAnalyzer.ROI_SPECTRUM
+            self.assertIn("synthetic_%s.png" % (roiLabel.replace(" ", "_")), os.listdir(self.outputPath))
+
+        # The whole spectrum is fitted once, for all the ROIs and for fitSpectrumData.
+        self.assertEqual(["O Ka1"], [peakIntensity.label for peakIntensity in spectrumAnalyzer.fitRoi("Roi O")])
+        self.assertIn("Si Ka1", [peakIntensity.label for peakIntensity in spectrumAnalyzer.fitSpectrumData(xData, yData)])
+        self.assertEqual(1, len(spectrumAnalyzer.fitResultCache))
+        self.assertEqual(3, spectrumAnalyzer.fitResultCache.numberHits)
+
+        key = spectrumAnalyzer.getFitResultKey(roi, xData, yData)
+        yDataOther = yData.copy()
+        yDataOther[0] += 1.0
+        self.assertNotEqual(key, spectrumAnalyzer.getFitResultKey(roi, xData, yDataOther))
+        spectrumAnalyzer.fitMethod = SpectrumAnalyzer.FIT_METHOD_PEAK
+        keyPeak = spectrumAnalyzer.getFitResultKey(roi, xData, yData)
+        self.assertNotEqual(key, keyPeak)
+        self.assertEqual(keyPeak, spectrumAnalyzer.getFitResultKey(roi, xData, yDataOther))
+        spectrumAnalyzer.setDetector(40.0, 0.13)
+        self.assertNotEqual(keyPeak, spectrumAnalyzer.getFitResultKey(roi, xData, yData))
+        spectrumAnalyzer.setDetector(40.0, 0.12)
+        spectrumAnalyzer.addOmittedPeak("O", "Ka")
+        self.assertEqual(keyPeak, spectrumAnalyzer.getFitResultKey(roi, xData, yData))
+        spectrumAnalyzer.addRequiredPeak("Si", "Kb1")
+        self.assertNotEqual(keyPeak, spectrumAnalyzer.getFitResultKey(roi, xData, yData))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitSpectraData(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        spectrumAnalyzer.addRoi("Roi O", (0.4, 0.6))
+        xData = self.xData
+        yDatas = np.round(np.linspace(0.5, 1.5, 5)[:, np.newaxis]*self.yData[np.newaxis, :])
+
+        expected = [[peakIntensity.counts for peakIntensity in spectrumAnalyzer.fitSpectrumData(xData, yData)] for yData in yDatas]
+        peakIntensitiesSpectra = spectrumAnalyzer.fitSpectraData(xData, yDatas)
+        np.testing.assert_allclose(expected, [[peakIntensity.counts for peakIntensity in peakIntensities] for peakIntensities in peakIntensitiesSpectra])
+
+        spectrumAnalyzer.fitBackend = SpectrumAnalyzer.FIT_BACKEND_BATCH
+        peakIntensitiesSpectra = spectrumAnalyzer.fitSpectraData(xData, yDatas)
+        self.assertEqual(5, len(peakIntensitiesSpectra))
+        self.assertEqual(["Si Ka1", "O Ka1"], [peakIntensity.label for peakIntensity in peakIntensitiesSpectra[0]])
+        np.testing.assert_allclose(expected, [[peakIntensity.counts for peakIntensity in peakIntensities] for peakIntensities in peakIntensitiesSpectra], rtol=1.0e-4)
+
+        spectrumAnalyzer.saveFitFigures()
+        self.assertEqual([], os.listdir(self.outputPath))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeSpectrumCube(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"], headless=False)
+        xData, yData = self.xData, self.yData
+        scales = np.linspace(0.5, 1.5, 4*6).reshape(4, 6)
+        data = np.round(scales[:, :, np.newaxis]*yData[np.newaxis, np.newaxis, :])
+        rplFilepath = os.path.join(self.path, "cube.rpl")
+        SpectrumCube.writeRplCube(rplFilepath, data.astype(np.float32), energyOffset_keV=xData[0], energyScale_keV=0.01)
+
+        peakIntensityMaps = spectrumAnalyzer.analyzeSpectrumCube(rplFilepath)
+        self.assertEqual(["Si Ka1"], peakIntensityMaps.labels)
+        self.assertEqual((4, 6), peakIntensityMaps.shape)
+        self.assertEqual(["cube_Si_Ka1.npy", "cube_tiles.json"], sorted(os.listdir(self.outputPath)))
+
+        siliconMap = np.load(os.path.join(self.outputPath, "cube_Si_Ka1.npy"))
+        self.assertEqual((4, 6), siliconMap.shape)
+        self.assertTrue(np.all(np.diff(siliconMap.ravel()) > 0.0))
+        peakIntensities = spectrumAnalyzer.fitSpectrumData(xData, data[1, 2])
+        np.testing.assert_allclose(peakIntensities[0].counts, siliconMap[1, 2], rtol=1.0e-6)
+
+        peakIntensityMaps = spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, binning=2)
+        binnedMap = np.load(os.path.join(self.outputPath, "cube_Si_Ka1.npy"))
+        self.assertEqual((2, 3), binnedMap.shape)
+        np.testing.assert_allclose(siliconMap.reshape(2, 2, 3, 2).sum(axis=(1, 3)), binnedMap, rtol=1.0e-3)
+
+        spectrumAnalyzer.fitBackend = SpectrumAnalyzer.FIT_BACKEND_BATCH
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath)
+        np.testing.assert_allclose(siliconMap, np.load(os.path.join(self.outputPath, "cube_Si_Ka1.npy")), rtol=1.0e-4)
+
+        # A line in two ROIs does not overwrite its map.
+        spectrumAnalyzer.addRoi("Roi Si narrow", (1.65, 1.85))
+        self.assertRaises(ValueError, spectrumAnalyzer.analyzeSpectrumCube, rplFilepath)
+        peakIntensityMaps = SpectrumAnalyzer.PeakIntensityMaps(self.outputPath, "other", (4, 6))
+        peakIntensity = SpectrumAnalyzer.PeakIntensity(xData, yData, np.zeros_like(yData), 1.74, 0.05, "Si Ka1")
+        self.assertRaises(ValueError, peakIntensityMaps.setPixel, 0, 0, [peakIntensity, peakIntensity])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_FitWithoutSpectrumFile(self):
+        spectrumAnalyzer = SpectrumAnalyzer.SpectrumAnalyzer(outputPath=self.outputPath)
+        spectrumAnalyzer.addElement("Si")
+        spectrumAnalyzer.setDetector(40.0, 0.12)
+        spectrumAnalyzer.addRoi("Roi Si", (1.6, 1.9))
+        xData, yData = self.xData, self.yData
+
+        # The fits of spectra given as arrays have no figure.
+        peakIntensities = spectrumAnalyzer.fitSpectrumData(xData, yData)
+        self.assertEqual(["Si Ka1"], [peakIntensity.label for peakIntensity in peakIntensities])
+        self.assertEqual(2, len(spectrumAnalyzer.fitSpectraData(xData, [yData, 2.0*yData])))
+        self.assertEqual([], os.listdir(self.outputPath))
+
+        data = np.round(np.linspace(0.5, 1.5, 2*3).reshape(2, 3, 1)*yData[np.newaxis, np.newaxis, :])
+        rplFilepath = os.path.join(self.path, "cube.rpl")
+        SpectrumCube.writeRplCube(rplFilepath, data.astype(np.float32), energyOffset_keV=xData[0], energyScale_keV=0.01)
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath)
+        self.assertEqual(["cube_Si_Ka1.npy", "cube_tiles.json"], sorted(os.listdir(self.outputPath)))
+        self.assertFalse(np.any(np.isnan(np.load(os.path.join(self.outputPath, "cube_Si_Ka1.npy")))))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeSpectrumCubeWindows(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        spectrumAnalyzer.addRoi("Roi Si narrow", (1.65, 1.85))
+        xData, yData = self.xData, self.yData
+        scales = np.linspace(0.5, 1.5, 5*6).reshape(5, 6)
+        data = np.round(scales[:, :, np.newaxis]*yData[np.newaxis, np.newaxis, :])
+        rplFilepath = os.path.join(self.path, "cube.rpl")
+        SpectrumCube.writeRplCube(rplFilepath, data.astype(np.float32), energyOffset_keV=xData[0], energyScale_keV=0.01)
+
+        windows_keV = spectrumAnalyzer.getLineWindows_keV()
+        self.assertEqual(["Si Ka1"], [label for label, _e1_keV, _e2_keV in windows_keV])
+        _label, e1_keV, e2_keV = windows_keV[0]
+        self.assertAlmostEqual(1.2*SpectrumAnalyzer.DetectorFunction(40.0, 0.12).getFwhm_eV(1.74e3)*1.0e-3, e2_keV - e1_keV, delta=1.0e-3)
+
+        peakIntensityMaps = spectrumAnalyzer.analyzeSpectrumCubeWindows(rplFilepath, tileSize=4)
+        self.assertEqual(["Si Ka1"], peakIntensityMaps.labels)
+        siliconMap = np.load(os.path.join(self.outputPath, "cube_window_Si_Ka1.npy"))
+        mask = (xData >= e1_keV) & (xData <= e2_keV)
+        np.testing.assert_allclose(np.sum(data[:, :, mask], axis=2), siliconMap)
+
+        windows_keV = [("Si", 1.6, 1.9), ("Low", 0.5, 1.0)]
+        spectrumAnalyzer.analyzeSpectrumCubeWindows(rplFilepath, windows_keV, binning=2, fractional=True)
+        lowMap = np.load(os.path.join(self.outputPath, "cube_window_Low.npy"))
+        self.assertEqual((2, 3), lowMap.shape)
+        counts = spectrumAnalyzer.integrateWindows(xData, data[:4, :6].reshape(2, 2, 3, 2, -1).sum(axis=(1, 3)), windows_keV, fractional=True)
+        np.testing.assert_allclose(counts[..., 1], lowMap)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_AnalyzeSpectrumCubeTiles(self):
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        xData, yData = self.xData, self.yData
+        scales = np.linspace(0.5, 1.5, 5*6).reshape(5, 6)
+        data = np.round(scales[:, :, np.newaxis]*yData[np.newaxis, np.newaxis, :])
+        rplFilepath = os.path.join(self.path, "cube.rpl")
+        SpectrumCube.writeRplCube(rplFilepath, data.astype(np.float32), energyOffset_keV=xData[0], energyScale_keV=0.01)
+        manifestFilepath = os.path.join(self.outputPath, "cube_tiles.json")
+        mapFilepath = os.path.join(self.outputPath, "cube_Si_Ka1.npy")
+
+        self.assertEqual(["Si Ka1"], spectrumAnalyzer.getPeakLabels(xData))
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, tileSize=4)
+        siliconMap = np.load(mapFilepath)
+        self.assertFalse(np.any(np.isnan(siliconMap)))
+        with open(manifestFilepath) as manifestFile:
+            content = json.load(manifestFile)
+        self.assertEqual(4, len(content["doneTiles"]))
+
+        # A job stopped after two tiles only fits the two other tiles when restarted.
+        content["doneTiles"] = [[0, 4, 0, 4], [4, 5, 0, 4]]
+        with open(manifestFilepath, 'w') as manifestFile:
+            json.dump(content, manifestFile)
+        intensityMap = np.load(mapFilepath, mmap_mode='r+')
+        intensityMap[:, 4:] = np.nan
+        intensityMap[0, 0] = -1.0
+        intensityMap.flush()
+        del intensityMap
+
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, tileSize=4)
+        resumedMap = np.load(mapFilepath)
+        self.assertEqual(-1.0, resumedMap[0, 0])
+        np.testing.assert_allclose(siliconMap[:, 4:], resumedMap[:, 4:])
+
+        # Another tile size is a new job, the tiles are fitted by the workers.
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, tileSize=3, numberWorkers=2)
+        np.testing.assert_allclose(siliconMap, np.load(mapFilepath))
+
+        # Another fit configuration is a new job, all the tiles are fitted again.
+        fittedTiles = []
+        fitSpectrumCubeTile = spectrumAnalyzer._fitSpectrumCubeTile
+        def countFitSpectrumCubeTile(cube, tile, *args):
+            fittedTiles.append(tile)
+            return fitSpectrumCubeTile(cube, tile, *args)
+        spectrumAnalyzer._fitSpectrumCubeTile = countFitSpectrumCubeTile
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, tileSize=3)
+        self.assertEqual([], fittedTiles)
+
+        intensityMap = np.load(mapFilepath, mmap_mode='r+')
+        intensityMap[0, 0] = -1.0
+        intensityMap.flush()
+        del intensityMap
+        spectrumAnalyzer.setDetector(45.0, 0.12)
+        spectrumAnalyzer.analyzeSpectrumCube(rplFilepath, tileSize=3)
+        self.assertEqual(SpectrumCube.getTiles((5, 6), 3), fittedTiles)
+        self.assertNotEqual(-1.0, np.load(mapFilepath)[0, 0])
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_RoiFitPlan(self):
+        roi = SpectrumAnalyzer.Roi("Roi Si", ROIS["Roi Si"])
+        for fitMethod in [SpectrumAnalyzer.FIT_METHOD_PEAK, SpectrumAnalyzer.FIT_METHOD_PEAK_PROJECTION,
+                          SpectrumAnalyzer.FIT_METHOD_PEAK_FAMILY, SpectrumAnalyzer.FIT_METHOD_ROI]:
+            spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+            spectrumAnalyzer.fitMethod = fitMethod
+            xData, yData = self.xData, self.yData
+
+            plan = spectrumAnalyzer.getRoiFitPlan(roi)
+            self.assertIs(plan, spectrumAnalyzer.getRoiFitPlan(roi))
+            self.assertEqual(["Si Ka1"], plan.labels)
+
+            countsExpected = [peakIntensity.counts for peakIntensity in spectrumAnalyzer.fitSpectrumData(xData, yData)]
+
+            # A pickled plan gives the same fit, and it is reused for another spectrum.
+            spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+            spectrumAnalyzer.fitMethod = fitMethod
+            spectrumAnalyzer.setRoiFitPlans({roi.label: pickle.loads(pickle.dumps(plan))})
+            counts = [peakIntensity.counts for peakIntensity in spectrumAnalyzer.fitSpectrumData(xData, yData)]
+            np.testing.assert_allclose(countsExpected, counts)
+
+            plan = spectrumAnalyzer.getRoiFitPlan(roi)
+            counts = [peakIntensity.counts for peakIntensity in spectrumAnalyzer.fitSpectrumData(xData, 2.0*yData)]
+            self.assertIs(plan, spectrumAnalyzer.getRoiFitPlan(roi))
+            np.testing.assert_allclose(2.0*np.array(countsExpected), counts, rtol=1.0e-4)
+
+        # The lines of the ROI are looked up again only after a change of the configuration.
+        roiPeaksCalls = []
+        getRoiPeaks = spectrumAnalyzer.getRoiPeaks
+        def countGetRoiPeaks(roi):
+            roiPeaksCalls.append(roi.label)
+            return getRoiPeaks(roi)
+        spectrumAnalyzer.getRoiPeaks = countGetRoiPeaks
+        for _index in range(3):
+            spectrumAnalyzer.fitSpectrumData(xData, yData)
+        self.assertEqual([], roiPeaksCalls)
+
+        # Only a change of the lines of the ROI compiles the plan again.
+        spectrumAnalyzer.addElement("Fe")
+        self.assertIs(plan, spectrumAnalyzer.getRoiFitPlan(roi))
+        self.assertIs(plan, spectrumAnalyzer.getRoiFitPlan(roi))
+        self.assertEqual(["Roi Si"], roiPeaksCalls)
+        spectrumAnalyzer.addRequiredPeak("Si", "Kb1")
+        self.assertIsNot(plan, spectrumAnalyzer.getRoiFitPlan(roi))
+        self.assertEqual(["Si Ka1", "Si Kb1"], spectrumAnalyzer.getRoiFitPlan(roi).labels)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_IncrementalAnalysis(self):
+        for numberRoiWorkers in [1, 2]:
+            spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si", "Roi O"])
+            spectrumAnalyzer.incrementalAnalysis = True
+            spectrumAnalyzer.numberRoiWorkers = numberRoiWorkers
+            spectrumFilepath = self.spectrumFilepath
+            spectrumFilepathOther = self._writeSpectrum(self.xData, 2.0*self.yData, "synthetic2.msa")
+
+            def getCounts(results):
+                return dict((roiLabel, [peakIntensity.counts for peakIntensity in peakIntensities]) for roiLabel, peakIntensities in results)
+
+            expected = getCounts(spectrumAnalyzer.analyzeIter(spectrumFilepath))
+            self.assertEqual(["Roi O", "Roi Si"], sorted(expected))
+
+            # The pool of workers is not used when less than two ROIs changed.
+            fittedRoiLabels = []
+            fitRoiData = spectrumAnalyzer._fitRoiData
+            def countFitRoiData(roi, *args):
+                fittedRoiLabels.append(roi.label)
+                return fitRoiData(roi, *args)
+            spectrumAnalyzer._fitRoiData = countFitRoiData
+
+            # Nothing changed, no ROI is fitted again.
+            self.assertEqual(expected, getCounts(spectrumAnalyzer.analyzeIter(spectrumFilepath)))
+            self.assertEqual([], fittedRoiLabels)
+
+            # The key of each ROI is computed once.
+            keyRoiLabels = []
+            getFitResultKey = spectrumAnalyzer.getFitResultKey
+            def countGetFitResultKey(roi, *args):
+                keyRoiLabels.append(roi.label)
+                return getFitResultKey(roi, *args)
+            spectrumAnalyzer.getFitResultKey = countGetFitResultKey
+            spectrumAnalyzer.analyze(spectrumFilepath)
+            self.assertEqual(["Roi O", "Roi Si"], sorted(keyRoiLabels))
+            del spectrumAnalyzer.getFitResultKey
+
+            # An element or an omitted peak without lines in a ROI does not change its fit.
+            spectrumAnalyzer.addElement("Ca")
+            spectrumAnalyzer.addOmittedPeak("Ca", "Ka")
+            spectrumAnalyzer.analyze(spectrumFilepath)
+            self.assertEqual([], fittedRoiLabels)
+
+            # Only the ROI with a new line is fitted again.
+            spectrumAnalyzer.addRequiredPeak("Si", "Kb1")
+            peakIntensitiesRois = dict(spectrumAnalyzer.analyzeIter(spectrumFilepath))
+            self.assertEqual(["Roi Si"], fittedRoiLabels)
+            self.assertEqual(["Si Ka1", "Si Kb1"], [peakIntensity.label for peakIntensity in peakIntensitiesRois["Roi Si"]])
+
+            # Only a new ROI is fitted.
+            spectrumAnalyzer.addRoi("Roi Background", ROIS["Roi Background"])
+            spectrumAnalyzer.analyze(spectrumFilepath)
+            self.assertEqual(["Roi Si", "Roi Background"], fittedRoiLabels)
+            with open(os.path.join(self.outputPath, "synthetic.csv")) as resultsFile:
+                self.assertEqual(["Line", "O Ka1", "Si Ka1", "Si Kb1"], sorted(row[0] for row in csv.reader(resultsFile)))
+
+            # Another spectrum is read and all its ROIs are fitted.
+            del spectrumAnalyzer._fitRoiData
+            counts = getCounts(spectrumAnalyzer.analyzeIter(spectrumFilepathOther))
+            np.testing.assert_allclose(2.0*np.array(expected["Roi O"]), counts["Roi O"], rtol=1.0e-3)
+            self.assertTrue(os.path.isfile(os.path.join(self.outputPath, "synthetic2.csv")))
+
+            # After a reset, all the ROIs are fitted again, here in this process.
+            spectrumAnalyzer.closeRoiWorkers()
+            spectrumAnalyzer.numberRoiWorkers = 1
+            spectrumAnalyzer._fitRoiData = countFitRoiData
+            del fittedRoiLabels[:]
+            spectrumAnalyzer.resetIncrementalAnalysis()
+            self.assertEqual(counts, getCounts(spectrumAnalyzer.analyzeIter(spectrumFilepathOther)))
+            self.assertEqual(["Roi Background", "Roi O", "Roi Si"], sorted(fittedRoiLabels))
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_WarmStart(self):
+        results = []
+        initialValues = []
+        minimizeModel = SpectrumAnalyzer._minimizeModel
+        def minimizeModelResults(parameters, *args):
+            initialValues.append([parameter.value for parameter in parameters.values()])
+            result = minimizeModel(parameters, *args)
+            results.append(result)
+            return result
+
+        def readCounts(spectrumFilepath):
+            filename, _extension = os.path.splitext(os.path.basename(spectrumFilepath))
+            with open(os.path.join(self.outputPath, filename + ".csv")) as resultsFile:
+                rows = list(csv.reader(resultsFile))
+            return float(rows[1][1])
+
+        spectrumAnalyzer = self._createSpectrumAnalyzer(["Roi Si"])
+        xData, yData = self.xData, self.yData
+        noise = np.random.RandomState(0).normal(0.0, 1.0, len(yData))*np.sqrt(yData)
+        spectrumFilepaths = [self._writeSpectrum(xData, yData, "series0.msa"),
+                             self._writeSpectrum(xData, 1.05*yData, "series1.msa"),
+                             self._writeSpectrum(xData, 1.05*yData + noise, "series2.msa"),
+                             self._writeSpectrum(xData, 1.1*yData, "series3.msa")]
+        countsCold = [spectrumAnalyzer.fitSpectrum(spectrumFilepath)[0].counts for spectrumFilepath in spectrumFilepaths]
+
+        SpectrumAnalyzer._minimizeModel = minimizeModelResults
+        try:
+            spectrumAnalyzer.warmStart = True
+            spectrumAnalyzer.analyzeSeries(spectrumFilepaths[:2])
+            self.assertEqual(2, len(results))
+
+            # The second spectrum starts from the fit of the first one.
+            self.assertAlmostEqual(1.0, readCounts(spectrumFilepaths[1])/countsCold[1], places=4)
+            self.assertLessEqual(results[1].nfev, results[0].nfev)
+
+            # The noisy spectrum fits worse than the previous one, its warm fit is done again from the guesses.
+            spectrumAnalyzer.analyzeSeries(spectrumFilepaths[2:3])
+            self.assertEqual(4, len(results))
+            self.assertEqual(countsCold[2], readCounts(spectrumFilepaths[2]))
+
+            # The next spectra all start from the fit of the reference spectrum.
+            spectrumAnalyzer.setWarmStartReference()
+            spectrumAnalyzer.analyzeSeries([spectrumFilepaths[3], spectrumFilepaths[1]])
+            self.assertEqual(6, len(results))
+            self.assertEqual(initialValues[4], initialValues[5])
+            self.assertNotEqual(initialValues[3], initialValues[4])
+
+            # The next spectrum starts again from the guesses.
+            spectrumAnalyzer.resetWarmStart()
+            spectrumAnalyzer.analyzeSeries(spectrumFilepaths[:1])
+            self.assertEqual(7, len(results))
+            self.assertEqual(initialValues[0], initialValues[6])
+        finally:
+            SpectrumAnalyzer._minimizeModel = minimizeModel
+
+        #self.fail("Test if the testcase is working.")
+
 if __name__ == '__main__':  #pragma: no cover
     import nose
     import sys
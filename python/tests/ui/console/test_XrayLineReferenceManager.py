@@ -31,7 +31,7 @@ import logging
 # Local modules.
 
 # Project modules
-import xrayspectrumanalyzer.ui.console.XrayLineReferenceManager
+import xrayspectrumanalyzer.ui.console.XrayLineReferenceManager as XrayLineReferenceManager
 
 # Globals and constants variables.
 
@@ -62,6 +62,50 @@ class TestXrayLineReferenceManager(unittest.TestCase):
         #self.fail("Test if the testcase is working.")
         self.assert_(True)
 
+    def test_GetMajorLines(self):
+        lineRefManager = XrayLineReferenceManager.XrayLineReferenceManager()
+        lineRefManager.addElement("Si")
+
+        majorLines = lineRefManager.getMajorLines()
+        self.assertEqual(["Si Ka1"], [label for _position_keV, _fraction, label in majorLines if label.startswith("Si Ka")])
+
+        # The positions of the lines of an element are at least 0.01 keV apart.
+        positions_keV = sorted(position_keV for position_keV, _fraction, _label in majorLines)
+        for position1_keV, position2_keV in zip(positions_keV[:-1], positions_keV[1:]):
+            self.assertGreaterEqual(position2_keV - position1_keV, XrayLineReferenceManager.MINIMUM_POSITION_DIFFERENCE_keV)
+
+        # The cached lines are not modified by the caller.
+        majorLines.append((0.0, 1.0, "n"))
+        self.assertEqual(len(majorLines) - 1, len(lineRefManager.getMajorLines()))
+
+        lineRefManager.addElement("O")
+        labels = [label for _position_keV, _fraction, label in lineRefManager.getMajorLines()]
+        self.assertIn("O Ka1", labels)
+        self.assertIn("Si Ka1", labels)
+
+        #self.fail("Test if the testcase is working.")
+
+    def test_GetPeakLinesInEnergyRange(self):
+        lineRefManager = XrayLineReferenceManager.XrayLineReferenceManager()
+        lineRefManager.addElement("Si")
+        lineRefManager.addElement("O")
+
+        requiredPeaks = [("Si", "Ka2")]
+        omittedPeaks = [("O", "Ka1")]
+        lines = lineRefManager.getMajorLines() + lineRefManager.getLines(requiredPeaks)
+        lines.remove(lineRefManager.getLines(omittedPeaks)[0])
+        self.assertEqual(lines, lineRefManager.getPeakLines(requiredPeaks, omittedPeaks))
+
+        for eMin_keV, eMax_keV in [(0.0, 30.0), (0.4, 0.6), (1.6, 1.9), (5.0, 10.0)]:
+            linesExpected = [line for line in lines if eMin_keV <= line[0] <= eMax_keV]
+            roiLines = lineRefManager.getPeakLinesInEnergyRange(eMin_keV, eMax_keV, requiredPeaks, omittedPeaks)
+            self.assertEqual(linesExpected, roiLines)
+
+        labels = [label for _position_keV, _fraction, label in lineRefManager.getPeakLinesInEnergyRange(1.6, 1.9, requiredPeaks)]
+        self.assertEqual(["Si Ka1", "Si Ka2"], labels)
+
+        #self.fail("Test if the testcase is working.")
+
 if __name__ == '__main__':  #pragma: no cover
     import nose
     import sys
@@ -17,12 +17,10 @@
 # Standard library modules.
 import os.path
 import logging
+import csv
 
 # Third party modules.
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy
-import matplotlib.mlab as mlab
 
 # Local modules.
 
@@ -64,7 +62,10 @@ def get_current_module_path(modulePath, relativePath=""):
 
 
 def saveFigureData(filepath, figure=None):
+    import matplotlib.lines
+
     if figure is None:
+        import matplotlib.pyplot as plt
         figure = plt.gcf()
 
     axes = figure.get_axes()
@@ -96,10 +97,10 @@ def saveLineData(filepath, line, iLine, axeLabel="", label=None, xLabel=None, yL
         label = "_" + label
 
     if xLabel is None:
-        xLabel = line.get_axes().get_xaxis().get_label().get_text()
+        xLabel = line.axes.get_xaxis().get_label().get_text()
 
     if yLabel is None:
-        yLabel = line.get_axes().get_yaxis().get_label().get_text()
+        yLabel = line.axes.get_yaxis().get_label().get_text()
 
     if len(xLabel) == 0:
         xLabel = 'X'
@@ -132,4 +133,7 @@ def saveDataRecord(recordData, filepath, hasExtension=True):
 
     createPath(os.path.dirname(filepath))
 
-    mlab.rec2csv(recordData, filepath)
+    with open(filepath, 'w', newline='') as dataFile:
+        writer = csv.writer(dataFile)
+        writer.writerow(recordData.dtype.names)
+        writer.writerows(recordData.tolist())
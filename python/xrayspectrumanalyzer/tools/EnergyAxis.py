@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.EnergyAxis
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Channel ranges of energy ranges on an increasing energy axis.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+
+def getEnergySlice(xData, eMin_keV, eMax_keV):
+    """
+    Return the slice of the channels with an energy in [eMin, eMax] of the increasing energy axis `xData`.
+    """
+    start = int(np.searchsorted(xData, eMin_keV, side='left'))
+    stop = int(np.searchsorted(xData, eMax_keV, side='right'))
+
+    return slice(start, max(start, stop))
+
+def isEnergySlice(xData, energySlice, eMin_keV, eMax_keV):
+    """
+    Return if `energySlice` is the slice of [eMin, eMax] on the increasing energy axis `xData`.
+
+    Only the channels at the edges of the slice are checked, a slice can be reused for
+    spectra with the same calibration without searching the axis again.
+    """
+    numberChannels = len(xData)
+    start = energySlice.start
+    stop = energySlice.stop
+
+    if stop > numberChannels:
+        return False
+    if start > 0 and not xData[start - 1] < eMin_keV:
+        return False
+    if start < numberChannels and not xData[start] >= eMin_keV:
+        return False
+    if stop > start and not xData[stop - 1] <= eMax_keV:
+        return False
+    if stop < numberChannels and not xData[stop] > eMax_keV:
+        return False
+
+    return True
+
+class EnergySliceCache(object):
+    """
+    Slices of energy ranges, kept for the axis of the last spectrum.
+    """
+    def __init__(self):
+        self._slices = {}
+
+    def getSlice(self, xData, eMin_keV, eMax_keV):
+        key = (eMin_keV, eMax_keV)
+        energySlice = self._slices.get(key)
+        if energySlice is None or not isEnergySlice(xData, energySlice, eMin_keV, eMax_keV):
+            energySlice = getEnergySlice(xData, eMin_keV, eMax_keV)
+            self._slices[key] = energySlice
+
+        return energySlice
+
+    def clear(self):
+        self._slices = {}
+
+class WindowIntegrator(object):
+    """
+    Integrals of curves over energy windows, from their cumulative sums computed once.
+
+    `yData` has the channels of the increasing energy axis `xData` on its last axis, e.g. one
+    curve, a stack of fitted peaks or the pixels of a map. Each window integral only reads
+    the cumulative sums at the window edges.
+    """
+    def __init__(self, xData, yData):
+        self._xData = np.asarray(xData, dtype=np.float64)
+        yData = np.asarray(yData)
+
+        numberChannels = len(self._xData)
+        assert yData.shape[-1] == numberChannels
+        self._cumulativeSums = np.zeros(yData.shape[:-1] + (numberChannels + 1,))
+        np.cumsum(yData, axis=-1, out=self._cumulativeSums[..., 1:])
+
+        self._channelEdges_keV = None
+
+    def integrate(self, e1_keV, e2_keV, index=None, fractional=False):
+        """
+        Return the integrals over the windows [e1, e2] of the curves, or of the curves selected by `index`.
+
+        The windows can be arrays, the window axes are added after the curve axes. Without
+        `fractional`, the channels with an energy in [e1, e2] are summed, as with a mask on the
+        axis. With `fractional`, the channels cut by the window edges contribute the fraction
+        of their width inside the window.
+        """
+        cumulativeSums = self._cumulativeSums if index is None else self._cumulativeSums[index]
+
+        if fractional:
+            return self._getFractionalSums(cumulativeSums, e2_keV) - self._getFractionalSums(cumulativeSums, e1_keV)
+
+        starts = np.searchsorted(self._xData, e1_keV, side='left')
+        stops = np.maximum(starts, np.searchsorted(self._xData, e2_keV, side='right'))
+
+        return cumulativeSums[..., stops] - cumulativeSums[..., starts]
+
+    def _getFractionalSums(self, cumulativeSums, energy_keV):
+        channelEdges_keV = self._getChannelEdges_keV()
+        positions = np.interp(energy_keV, channelEdges_keV, np.arange(len(channelEdges_keV), dtype=np.float64))
+
+        indices = np.minimum(np.floor(positions).astype(int), len(self._xData) - 1)
+        fractions = positions - indices
+
+        return cumulativeSums[..., indices]*(1.0 - fractions) + cumulativeSums[..., indices + 1]*fractions
+
+    def _getChannelEdges_keV(self):
+        """
+        Return the channel edges, half way between the channel energies and half a channel outside the first and last ones.
+        """
+        if self._channelEdges_keV is None:
+            xData = self._xData
+            assert len(xData) > 1
+            middles_keV = 0.5*(xData[1:] + xData[:-1])
+            self._channelEdges_keV = np.concatenate(([1.5*xData[0] - 0.5*xData[1]], middles_keV, [1.5*xData[-1] - 0.5*xData[-2]]))
+
+        return self._channelEdges_keV
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.FitLeastSquares
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Bounded least-squares fit of a flat parameter vector with :func:`scipy.optimize.least_squares`.
+
+The result has the attributes of :class:`lmfit.minimizer.MinimizerResult` used by the analyzer,
+without the cost of the lmfit parameters in each evaluation. :func:`minimizeBatch` fits many problems
+with the same model and different data together, with arrays of (nproblems x ...) at each iteration.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+
+# Third party modules.
+import numpy as np
+from scipy.optimize import least_squares
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+FTOL = 1.5e-8
+XTOL = 1.5e-8
+
+_INITIAL_DAMPING = 1.0e-3
+_MAXIMUM_DAMPING = 1.0e16
+
+class FitParameter(object):
+    """
+    Fitted value of a parameter, with the attributes of :class:`lmfit.Parameter`.
+    """
+    __slots__ = ('name', 'value', 'stderr', 'vary', 'min', 'max')
+
+    def __init__(self, name, value, stderr, vary, minimum, maximum):
+        self.name = name
+        self.value = value
+        self.stderr = stderr
+        self.vary = vary
+        self.min = minimum
+        self.max = maximum
+
+class FitResult(object):
+    """
+    Result of :func:`minimize`, with the attributes of :class:`lmfit.minimizer.MinimizerResult`.
+
+    `params` is a dictionary of :class:`FitParameter` in the order of the parameters.
+    """
+    def __init__(self, params, success, message, nfev, residual, nvarys, covar):
+        self.params = params
+        self.success = success
+        self.message = message
+        self.nfev = nfev
+        self.residual = residual
+        self.ndata = len(residual)
+        self.nvarys = nvarys
+        self.nfree = self.ndata - nvarys
+        self.chisqr = np.sum(residual**2)
+        self.redchi = self.chisqr/max(1, self.nfree)
+        self.covar = covar
+        self.errorbars = covar is not None
+
+class BoundsTransform(object):
+    """
+    Transformation of bounded values to unbounded internal values, the same as the one of lmfit (Minuit style).
+
+    The values can be an array of (nproblems x nparameters), the bounds are those of the last axis.
+    """
+    def __init__(self, lowerBounds, upperBounds):
+        self.lowerBounds = np.asarray(lowerBounds, dtype=np.float64)
+        self.upperBounds = np.asarray(upperBounds, dtype=np.float64)
+
+        hasLower = np.isfinite(self.lowerBounds)
+        hasUpper = np.isfinite(self.upperBounds)
+        self._isBoth = np.logical_and(hasLower, hasUpper)
+        self._isLower = np.logical_and(hasLower, ~hasUpper)
+        self._isUpper = np.logical_and(~hasLower, hasUpper)
+
+    def toInternal(self, values):
+        values = np.clip(np.array(values, dtype=np.float64), self.lowerBounds, self.upperBounds)
+        internalValues = values.copy()
+
+        lower = self.lowerBounds[self._isBoth]
+        upper = self.upperBounds[self._isBoth]
+        internalValues[..., self._isBoth] = np.arcsin(2.0*(values[..., self._isBoth] - lower)/(upper - lower) - 1.0)
+        internalValues[..., self._isLower] = np.sqrt((values[..., self._isLower] - self.lowerBounds[self._isLower] + 1.0)**2 - 1.0)
+        internalValues[..., self._isUpper] = np.sqrt((self.upperBounds[self._isUpper] - values[..., self._isUpper] + 1.0)**2 - 1.0)
+        internalValues[np.abs(internalValues) < 1.0e-15] = 0.0
+
+        return internalValues
+
+    def fromInternal(self, internalValues):
+        """
+        Return the values and their derivatives with respect to the internal values.
+        """
+        values = internalValues.copy()
+        derivatives = np.ones_like(internalValues)
+
+        internal = internalValues[..., self._isBoth]
+        lower = self.lowerBounds[self._isBoth]
+        upper = self.upperBounds[self._isBoth]
+        values[..., self._isBoth] = lower + (np.sin(internal) + 1.0)*(upper - lower)/2.0
+        derivatives[..., self._isBoth] = np.cos(internal)*(upper - lower)/2.0
+
+        for isBounded, sign, bounds in [(self._isLower, 1.0, self.lowerBounds), (self._isUpper, -1.0, self.upperBounds)]:
+            internal = internalValues[..., isBounded]
+            root = np.sqrt(internal*internal + 1.0)
+            values[..., isBounded] = bounds[isBounded] + sign*(root - 1.0)
+            derivatives[..., isBounded] = sign*internal/root
+
+        return values, derivatives
+
+def minimize(names, values, vary, lowerBounds, upperBounds, functionModel, functionJacobian, x, data, maximumEvaluations=None):
+    """
+    Least-squares fit of `data` with an analytic Jacobian.
+
+    `values`, `vary` and the bounds are arrays in the order of `names`, only the parameters with `vary` are fitted.
+    `functionModel(values, x)` returns the model and `functionJacobian(values, x)` its
+    (nparameters x nchannels) derivatives. The fit is aborted, and not successful, after `maximumEvaluations`.
+
+    The bounded problem is solved as lmfit does with leastsq: the Levenberg-Marquardt method
+    on the internal values of :class:`BoundsTransform`, with the same tolerances.
+    """
+    varyIndices = np.flatnonzero(vary)
+    numberVarys = len(varyIndices)
+    transform = BoundsTransform(lowerBounds[varyIndices], upperBounds[varyIndices])
+    allValues = np.clip(np.array(values, dtype=np.float64), lowerBounds, upperBounds)
+
+    def getValues(internalValues):
+        allValues[varyIndices], derivatives = transform.fromInternal(internalValues)
+        return allValues, derivatives
+
+    def residual(internalValues):
+        return data - functionModel(getValues(internalValues)[0], x)
+
+    def jacobian(internalValues):
+        values, derivatives = getValues(internalValues)
+        return -(functionJacobian(values, x)[varyIndices]*derivatives[:, np.newaxis]).T
+
+    if maximumEvaluations is None:
+        maximumEvaluations = 2000*(numberVarys + 1)
+    result = least_squares(residual, transform.toInternal(allValues[varyIndices]), jac=jacobian, method='lm',
+                           x_scale='jac', ftol=FTOL, xtol=XTOL, gtol=1.0e-15, max_nfev=maximumEvaluations)
+
+    values = getValues(result.x)[0].copy()
+    jacobianValues = functionJacobian(values, x)[varyIndices]
+
+    return _createFitResult(names, values, vary, lowerBounds, upperBounds, residual(result.x), jacobianValues,
+                            result.nfev, result.status > 0, result.message)
+
+def minimizeBatch(names, values, vary, lowerBounds, upperBounds, functionModel, functionJacobian, x, data, maximumEvaluations=None):
+    """
+    Least-squares fits of each row of `data` with the same model, return a :class:`FitResult` for each row.
+
+    `values` is the (nproblems x nparameters) array of the initial values, `vary` and the bounds are the same
+    for all the problems. `functionModel(values, x)` returns the (nproblems x nchannels) models of the rows
+    of `values` and `functionJacobian(values, x)` their (nproblems x nparameters x nchannels) derivatives.
+
+    All the problems are iterated together by a Levenberg-Marquardt method on the internal values of
+    :class:`BoundsTransform`, each one with its own damping. A problem is converged when the relative reduction
+    of its chi-square or its step is below the tolerances of :func:`minimize`, the converged problems are
+    not evaluated anymore. A problem is aborted, and not successful, after `maximumEvaluations` or when
+    its chi-square cannot be reduced anymore by a damped step, the caller can fit it again with :func:`minimize`.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    numberProblems = len(data)
+    varyIndices = np.flatnonzero(vary)
+    numberVarys = len(varyIndices)
+    transform = BoundsTransform(lowerBounds[varyIndices], upperBounds[varyIndices])
+    allValues = np.clip(np.array(values, dtype=np.float64), lowerBounds, upperBounds)
+
+    if maximumEvaluations is None:
+        maximumEvaluations = 2000*(numberVarys + 1)
+
+    def evaluate(indices, internalValues):
+        values = allValues[indices]
+        values[:, varyIndices], derivatives = transform.fromInternal(internalValues)
+        return values, derivatives, data[indices] - functionModel(values, x)
+
+    internalValues = transform.toInternal(allValues[:, varyIndices])
+    allValues, derivatives, residuals = evaluate(np.arange(numberProblems), internalValues)
+    chi2s = np.sum(residuals**2, axis=1)
+
+    numberEvaluations = np.ones(numberProblems, dtype=int)
+    dampings = np.full(numberProblems, _INITIAL_DAMPING)
+    dampingFactors = np.full(numberProblems, 2.0)
+    isActive = np.ones(numberProblems, dtype=bool)
+    isSuccess = np.zeros(numberProblems, dtype=bool)
+    messages = ["Maximum number of function evaluations is exceeded."]*numberProblems
+
+    # The normal equations are computed again only for the problems with a new accepted step. As in MINPACK,
+    # the damping is scaled by the largest norms of the Jacobian columns so far, a parameter that reaches
+    # a bound, where its derivative vanishes, stays damped.
+    hasNewStep = np.ones(numberProblems, dtype=bool)
+    hessians = np.zeros((numberProblems, numberVarys, numberVarys))
+    scales = np.full((numberProblems, numberVarys), np.finfo(np.float64).tiny)
+    gradients = np.zeros((numberProblems, numberVarys))
+    diagonalIndices = np.arange(numberVarys)
+
+    def stop(indices, success, message):
+        isActive[indices] = False
+        isSuccess[indices] = success
+        for index in indices:
+            messages[index] = message
+
+    stop(np.flatnonzero(chi2s == 0.0), True, "The residual is zero.")
+    while np.any(isActive):
+        indices = np.flatnonzero(isActive & hasNewStep)
+        if len(indices) > 0:
+            jacobians = functionJacobian(allValues[indices], x)[:, varyIndices]*derivatives[indices][:, :, np.newaxis]
+            hessians[indices] = np.einsum('kim,kjm->kij', jacobians, jacobians)
+            scales[indices] = np.maximum(scales[indices], hessians[indices][:, diagonalIndices, diagonalIndices])
+            gradients[indices] = np.einsum('kim,km->ki', jacobians, residuals[indices])
+            hasNewStep[indices] = False
+
+        indices = np.flatnonzero(isActive)
+        hessian = hessians[indices]
+        gradient = gradients[indices]
+        dampedHessian = hessian.copy()
+        dampedHessian[:, diagonalIndices, diagonalIndices] += dampings[indices][:, np.newaxis]*scales[indices]
+        steps = _solveBatch(dampedHessian, gradient)
+
+        trialInternalValues = internalValues[indices] + steps
+        trialValues, trialDerivatives, trialResiduals = evaluate(indices, trialInternalValues)
+        trialChi2s = np.sum(trialResiduals**2, axis=1)
+        numberEvaluations[indices] += 1
+
+        chi2 = chi2s[indices]
+        predictedReductions = 2.0*np.sum(steps*gradient, axis=1) - np.einsum('ki,kij,kj->k', steps, hessian, steps)
+        isSmallStep = np.sqrt(np.sum(steps**2, axis=1)) <= XTOL*(np.sqrt(np.sum(internalValues[indices]**2, axis=1)) + XTOL)
+        isAccepted = trialChi2s < chi2
+        isConverged = isAccepted & (chi2 - trialChi2s <= FTOL*chi2) & (predictedReductions <= FTOL*chi2)
+
+        accepted = indices[isAccepted]
+        internalValues[accepted] = trialInternalValues[isAccepted]
+        allValues[accepted] = trialValues[isAccepted]
+        derivatives[accepted] = trialDerivatives[isAccepted]
+        residuals[accepted] = trialResiduals[isAccepted]
+        chi2s[accepted] = trialChi2s[isAccepted]
+        # Damping update of Nielsen from the ratio of the actual and predicted reductions.
+        ratios = (chi2 - trialChi2s)[isAccepted]/np.maximum(predictedReductions[isAccepted], np.finfo(np.float64).tiny)
+        dampings[accepted] *= np.maximum(1.0/3.0, 1.0 - (2.0*np.minimum(ratios, 1.0) - 1.0)**3)
+        dampingFactors[accepted] = 2.0
+        hasNewStep[accepted] = True
+        rejected = indices[~isAccepted]
+        dampings[rejected] *= dampingFactors[rejected]
+        dampingFactors[rejected] *= 2.0
+
+        stop(indices[isConverged], True, "The relative reduction of the chi-square is at most ftol.")
+        # A rejected step is not a convergence, the damping is increased until the problem stalls.
+        stop(indices[isSmallStep & isAccepted & ~isConverged], True, "The relative step is at most xtol.")
+        stop(rejected[dampings[rejected] > _MAXIMUM_DAMPING], False, "The chi-square cannot be reduced.")
+        isActive &= numberEvaluations < maximumEvaluations
+
+    jacobians = functionJacobian(allValues, x)[:, varyIndices]
+    results = []
+    for index in range(numberProblems):
+        results.append(_createFitResult(names, allValues[index], vary, lowerBounds, upperBounds, residuals[index], jacobians[index],
+                                        numberEvaluations[index], bool(isSuccess[index]), messages[index]))
+
+    return results
+
+def _solveBatch(matrices, vectors):
+    try:
+        return np.linalg.solve(matrices, vectors[:, :, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        return np.array([np.linalg.lstsq(matrix, vector, rcond=None)[0] for matrix, vector in zip(matrices, vectors)])
+
+def _createFitResult(names, values, vary, lowerBounds, upperBounds, residual, jacobian, nfev, success, message):
+    """
+    Return the result of a fit, the standard errors are computed from the (nvarys x nchannels) `jacobian` of the model.
+    """
+    varyIndices = np.flatnonzero(vary)
+
+    covar = None
+    stderrs = np.zeros(len(values))
+    nfree = len(residual) - len(varyIndices)
+    if nfree > 0:
+        try:
+            covar = np.linalg.inv(np.dot(jacobian, jacobian.T))*np.sum(residual**2)/nfree
+            stderrs[varyIndices] = np.sqrt(np.abs(np.diag(covar)))
+        except np.linalg.LinAlgError:
+            covar = None
+
+    params = {}
+    for index, name in enumerate(names):
+        params[name] = FitParameter(name, values[index], stderrs[index], bool(vary[index]),
+                                    lowerBounds[index], upperBounds[index])
+
+    return FitResult(params, success, message, nfev, residual, len(varyIndices), covar)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.FitMultiGaussianFunction
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Linear background plus many Gaussian peaks evaluated as a single array operation.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+
+# Third party modules.
+import numpy as np
+from scipy.optimize import nnls
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+SQRT_2PI = np.sqrt(2.0*np.pi)
+
+class MultiGaussianFunction(object):
+    """
+    Model of a ROI: linear background `a + b*x` plus N Gaussian peaks.
+
+    The areas, positions and sigmas of the peaks are kept in contiguous arrays and
+    all the peaks are evaluated at once as a (npeaks x nchannels) array.
+    """
+    def __init__(self, areas, positions, sigmas, a=0.0, b=0.0):
+        self.areas = np.array(areas, dtype=np.float64)
+        self.positions = np.array(positions, dtype=np.float64)
+        self.sigmas = np.array(sigmas, dtype=np.float64)
+        self.a = a
+        self.b = b
+
+        assert self.areas.shape == self.positions.shape == self.sigmas.shape
+
+    @property
+    def numberPeaks(self):
+        return len(self.areas)
+
+    def background(self, x):
+        return self.a + self.b*np.asarray(x)
+
+    def peaks(self, x):
+        """
+        Return the (npeaks x nchannels) array of each peak evaluated on `x`.
+        """
+        return self.areas[:, np.newaxis]*self.unitPeaks(x)
+
+    def peak(self, x, index):
+        """
+        Return the peak `index` evaluated on `x`, equal to the row `index` of :meth:`peaks`.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        sigma = self.sigmas[index]
+        z = (x - self.positions[index])/sigma
+        return self.areas[index]*(np.exp(-0.5*z*z)/(sigma*SQRT_2PI))
+
+    def unitPeaks(self, x):
+        """
+        Return the (npeaks x nchannels) array of unit area Gaussians evaluated on `x`.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        sigmas = self.sigmas[:, np.newaxis]
+        z = (x[np.newaxis, :] - self.positions[:, np.newaxis])/sigmas
+        return np.exp(-0.5*z*z)/(sigmas*SQRT_2PI)
+
+    def __call__(self, x):
+        return self.background(x) + np.sum(self.peaks(x), axis=0)
+
+    def derivatives(self, x):
+        """
+        Return the partial derivatives of the peaks with respect to the areas, positions and sigmas.
+
+        Each derivative is a (npeaks x nchannels) array. The derivatives with respect to
+        the background parameters `a` and `b` are simply 1 and `x`.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        unitPeaks = self.unitPeaks(x)
+        peaks = self.areas[:, np.newaxis]*unitPeaks
+        sigmas = self.sigmas[:, np.newaxis]
+        z = (x[np.newaxis, :] - self.positions[:, np.newaxis])/sigmas
+
+        derivativeAreas = unitPeaks
+        derivativePositions = peaks*z/sigmas
+        derivativeSigmas = peaks*(z*z - 1.0)/sigmas
+
+        return derivativeAreas, derivativePositions, derivativeSigmas
+
+    def solveLinearParameters(self, x, y, isBackgroundFixed=False):
+        """
+        Set the background and the areas to their least-squares values for the current positions and sigmas.
+
+        The areas are solved with a non-negative least-squares solve. The background coefficients
+        are free, each one is split in a positive and a negative part for the solve. If
+        `isBackgroundFixed` is true, only the areas are solved.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        unitPeaks = self.unitPeaks(x)
+
+        if isBackgroundFixed:
+            basis = unitPeaks
+            data = y - self.background(x)
+        else:
+            ones = np.ones_like(x)
+            basis = np.vstack((ones, -ones, x, -x, unitPeaks))
+            data = y
+
+        coefficients, _residualNorm = nnls(basis.T, data)
+
+        if isBackgroundFixed:
+            self.areas[:] = coefficients
+        else:
+            self.a = coefficients[0] - coefficients[1]
+            self.b = coefficients[2] - coefficients[3]
+            self.areas[:] = coefficients[4:]
+
+    def projectedDerivatives(self, x, isBackgroundFixed=False):
+        """
+        Return the derivatives with respect to the positions and sigmas when the linear parameters are projected out.
+
+        Kaufman approximation of the variable projection Jacobian: the derivatives are projected
+        on the orthogonal complement of the background and of the peaks with a non-zero area.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        _derivativeAreas, derivativePositions, derivativeSigmas = self.derivatives(x)
+
+        basis = [self.unitPeaks(x)[self.areas > 0.0]]
+        if not isBackgroundFixed:
+            basis.append(np.ones((1, len(x))))
+            basis.append(x[np.newaxis, :])
+        basis = np.vstack(basis)
+
+        derivatives = np.vstack((derivativePositions, derivativeSigmas))
+        if len(basis) > 0:
+            q, _r = np.linalg.qr(basis.T)
+            derivatives = derivatives - np.dot(np.dot(derivatives, q), q.T)
+
+        return derivatives[:self.numberPeaks], derivatives[self.numberPeaks:]
+
+class BatchMultiGaussianFunction(object):
+    """
+    Models of the same ROI for many spectra, the parameters of a :class:`MultiGaussianFunction` for each spectrum.
+
+    The areas, positions and sigmas are (nspectra x npeaks) arrays and the background coefficients `a` and `b`
+    are (nspectra) arrays. The peaks of all the spectra are evaluated at once as a (nspectra x npeaks x nchannels) array.
+    """
+    def __init__(self, areas, positions, sigmas, a, b):
+        self.areas = np.array(areas, dtype=np.float64, ndmin=2)
+        self.positions = np.array(positions, dtype=np.float64, ndmin=2)
+        self.sigmas = np.array(sigmas, dtype=np.float64, ndmin=2)
+        self.a = np.array(a, dtype=np.float64, ndmin=1)
+        self.b = np.array(b, dtype=np.float64, ndmin=1)
+
+        assert self.areas.shape == self.positions.shape == self.sigmas.shape
+        assert self.a.shape == self.b.shape == self.areas.shape[:1]
+
+    @property
+    def numberSpectra(self):
+        return len(self.areas)
+
+    def background(self, x):
+        """
+        Return the (nspectra x nchannels) array of the background of each spectrum.
+        """
+        return self.a[:, np.newaxis] + self.b[:, np.newaxis]*np.asarray(x)[np.newaxis, :]
+
+    def peaks(self, x):
+        return self.areas[:, :, np.newaxis]*self.unitPeaks(x)
+
+    def unitPeaks(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        sigmas = self.sigmas[:, :, np.newaxis]
+        z = (x - self.positions[:, :, np.newaxis])/sigmas
+        return np.exp(-0.5*z*z)/(sigmas*SQRT_2PI)
+
+    def __call__(self, x):
+        return self.background(x) + np.sum(self.peaks(x), axis=1)
+
+    def derivatives(self, x):
+        """
+        Return the partial derivatives of the peaks with respect to the areas, positions and sigmas.
+
+        Each derivative is a (nspectra x npeaks x nchannels) array, see :meth:`MultiGaussianFunction.derivatives`.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        unitPeaks = self.unitPeaks(x)
+        peaks = self.areas[:, :, np.newaxis]*unitPeaks
+        sigmas = self.sigmas[:, :, np.newaxis]
+        z = (x - self.positions[:, :, np.newaxis])/sigmas
+
+        derivativeAreas = unitPeaks
+        derivativePositions = peaks*z/sigmas
+        derivativeSigmas = peaks*(z*z - 1.0)/sigmas
+
+        return derivativeAreas, derivativePositions, derivativeSigmas
+
+    def getFunction(self, index):
+        """
+        Return the :class:`MultiGaussianFunction` of the spectrum `index`.
+        """
+        return MultiGaussianFunction(self.areas[index], self.positions[index], self.sigmas[index], a=self.a[index], b=self.b[index])
+
+if __name__ == '__main__':  #pragma: no cover
+    import pyHendrixDemersTools.Runner as Runner
+    Runner.Runner().run(runFunction=None)
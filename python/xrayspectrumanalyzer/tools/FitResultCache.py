@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.FitResultCache
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+On-disk cache of fit results, content-addressed by a hash of the fitted data and of the fit configuration.
+
+Each entry is a pickle file named by its key. The total size of the entries is bounded, the least
+recently used entries are removed first.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import os
+import os.path
+import hashlib
+import json
+import pickle
+import logging
+from collections import OrderedDict
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+from xrayspectrumanalyzer import createPath
+
+# Globals and constants variables.
+CACHE_VERSION = 1
+
+_ENTRY_EXTENSION = ".pkl"
+
+def createKey(configuration, *arrays):
+    """
+    Return the key of a fit, the hash of the json `configuration` and of the values of the `arrays`.
+
+    The values of the configuration that are not json types, e.g. numpy scalars, are hashed as strings.
+    """
+    keyHash = hashlib.sha256()
+    keyHash.update(json.dumps([CACHE_VERSION, configuration], sort_keys=True, default=str).encode('utf-8'))
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        keyHash.update(str(array.shape).encode('utf-8'))
+        keyHash.update(array.tobytes())
+
+    return keyHash.hexdigest()
+
+class FitResultCache(object):
+    """
+    Fit results saved in `cachePath`, at most `maximumSize_MB` of entries.
+
+    The entries already in the path are kept, the oldest used first removed. The order of use is
+    given by the modification time of the files, it is updated when an entry is read.
+    """
+    def __init__(self, cachePath, maximumSize_MB=100.0):
+        self._cachePath = createPath(cachePath)
+        self._maximumSize_bytes = int(maximumSize_MB*1.0e6)
+        self._entries = None
+        self._size_bytes = 0
+
+        self.numberHits = 0
+        self.numberMisses = 0
+
+    def __getstate__(self):
+        # Each process reads the entries of the path again.
+        state = self.__dict__.copy()
+        state['_entries'] = None
+        state['_size_bytes'] = 0
+        return state
+
+    def _getEntries(self):
+        if self._entries is None:
+            entries = []
+            for filename in os.listdir(self._cachePath):
+                if filename.endswith(_ENTRY_EXTENSION):
+                    status = os.stat(os.path.join(self._cachePath, filename))
+                    entries.append((status.st_mtime, filename[:-len(_ENTRY_EXTENSION)], status.st_size))
+
+            self._entries = OrderedDict((key, size_bytes) for _time, key, size_bytes in sorted(entries))
+            self._size_bytes = sum(self._entries.values())
+
+        return self._entries
+
+    def getFilepath(self, key):
+        return os.path.join(self._cachePath, key + _ENTRY_EXTENSION)
+
+    def get(self, key):
+        """
+        Return the result of `key`, or None if it is not in the cache.
+        """
+        entries = self._getEntries()
+        filepath = self.getFilepath(key)
+        try:
+            with open(filepath, 'rb') as entryFile:
+                value = pickle.load(entryFile)
+            os.utime(filepath)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.numberMisses += 1
+            return None
+
+        if key not in entries:
+            entries[key] = os.path.getsize(filepath)
+            self._size_bytes += entries[key]
+        entries.move_to_end(key)
+        self.numberHits += 1
+
+        return value
+
+    def set(self, key, value):
+        """
+        Save the result of `key` and remove the least recently used entries above the maximum size.
+        """
+        entries = self._getEntries()
+        filepath = self.getFilepath(key)
+
+        # The entry is replaced in one step, a reader never sees a partial file.
+        temporaryFilepath = "%s.%i.tmp" % (filepath, os.getpid())
+        with open(temporaryFilepath, 'wb') as entryFile:
+            pickle.dump(value, entryFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryFilepath, filepath)
+
+        self._size_bytes -= entries.pop(key, 0)
+        entries[key] = os.path.getsize(filepath)
+        self._size_bytes += entries[key]
+
+        while self._size_bytes > self._maximumSize_bytes and len(entries) > 1:
+            oldKey, size_bytes = entries.popitem(last=False)
+            self._size_bytes -= size_bytes
+            try:
+                os.remove(self.getFilepath(oldKey))
+            except OSError:
+                logging.debug("Fit result cache entry already removed: %s", oldKey)
+
+    def clear(self):
+        for key in list(self._getEntries()):
+            try:
+                os.remove(self.getFilepath(key))
+            except OSError:
+                pass
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+
+    def __len__(self):
+        return len(self._getEntries())
+
+    @property
+    def cachePath(self):
+        return self._cachePath
+
+    @property
+    def size_bytes(self):
+        self._getEntries()
+        return self._size_bytes
+
+    @property
+    def maximumSize_MB(self):
+        return self._maximumSize_bytes*1.0e-6
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.FitSparseSpectrumFunction
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Whole spectrum model with a sparse Jacobian.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+
+# Third party modules.
+import numpy as np
+from scipy.sparse import coo_matrix
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+SQRT_2PI = np.sqrt(2.0*np.pi)
+
+class SparseSpectrumFunction(object):
+    """
+    Piecewise linear background plus N Gaussian peaks over a whole spectrum.
+
+    Each peak is only evaluated on its window of channels, so the model costs the total
+    window size instead of (npeaks x nchannels) and the Jacobian is a sparse matrix.
+
+    The parameter vector is `[knot values (K), areas (N), positions (N), sigmas (N)]`.
+    """
+    def __init__(self, x, knots, windowsMin, windowsMax):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.knots = np.asarray(knots, dtype=np.float64)
+        numberChannels = len(self.x)
+        numberKnots = len(self.knots)
+        numberPeaks = len(windowsMin)
+
+        assert numberKnots >= 2
+        assert self.knots[0] <= self.x[0] and self.x[-1] <= self.knots[-1]
+
+        knotIndices = np.searchsorted(self.knots, self.x, side='right') - 1
+        self._knotIndices = np.clip(knotIndices, 0, numberKnots - 2)
+        knotsLeft = self.knots[self._knotIndices]
+        knotsRight = self.knots[self._knotIndices + 1]
+        self._knotWeights = (self.x - knotsLeft)/(knotsRight - knotsLeft)
+
+        starts = np.searchsorted(self.x, windowsMin, side='left')
+        stops = np.searchsorted(self.x, windowsMax, side='right')
+        lengths = stops - starts
+        self.windows = list(zip(starts, stops))
+
+        self._peakIndices = np.repeat(np.arange(numberPeaks), lengths)
+        firstEntries = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        self._channels = np.repeat(starts, lengths) + np.arange(np.sum(lengths)) - firstEntries
+
+        self.numberKnots = numberKnots
+        self.numberPeaks = numberPeaks
+        self.numberParameters = numberKnots + 3*numberPeaks
+        self.shape = (numberChannels, self.numberParameters)
+
+        channels = np.arange(numberChannels)
+        self._jacobianRows = np.concatenate((channels, channels, self._channels, self._channels, self._channels))
+        self._jacobianColumns = np.concatenate((self._knotIndices, self._knotIndices + 1,
+                                                numberKnots + self._peakIndices,
+                                                numberKnots + numberPeaks + self._peakIndices,
+                                                numberKnots + 2*numberPeaks + self._peakIndices))
+
+    def splitParameters(self, values):
+        numberKnots = self.numberKnots
+        numberPeaks = self.numberPeaks
+        knotValues = values[:numberKnots]
+        areas = values[numberKnots:numberKnots + numberPeaks]
+        positions = values[numberKnots + numberPeaks:numberKnots + 2*numberPeaks]
+        sigmas = values[numberKnots + 2*numberPeaks:]
+
+        return knotValues, areas, positions, sigmas
+
+    def background(self, values):
+        knotValues = values[:self.numberKnots]
+        return knotValues[self._knotIndices]*(1.0 - self._knotWeights) + knotValues[self._knotIndices + 1]*self._knotWeights
+
+    def _unitPeakEntries(self, values):
+        _knotValues, _areas, positions, sigmas = self.splitParameters(values)
+        entrySigmas = sigmas[self._peakIndices]
+        z = (self.x[self._channels] - positions[self._peakIndices])/entrySigmas
+        return np.exp(-0.5*z*z)/(entrySigmas*SQRT_2PI), z, entrySigmas
+
+    def peak(self, values, indexPeak):
+        """
+        Return the channel slice of the window of a peak and the peak evaluated on it.
+        """
+        start, stop = self.windows[indexPeak]
+        _knotValues, areas, positions, sigmas = self.splitParameters(values)
+        z = (self.x[start:stop] - positions[indexPeak])/sigmas[indexPeak]
+        yPeak = areas[indexPeak]*np.exp(-0.5*z*z)/(sigmas[indexPeak]*SQRT_2PI)
+
+        return slice(start, stop), yPeak
+
+    def peaks(self, values):
+        unitPeaks, _z, _entrySigmas = self._unitPeakEntries(values)
+        _knotValues, areas, _positions, _sigmas = self.splitParameters(values)
+        return np.bincount(self._channels, weights=areas[self._peakIndices]*unitPeaks, minlength=len(self.x))
+
+    def __call__(self, values):
+        return self.background(values) + self.peaks(values)
+
+    def jacobian(self, values):
+        """
+        Return the (nchannels x nparameters) Jacobian of the model as a CSR sparse matrix.
+        """
+        unitPeaks, z, entrySigmas = self._unitPeakEntries(values)
+        _knotValues, areas, _positions, _sigmas = self.splitParameters(values)
+        peaks = areas[self._peakIndices]*unitPeaks
+
+        data = np.concatenate((1.0 - self._knotWeights, self._knotWeights,
+                               unitPeaks, peaks*z/entrySigmas, peaks*(z*z - 1.0)/entrySigmas))
+
+        return coo_matrix((data, (self._jacobianRows, self._jacobianColumns)), shape=self.shape).tocsr()
+
+if __name__ == '__main__':  #pragma: no cover
+    import pyHendrixDemersTools.Runner as Runner
+    Runner.Runner().run(runFunction=None)
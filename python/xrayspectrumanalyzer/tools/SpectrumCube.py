@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: xrayspectrumanalyzer.tools.SpectrumCube
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Spectrum image (EDS map) in the RAW/RPL format, read through a memory map.
+
+The RPL file is the Lispix text header of the RAW file, one "key value" pair per line:
+width, height, depth (channels), offset, data-length (bytes), data-type (signed, unsigned or float),
+byte-order (little-endian, big-endian or dont-care) and record-by (vector or image).
+The energy axis is given by `ev-per-chan` or by `depth-origin`, `depth-scale` and `depth-units`.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import os
+import os.path
+import json
+import math
+
+# Third party modules.
+import numpy as np
+
+# Local modules.
+
+# Project modules
+
+# Globals and constants variables.
+RECORD_BY_VECTOR = "vector"
+RECORD_BY_IMAGE = "image"
+
+_DATA_TYPES = {"signed": "i", "unsigned": "u", "float": "f"}
+_BYTE_ORDERS = {"little-endian": "<", "big-endian": ">", "dont-care": "="}
+
+def readRplHeader(rplFilepath):
+    """
+    Return the keys (lower case) and values of a RPL file, the integer values are converted.
+    """
+    header = {}
+    with open(rplFilepath) as rplFile:
+        for line in rplFile:
+            items = line.split(None, 1)
+            if len(items) != 2 or items[0].startswith(';'):
+                continue
+
+            key = items[0].strip().lower()
+            value = items[1].strip()
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    value = value.lower()
+            header[key] = value
+
+    # Skip the optional "key value" title line.
+    header.pop("key", None)
+
+    return header
+
+def writeRplCube(rplFilepath, data, recordBy=RECORD_BY_VECTOR, energyOffset_keV=0.0, energyScale_keV=0.01):
+    """
+    Write a spectrum cube (height x width x channels) in the RAW/RPL format, the RAW file next to the RPL file.
+    """
+    data = np.asarray(data)
+    height, width, depth = data.shape
+    dataType = {"i": "signed", "u": "unsigned", "f": "float"}[data.dtype.kind]
+
+    header = [("width", width), ("height", height), ("depth", depth), ("offset", 0),
+              ("data-length", data.dtype.itemsize), ("data-type", dataType), ("byte-order", "little-endian"),
+              ("record-by", recordBy), ("depth-origin", energyOffset_keV), ("depth-scale", energyScale_keV),
+              ("depth-units", "keV")]
+    with open(rplFilepath, 'w') as rplFile:
+        rplFile.write("key\tvalue\n")
+        for key, value in header:
+            rplFile.write("%s\t%s\n" % (key, value))
+
+    if recordBy == RECORD_BY_IMAGE:
+        data = np.moveaxis(data, 2, 0)
+    data.astype(data.dtype.newbyteorder('<')).tofile(_getRawFilepath(rplFilepath))
+
+def _getRawFilepath(rplFilepath):
+    basename, _extension = os.path.splitext(rplFilepath)
+    return basename + ".raw"
+
+class SpectrumCube(object):
+    """
+    Spectrum image of a RAW/RPL file, the data is memory-mapped and read only when used.
+
+    The calibration of the RPL file can be given, or replaced, with `energyOffset_keV` and `energyScale_keV`.
+    """
+    def __init__(self, rplFilepath, rawFilepath=None, energyOffset_keV=None, energyScale_keV=None):
+        self._rplFilepath = rplFilepath
+        if rawFilepath is None:
+            rawFilepath = _getRawFilepath(rplFilepath)
+        self._rawFilepath = rawFilepath
+
+        header = readRplHeader(rplFilepath)
+        self._numberColumns = header["width"]
+        self._numberRows = header["height"]
+        self._numberChannels = header["depth"]
+        self._recordBy = header.get("record-by", RECORD_BY_VECTOR)
+
+        dataType = "%s%s%i" % (_BYTE_ORDERS[header.get("byte-order", "dont-care")], _DATA_TYPES[header["data-type"]], header["data-length"])
+        if self._recordBy == RECORD_BY_VECTOR:
+            shape = (self._numberRows, self._numberColumns, self._numberChannels)
+        elif self._recordBy == RECORD_BY_IMAGE:
+            shape = (self._numberChannels, self._numberRows, self._numberColumns)
+        else:
+            raise ValueError("Record by %s not supported: %s" % (self._recordBy, rplFilepath))
+        self._data = np.memmap(rawFilepath, dtype=np.dtype(dataType), mode='r', offset=header.get("offset", 0), shape=shape)
+
+        self._energyOffset_keV, self._energyScale_keV = self._getCalibration(header)
+        if energyOffset_keV is not None:
+            self._energyOffset_keV = energyOffset_keV
+        if energyScale_keV is not None:
+            self._energyScale_keV = energyScale_keV
+        if self._energyScale_keV is None:
+            raise ValueError("No energy calibration: %s" % (rplFilepath))
+
+    def _getCalibration(self, header):
+        if "depth-scale" in header:
+            factor = 1.0e-3 if header.get("depth-units", "kev") == "ev" else 1.0
+            return header.get("depth-origin", 0.0)*factor, header["depth-scale"]*factor
+        if "ev-per-chan" in header:
+            return 0.0, header["ev-per-chan"]*1.0e-3
+        return 0.0, None
+
+    def getEnergies_keV(self):
+        return self._energyOffset_keV + self._energyScale_keV*np.arange(self._numberChannels)
+
+    def getSpectrum(self, row, column):
+        if self._recordBy == RECORD_BY_VECTOR:
+            return np.array(self._data[row, column], dtype=np.float64)
+        return np.array(self._data[:, row, column], dtype=np.float64)
+
+    def getMapShape(self, binning=1):
+        """
+        Return the shape of the maps of the super-pixels, the last rows and columns are left out if they do not fill a super-pixel.
+        """
+        return self._numberRows//binning, self._numberColumns//binning
+
+    def getBinnedRow(self, row, binning=1):
+        """
+        Return the spectra, summed over `binning` x `binning` pixels, of a row of super-pixels.
+
+        Only the pixels of the row are read, an array of (number of super-pixels x channels).
+        """
+        _numberMapRows, numberMapColumns = self.getMapShape(binning)
+        return self.getBinnedTile((row, row + 1, 0, numberMapColumns), binning)[0]
+
+    def getBinnedTile(self, tile, binning=1):
+        """
+        Return the spectra, summed over `binning` x `binning` pixels, of the super-pixels of a tile of the maps.
+
+        `tile` is (first row, last row + 1, first column, last column + 1) in super-pixels. Only the pixels
+        of the tile are read, an array of (rows x columns x channels).
+        """
+        rowStart, rowStop, columnStart, columnStop = tile
+        rows = slice(rowStart*binning, rowStop*binning)
+        columns = slice(columnStart*binning, columnStop*binning)
+
+        if self._recordBy == RECORD_BY_VECTOR:
+            data = np.asarray(self._data[rows, columns], dtype=np.float64)
+        else:
+            data = np.moveaxis(np.asarray(self._data[:, rows, columns], dtype=np.float64), 0, 2)
+        data = data.reshape(rowStop - rowStart, binning, columnStop - columnStart, binning, self._numberChannels)
+
+        return np.sum(data, axis=(1, 3))
+
+    @property
+    def numberRows(self):
+        return self._numberRows
+
+    @property
+    def numberColumns(self):
+        return self._numberColumns
+
+    @property
+    def numberChannels(self):
+        return self._numberChannels
+
+def getTiles(mapShape, tileSize):
+    """
+    Return the tiles, (first row, last row + 1, first column, last column + 1), covering maps of `mapShape`
+    with square tiles of `tileSize` pixels per side, row by row.
+    """
+    numberRows, numberColumns = mapShape
+    tiles = []
+    for rowStart in range(0, numberRows, tileSize):
+        for columnStart in range(0, numberColumns, tileSize):
+            tiles.append((rowStart, min(rowStart + tileSize, numberRows), columnStart, min(columnStart + tileSize, numberColumns)))
+
+    return tiles
+
+def computeTileSize(mapShape, numberChannels, binning=1, numberWorkers=1, maximumMemory_MB=256.0):
+    """
+    Return the size of the tiles for which the spectra read by all the workers fit in `maximumMemory_MB`.
+
+    The tiles are also made smaller so that each worker gets a few tiles, when the maps are large enough.
+    """
+    numberWorkers = max(1, numberWorkers)
+    tileBytes = binning*binning*numberChannels*np.dtype(np.float64).itemsize
+    tileSize = int(math.sqrt(maximumMemory_MB*1.0e6/(numberWorkers*tileBytes)))
+
+    numberPixels = mapShape[0]*mapShape[1]
+    tileSize = min(tileSize, int(math.ceil(math.sqrt(numberPixels/(4.0*numberWorkers)))), max(mapShape))
+
+    return max(1, tileSize)
+
+class TileManifest(object):
+    """
+    Checkpoint of the tiles done in a map processing, saved in a json file after each tile.
+
+    The tiles done are kept only if the `description` of the processing is the same as the one of the saved manifest.
+    """
+    def __init__(self, filepath, description):
+        self._filepath = filepath
+        self._description = description
+        self._doneTiles = set()
+
+        if os.path.isfile(filepath):
+            with open(filepath) as manifestFile:
+                manifest = json.load(manifestFile)
+            if manifest.get("description") == json.loads(json.dumps(description)):
+                self._doneTiles = set(tuple(tile) for tile in manifest["doneTiles"])
+
+    def isDone(self, tile):
+        return tuple(tile) in self._doneTiles
+
+    def addTile(self, tile):
+        self._doneTiles.add(tuple(tile))
+        self.save()
+
+    def save(self):
+        manifest = {"description": self._description, "doneTiles": sorted(self._doneTiles)}
+
+        # The manifest is replaced in one step, a crash while saving keeps the previous one.
+        temporaryFilepath = self._filepath + ".tmp"
+        with open(temporaryFilepath, 'w') as manifestFile:
+            json.dump(manifest, manifestFile)
+        os.replace(temporaryFilepath, self._filepath)
+
+    @property
+    def doneTiles(self):
+        return sorted(self._doneTiles)
+
+    @property
+    def isResumed(self):
+        return len(self._doneTiles) > 0
@@ -18,11 +18,18 @@
 ###############################################################################
 
 # Standard library modules.
+import os
 import os.path
+import sys
 import warnings
 import csv
+import glob
+import hashlib
+import logging
+import tempfile
 
 # Third party modules.
+import numpy as np
 
 # Local modules.
 import pywinxraydata.XRayDataWinxray as XRayDataWinxray
@@ -30,6 +37,193 @@ import pywinxraydata.ElementProperties as ElementProperties
 from xrayspectrumanalyzer import get_current_module_path
 
 # Globals and constants variables.
+LINE_DTYPE = np.dtype([('atomicNumber', 'i4'), ('energy_eV', 'f8'), ('fraction', 'f8'), ('line', 'U16')])
+EDGE_DTYPE = np.dtype([('atomicNumber', 'i4'), ('energy_eV', 'f8'), ('subshell', 'U8')])
+CACHE_PATH_VARIABLE = "XRAYSPECTRUMANALYZER_CACHE_PATH"
+
+_tables = {}
+
+def _readCsvRows(filename):
+    reader = csv.reader(open(filename, 'r'))
+
+    # Skip header
+    next(reader)
+
+    return reader
+
+def readLineRows(filename):
+    rows = []
+    for row in _readCsvRows(filename):
+        try:
+            atomicNumber = int(row[0])
+            energy_eV = float(row[1])
+            fraction = float(row[2])
+            line = row[3]
+
+            rows.append((atomicNumber, energy_eV, fraction, line))
+        except ValueError:
+            logging.debug("Line row skipped: %s", row)
+
+    return rows
+
+def readEdgeRows(filename):
+    rows = []
+    for row in _readCsvRows(filename):
+        try:
+            atomicNumber = int(row[0])
+            energy_eV = float(row[1])
+            subshell = row[2]
+
+            subshell = subshell.replace('edge', '')
+
+            if len(subshell) > 4:
+                logging.debug("Long subshell name for %i: %s", atomicNumber, subshell)
+
+            rows.append((atomicNumber, energy_eV, subshell))
+        except ValueError:
+            logging.debug("Edge row skipped: %s", row)
+
+    return rows
+
+def getCachePaths():
+    """
+    Return the directories of the reference data cache, the user cache directory then the temporary directory.
+
+    The user cache directory is set by the environment variable :data:`CACHE_PATH_VARIABLE`, if it is defined.
+    """
+    cachePath = os.environ.get(CACHE_PATH_VARIABLE)
+    if not cachePath:
+        if sys.platform.startswith('win'):
+            basePath = os.environ.get('LOCALAPPDATA') or os.path.expanduser("~")
+        elif sys.platform == 'darwin':
+            basePath = os.path.expanduser("~/Library/Caches")
+        else:
+            basePath = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+        cachePath = os.path.join(basePath, "xrayspectrumanalyzer")
+
+    return [cachePath, os.path.join(tempfile.gettempdir(), "xrayspectrumanalyzer")]
+
+def readTable(filename, dtype, readRows):
+    """
+    Return the rows of a reference data CSV file as a read-only structured array.
+
+    The rows are compiled once into a `.npy` file in the first writable directory of :func:`getCachePaths`,
+    named after the CSV file and the SHA-1 of its content, and memory mapped afterward. A modified CSV
+    file gets a new cache file. The arrays are also kept for the process, keyed by the modification
+    time and size of the CSV file.
+    """
+    fileStat = os.stat(filename)
+    tableKey = (os.path.abspath(filename), fileStat.st_mtime_ns, fileStat.st_size)
+    if tableKey in _tables:
+        return _tables[tableKey]
+
+    with open(filename, 'rb') as csvFile:
+        digest = hashlib.sha1(csvFile.read()).hexdigest()
+    basename, _extension = os.path.splitext(os.path.basename(filename))
+    cacheFilename = "%s.%s.npy" % (basename, digest[:16])
+    cacheFilepaths = [os.path.join(cachePath, cacheFilename) for cachePath in getCachePaths()]
+
+    table = None
+    for cacheFilepath in cacheFilepaths:
+        try:
+            table = np.load(cacheFilepath, mmap_mode='r')
+        except (IOError, ValueError):
+            continue
+        if table.dtype == dtype:
+            break
+        table = None
+
+    if table is None:
+        table = np.array(readRows(filename), dtype=dtype)
+        for cacheFilepath in cacheFilepaths:
+            if _saveTable(cacheFilepath, table):
+                break
+        else:
+            logging.warning("Cannot save the reference data cache %s", cacheFilename)
+
+    _tables[tableKey] = table
+    return table
+
+def _saveTable(cacheFilepath, table):
+    """
+    Save the table in the cache file and remove the cache files of the other versions of the CSV file.
+
+    Return False if the file cannot be written.
+    """
+    cachePath, cacheFilename = os.path.split(cacheFilepath)
+    basename = cacheFilename.split('.')[0]
+    try:
+        os.makedirs(cachePath, exist_ok=True)
+        # Write then rename, other processes could be reading the same cache.
+        fileDescriptor, temporaryFilepath = tempfile.mkstemp(suffix=".npy.tmp", dir=cachePath)
+        with os.fdopen(fileDescriptor, 'wb') as temporaryFile:
+            np.save(temporaryFile, table)
+        os.replace(temporaryFilepath, cacheFilepath)
+    except OSError as message:
+        logging.debug("Cannot save the reference data cache %s: %s", cacheFilepath, message)
+        return False
+
+    for staleFilepath in glob.glob(os.path.join(cachePath, basename + ".*.npy")):
+        if staleFilepath != cacheFilepath:
+            try:
+                os.remove(staleFilepath)
+            except OSError:
+                pass
+
+    return True
+
+class EnergyIndex(object):
+    """
+    Entries (atomic number, name, energy) sorted by energy for range and nearest queries by binary search.
+
+    The queries return positions in the sorted arrays :attr:`energies_eV`, :attr:`atomicNumbers`
+    and :attr:`names`; :attr:`order` gives the position of the entry in the input arrays.
+    """
+    def __init__(self, atomicNumbers, names, energies_eV):
+        energies_eV = np.asarray(energies_eV, dtype=np.float64)
+        self.order = np.argsort(energies_eV, kind='stable')
+        self.energies_eV = energies_eV[self.order]
+        self.atomicNumbers = np.asarray(atomicNumbers, dtype=np.int32)[self.order]
+        self.names = np.asarray(names)[self.order]
+
+    def __len__(self):
+        return len(self.energies_eV)
+
+    def getRangeBounds(self, energiesMin_eV, energiesMax_eV, isOpen=False):
+        """
+        Return the start and stop positions of the entries in each [min, max] range, (min, max) if `isOpen`.
+
+        The ranges can be arrays, for example one range per channel of a spectrum.
+        """
+        if isOpen:
+            starts = np.searchsorted(self.energies_eV, energiesMin_eV, side='right')
+            stops = np.searchsorted(self.energies_eV, energiesMax_eV, side='left')
+        else:
+            starts = np.searchsorted(self.energies_eV, energiesMin_eV, side='left')
+            stops = np.searchsorted(self.energies_eV, energiesMax_eV, side='right')
+
+        return starts, np.maximum(starts, stops)
+
+    def getIndicesInRange(self, energyMin_eV, energyMax_eV, atomicNumbers=None, isOpen=False):
+        start, stop = self.getRangeBounds(energyMin_eV, energyMax_eV, isOpen)
+        indices = np.arange(start, stop)
+        if atomicNumbers is not None:
+            indices = indices[np.isin(self.atomicNumbers[start:stop], atomicNumbers)]
+
+        return indices
+
+    def getNearestIndices(self, energy_eV, limit_eV, atomicNumbers=None):
+        """
+        Return the positions of the entries within `limit_eV` of `energy_eV`, nearest first.
+        """
+        indices = self.getIndicesInRange(energy_eV - limit_eV, energy_eV + limit_eV, atomicNumbers)
+        distances_eV = np.abs(self.energies_eV[indices] - energy_eV)
+
+        return indices[np.argsort(distances_eV, kind='stable')]
+
+    def getEntries(self, indices):
+        return [(atomicNumber, name, energy_eV) for atomicNumber, name, energy_eV in
+                zip(self.atomicNumbers[indices].tolist(), self.names[indices].tolist(), self.energies_eV[indices].tolist())]
 
 class XRayTransitionData(object):
     def __init__(self):
@@ -56,79 +250,157 @@ class XRayTransitionData(object):
 
     def readLineFile(self, filename):
         # pylint: disable-msg=W0201
-        reader = csv.reader(open(filename, 'r'))
+        self.lineTable = readTable(filename, LINE_DTYPE, readLineRows)
+        self._lineData = None
+        self._sortedTransitions = None
+        self._lineEnergyIndex = None
+
+    def readEdgeFile(self, filename):
+        # pylint: disable-msg=W0201
+        self.edgeTable = readTable(filename, EDGE_DTYPE, readEdgeRows)
+        self._edgeData = None
+        self._edgeEnergyIndex = None
 
-        # Extract header
-        row = next(reader)
+    @property
+    def lineData(self):
+        """
+        Dictionary of the lines by atomic number and line name, built from :attr:`lineTable` on first use.
+        """
+        if self._lineData is None:
+            self._lineData = {}
 
-        keys = []
-        for value in row:
-            if value[0] == '#':
-                value = value[1:]
+            for atomicNumber, energy_eV, fraction, line in zip(self.lineTable['atomicNumber'].tolist(), self.lineTable['energy_eV'].tolist(),
+                                                               self.lineTable['fraction'].tolist(), self.lineTable['line'].tolist()):
+                self._lineData.setdefault(atomicNumber, {})
 
-            value = value.strip()
-            value = value.replace(' ', '_')
-            value = value.replace('(', '')
-            value = value.replace(')', '')
+                self._lineData[atomicNumber].setdefault(line, {})
 
-            keys.append(value)
+                self._lineData[atomicNumber][line]['energy_eV'] = energy_eV
+                self._lineData[atomicNumber][line]['fraction'] = fraction
 
-        self.lineData = {}
+        return self._lineData
 
-        for row in reader:
-            try:
-                atomicNumber = int(row[0])
-                energy_eV = float(row[1])
-                fraction = float(row[2])
-                line = row[3]
+    @property
+    def edgeData(self):
+        """
+        Dictionary of the edge energies by atomic number and subshell, built from :attr:`edgeTable` on first use.
+        """
+        if self._edgeData is None:
+            self._edgeData = {}
 
-                self.lineData.setdefault(atomicNumber, {})
+            for atomicNumber, energy_eV, subshell in zip(self.edgeTable['atomicNumber'].tolist(), self.edgeTable['energy_eV'].tolist(),
+                                                         self.edgeTable['subshell'].tolist()):
+                self._edgeData.setdefault(atomicNumber, {})
 
-                self.lineData[atomicNumber].setdefault(line, {})
+                self._edgeData[atomicNumber].setdefault(subshell, energy_eV)
 
-                self.lineData[atomicNumber][line]['energy_eV'] = energy_eV
-                self.lineData[atomicNumber][line]['fraction'] = fraction
+        return self._edgeData
 
-            except ValueError:
-                print(row)
+    def _getSortedTransitions(self):
+        """
+        Return the sorted transitions of each atomic number, building the line index on first use.
 
-    def readEdgeFile(self, filename):
-        # pylint: disable-msg=W0201
-        reader = csv.reader(open(filename, 'r'))
+        The index also has the row of each (atomic number, transition) in :attr:`lineTable`
+        and a memo of the rows found for the transition names queried, see :meth:`extractTransitionKey`.
+        """
+        if self._sortedTransitions is None:
+            self._lineRows = {}
+            for row, (atomicNumber, line) in enumerate(zip(self.lineTable['atomicNumber'].tolist(), self.lineTable['line'].tolist())):
+                self._lineRows[(atomicNumber, line)] = row
 
-        # Extract header
-        row = next(reader)
+            self._transitionRows = {}
+            self._lineEnergies_eV = self.lineTable['energy_eV'].tolist()
+            self._lineFractions = self.lineTable['fraction'].tolist()
 
-        keys = []
-        for value in row:
-            if value[0] == '#':
-                value = value[1:]
+            self._sortedTransitions = {}
+            for atomicNumber, line in self._lineRows:
+                self._sortedTransitions.setdefault(atomicNumber, []).append(line)
+            for transitions in self._sortedTransitions.values():
+                transitions.sort()
 
-            value = value.strip()
-            value = value.replace(' ', '_')
-            value = value.replace('(', '')
-            value = value.replace(')', '')
+        return self._sortedTransitions
 
-            keys.append(value)
+    @property
+    def lineEnergyIndex(self):
+        """
+        :class:`EnergyIndex` of all the transitions, with the energies of :meth:`getTransitionEnergy_eV`.
+        """
+        if self._lineEnergyIndex is None:
+            atomicNumbers = []
+            transitions = []
+            energies_eV = []
+            for atomicNumber, sortedTransitions in self._getSortedTransitions().items():
+                for transition in sortedTransitions:
+                    atomicNumbers.append(atomicNumber)
+                    transitions.append(transition)
+                    energies_eV.append(self._lineEnergies_eV[self._getTransitionRow(atomicNumber, transition)])
 
-        self.edgeData = {}
+            self._lineEnergyIndex = EnergyIndex(atomicNumbers, transitions, energies_eV)
 
-        for row in reader:
-            try:
-                atomicNumber = int(row[0])
-                energy_eV = float(row[1])
-                subshell = row[2]
+        return self._lineEnergyIndex
 
-                subshell = subshell.replace('edge', '')
+    @property
+    def edgeEnergyIndex(self):
+        """
+        :class:`EnergyIndex` of all the subshells, with the energies of :meth:`getIonizationEnergy_eV`.
+        """
+        if self._edgeEnergyIndex is None:
+            atomicNumbers = []
+            subshells = []
+            energies_eV = []
+            for atomicNumber in self.edgeData:
+                for subshell in self.edgeData[atomicNumber]:
+                    atomicNumbers.append(atomicNumber)
+                    subshells.append(subshell)
+                    energies_eV.append(self._getIonizationEnergy_eV(atomicNumber, subshell))
+
+            self._edgeEnergyIndex = EnergyIndex(atomicNumbers, subshells, energies_eV)
 
-                if len(subshell) > 4:
-                    print(atomicNumber, subshell)
+        return self._edgeEnergyIndex
 
-                self.edgeData.setdefault(atomicNumber, {})
+    def getLinesInEnergyRange(self, energyMin_eV, energyMax_eV, atomicNumbers=None):
+        """
+        Return the (atomic number, transition, energy (eV)) of the lines in [min, max], sorted by energy.
+
+        If `atomicNumbers` is given, only the lines of these elements are returned.
+        """
+        indices = self.lineEnergyIndex.getIndicesInRange(energyMin_eV, energyMax_eV, atomicNumbers)
+        return self.lineEnergyIndex.getEntries(indices)
 
-                self.edgeData[atomicNumber].setdefault(subshell, energy_eV)
-            except ValueError:
-                print(row)
+    def getNearestLines(self, energy_eV, limit_eV, atomicNumbers=None):
+        """
+        Return the (atomic number, transition, energy (eV)) of the lines within `limit_eV` of `energy_eV`, nearest first.
+        """
+        indices = self.lineEnergyIndex.getNearestIndices(energy_eV, limit_eV, atomicNumbers)
+        return self.lineEnergyIndex.getEntries(indices)
+
+    def getEdgesInEnergyRange(self, energyMin_eV, energyMax_eV, atomicNumbers=None):
+        """
+        Return the (atomic number, subshell, energy (eV)) of the edges in [min, max], sorted by energy.
+        """
+        indices = self.edgeEnergyIndex.getIndicesInRange(energyMin_eV, energyMax_eV, atomicNumbers)
+        return self.edgeEnergyIndex.getEntries(indices)
+
+    def getNearestEdges(self, energy_eV, limit_eV, atomicNumbers=None):
+        """
+        Return the (atomic number, subshell, energy (eV)) of the edges within `limit_eV` of `energy_eV`, nearest first.
+        """
+        indices = self.edgeEnergyIndex.getNearestIndices(energy_eV, limit_eV, atomicNumbers)
+        return self.edgeEnergyIndex.getEntries(indices)
+
+    def _getTransitionRow(self, atomicNumber, transitionName):
+        """
+        Return the row of the transition in :attr:`lineTable`, or -1 if the transition does not exist.
+        """
+        self._getSortedTransitions()
+
+        try:
+            return self._transitionRows[(atomicNumber, transitionName)]
+        except KeyError:
+            transitionKey = self.extractTransitionKey(atomicNumber, transitionName)
+            row = self._lineRows.get((atomicNumber, transitionKey), -1)
+            self._transitionRows[(atomicNumber, transitionName)] = row
+            return row
 
     def readFiles(self):
         data_path = get_current_module_path(__file__, "../../../data/")
@@ -155,16 +427,14 @@ class XRayTransitionData(object):
         return atomicNumbers
 
     def getSubshellFromEnergy(self, atomicNumber, energy_eV, limit_eV=100.0):
-        subshells = self.getSubshell(atomicNumber)
-
         if atomicNumber == 92:
             limit_eV = 500
 
-        for subshell in subshells:
-            subshellEnergy_eV = self.getIonizationEnergy_eV(atomicNumber, subshell)
-
-            if energy_eV > (subshellEnergy_eV - limit_eV) and energy_eV < (subshellEnergy_eV + limit_eV):
-                return subshell
+        # First subshell of the element, in the order of getSubshell(), within the limit.
+        indices = self.edgeEnergyIndex.getIndicesInRange(energy_eV - limit_eV, energy_eV + limit_eV, [atomicNumber], isOpen=True)
+        if len(indices) > 0:
+            index = indices[np.argmin(self.edgeEnergyIndex.order[indices])]
+            return str(self.edgeEnergyIndex.names[index])
 
     def getSubshell(self, atomicNumbers=None):
         subshells = []
@@ -190,13 +460,11 @@ class XRayTransitionData(object):
         return subshells
 
     def getTransitionFromEnergy(self, atomicNumber, energy_eV, limit_eV=10.0):
-        transitions = self.getTransition(atomicNumber)
-
-        for transitionName in transitions:
-            lineEnergy_eV = self.getTransitionEnergy_eV(atomicNumber, transitionName)
-
-            if energy_eV > (lineEnergy_eV - limit_eV) and energy_eV < (lineEnergy_eV + limit_eV):
-                return transitionName
+        # First transition of the element, in the order of getTransition(), within the limit.
+        indices = self.lineEnergyIndex.getIndicesInRange(energy_eV - limit_eV, energy_eV + limit_eV, [atomicNumber], isOpen=True)
+        if len(indices) > 0:
+            index = indices[np.argmin(self.lineEnergyIndex.order[indices])]
+            return str(self.lineEnergyIndex.names[index])
 
     def getTransition(self, atomicNumbers=None, restricted=False):
         transitions = []
@@ -221,13 +489,11 @@ class XRayTransitionData(object):
                                 transitions.append(transition)
         else:
             atomicNumber = atomicNumbers
-            if atomicNumber in self.lineData:
-                for transition in self.lineData[atomicNumber]:
-                    if not transition in transitions:
-                        if not restricted:
-                            transitions.append(transition)
-                        elif transition in self.restrictedXRayLines:
-                            transitions.append(transition)
+            for transition in self._getSortedTransitions().get(atomicNumber, []):
+                if not restricted:
+                    transitions.append(transition)
+                elif transition in self.restrictedXRayLines:
+                    transitions.append(transition)
 
         transitions.sort()
 
@@ -323,12 +589,7 @@ class XRayTransitionData(object):
             return XRayDataWinxray.getIonizationEnergy_eV(atomicNumber, subshell)
 
     def extractTransitionKey(self, atomicNumber, transitionName):
-
-        transitions = self.getTransition(atomicNumber)
-
-        transitions.sort()
-
-        for transition in transitions:
+        for transition in self._getSortedTransitions().get(atomicNumber, []):
             if transitionName in transition:
                 return transition
 
@@ -343,11 +604,9 @@ class XRayTransitionData(object):
         return self._getTransitionEnergy_eV(atomicNumber, transitionName)
 
     def _getTransitionEnergy_eV(self, atomicNumber, transitionName):
-        if atomicNumber in self.lineData:
-            transitionKey = self.extractTransitionKey(atomicNumber, transitionName)
-
-            if transitionKey in self.lineData[atomicNumber]:
-                return self.lineData[atomicNumber][transitionKey]['energy_eV']
+        row = self._getTransitionRow(atomicNumber, transitionName)
+        if row >= 0:
+            return self._lineEnergies_eV[row]
 
         message = "No data for the atomic number %i" % (atomicNumber)
         warnings.warn(message)
@@ -355,10 +614,49 @@ class XRayTransitionData(object):
         return 0.0
 
     def getTransitionFraction(self, atomicNumber, transitionName):
+        row = self._getTransitionRow(atomicNumber, transitionName)
+        if row < 0:
+            raise KeyError((atomicNumber, transitionName))
+
+        return self._lineFractions[row]
+
+    def getTransitionRows(self, elements, transitionNames):
+        """
+        Return the rows in :attr:`lineTable` of many (element, transition name) pairs, -1 for the missing transitions.
 
-        transitionKey = self.extractTransitionKey(atomicNumber, transitionName)
+        The elements are atomic numbers or symbols and the transition names are matched
+        as in :meth:`getTransitionEnergy_eV`.
+        """
+        rows = np.empty(len(transitionNames), dtype=np.intp)
+        for index, (element, transitionName) in enumerate(zip(elements, transitionNames)):
+            if isinstance(element, str):
+                element = ElementProperties.getAtomicNumberBySymbol(element)
+            rows[index] = self._getTransitionRow(int(element), transitionName)
+
+        return rows
+
+    def getTransitionEnergies_eV(self, elements, transitionNames):
+        """
+        Return the energies (eV) of many (element, transition name) pairs as an array, 0.0 for the missing transitions.
+        """
+        rows = self.getTransitionRows(elements, transitionNames)
+        isMissing = rows < 0
+        if np.any(isMissing):
+            message = "No data for %i of the transitions" % (np.count_nonzero(isMissing))
+            warnings.warn(message)
+
+        return np.where(isMissing, 0.0, self.lineTable['energy_eV'][rows])
+
+    def getTransitionFractions(self, elements, transitionNames):
+        """
+        Return the fractions of many (element, transition name) pairs as an array.
+        """
+        rows = self.getTransitionRows(elements, transitionNames)
+        if np.any(rows < 0):
+            index = int(np.flatnonzero(rows < 0)[0])
+            raise KeyError((elements[index], transitionNames[index]))
 
-        return self.lineData[atomicNumber][transitionKey]['fraction']
+        return self.lineTable['fraction'][rows]
 
     def getSubshellEnergies(self, atomicNumber, subshell, restricted=True):
         """
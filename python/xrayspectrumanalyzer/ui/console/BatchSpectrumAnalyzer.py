@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+"""
+.. py:currentmodule:: BatchSpectrumAnalyzer
+.. moduleauthor:: Hendrix Demers <hendrix.demers@mail.mcgill.ca>
+
+Analyze many spectra with the same configuration in a pool of processes.
+"""
+
+###############################################################################
+# Copyright 2016 Hendrix Demers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###############################################################################
+
+# Standard library modules.
+import logging
+import os.path
+import csv
+import glob
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+# Third party modules.
+
+# Local modules.
+from xrayspectrumanalyzer import createPath
+
+# Project modules
+import xrayspectrumanalyzer.ui.console.SpectrumAnalyzer as SpectrumAnalyzer
+import xrayspectrumanalyzer.tools.FitResultCache as FitResultCache
+
+# Globals and constants variables.
+SPECTRUM_FORMAT_EMSA = "spectrumFormatEmsa"
+SPECTRUM_FORMAT_BRUKER = "spectrumFormatBruker"
+SPECTRUM_FORMAT_MCXRAY = "spectrumFormatMcXray"
+
+_SPECTRUM_READERS = {SPECTRUM_FORMAT_EMSA: "readSpectrum",
+                     SPECTRUM_FORMAT_BRUKER: "readExportedBrukerSpectrum",
+                     SPECTRUM_FORMAT_MCXRAY: "readExportedMcXraySpectrum"}
+
+# Number of spectra submitted to the pool for each worker, the results of the other spectra are not kept in memory.
+PENDING_SPECTRA_PER_WORKER = 4
+
+_batchWorker = None
+
+def _createBatchAnalyzer(configuration):
+    try:
+        return createSpectrumAnalyzer(configuration)
+    except Exception:
+        # The error is reported for each spectrum by analyzeSpectrum().
+        return None
+
+def _initializeBatchWorker(configuration):
+    global _batchWorker
+    _batchWorker = (configuration, _createBatchAnalyzer(configuration))
+
+def _analyzeSpectrumWorker(spectrumFilepath):
+    configuration, spectrumAnalyzer = _batchWorker
+    return analyzeSpectrum(configuration, spectrumFilepath, spectrumAnalyzer)
+
+def createSpectrumAnalyzer(configuration, spectrumFilepath=None):
+    """
+    Create a :class:`SpectrumAnalyzer` from a configuration and read the spectrum, if given.
+
+    The analyzer can be used for other spectra with :func:`setSpectrum`.
+    """
+    spectrumAnalyzer = SpectrumAnalyzer.SpectrumAnalyzer(outputPath=configuration["outputPath"], headless=configuration["headless"])
+
+    for symbol in configuration["elements"]:
+        spectrumAnalyzer.addElement(symbol)
+    for symbol, peakLabel in configuration["requiredPeaks"]:
+        spectrumAnalyzer.addRequiredPeak(symbol, peakLabel)
+    for symbol, peakLabel in configuration["omittedPeaks"]:
+        spectrumAnalyzer.addOmittedPeak(symbol, peakLabel)
+
+    electronicNoise_eV, FanoFactor = configuration["detector"]
+    spectrumAnalyzer.setDetector(electronicNoise_eV, FanoFactor)
+
+    spectrumAnalyzer.fitMethod = configuration["fitMethod"]
+    spectrumAnalyzer.fitBackend = configuration["fitBackend"]
+    spectrumAnalyzer.hasDoubleCarbonPeak = configuration["hasDoubleCarbonPeak"]
+    spectrumAnalyzer.maximumEnergy_keV = configuration["maximumEnergy_keV"]
+
+    if configuration.get("fitResultCachePath") is not None:
+        spectrumAnalyzer.fitResultCache = FitResultCache.FitResultCache(configuration["fitResultCachePath"], configuration["fitResultCacheMaximumSize_MB"])
+
+    spectrumAnalyzer.setRoiFitPlans(configuration.get("roiFitPlans", {}))
+    setSpectrum(spectrumAnalyzer, configuration, spectrumFilepath)
+
+    return spectrumAnalyzer
+
+def setSpectrum(spectrumAnalyzer, configuration, spectrumFilepath=None):
+    """
+    Read the spectrum, if given, and add the ROIs of the configuration to an analyzer of :func:`createSpectrumAnalyzer`.
+
+    The spectrum is read before the ROIs are added, as reading a Bruker spectrum sets the maximum energy.
+    """
+    if spectrumAnalyzer.maximumEnergy_keV != configuration["maximumEnergy_keV"]:
+        spectrumAnalyzer.maximumEnergy_keV = configuration["maximumEnergy_keV"]
+
+    if spectrumFilepath is not None:
+        readSpectrum = getattr(spectrumAnalyzer, _SPECTRUM_READERS[configuration["spectrumFormat"]])
+        readSpectrum(spectrumFilepath)
+
+    spectrumAnalyzer.clearRois()
+    for label, energyRange_keV, no_background in configuration["rois"]:
+        spectrumAnalyzer.addRoi(label, energyRange_keV, no_background)
+
+def analyzeSpectrum(configuration, spectrumFilepath, spectrumAnalyzer=None):
+    """
+    Return the :class:`PeakIntensityTable` of one spectrum and the error message, if the analysis failed.
+
+    The spectrum is analyzed by `spectrumAnalyzer`, created by :func:`createSpectrumAnalyzer` for the configuration,
+    or by a new analyzer.
+    """
+    try:
+        if spectrumAnalyzer is None:
+            spectrumAnalyzer = createSpectrumAnalyzer(configuration, spectrumFilepath)
+        else:
+            setSpectrum(spectrumAnalyzer, configuration, spectrumFilepath)
+        peakIntensities = spectrumAnalyzer.fitSpectrum(spectrumFilepath)
+        return SpectrumAnalyzer.createPeakIntensityTable(peakIntensities), None
+    except Exception as message:
+        logging.error("Analysis failed for %s:\n%s", spectrumFilepath, traceback.format_exc())
+        return SpectrumAnalyzer.PeakIntensityTable(), "%s: %s" % (type(message).__name__, message)
+
+class BatchSpectrumAnalyzer(object):
+    def __init__(self, outputPath, numberWorkers=None):
+        self._outputPath = createPath(outputPath)
+        self.numberWorkers = numberWorkers
+
+        self.fitMethod = SpectrumAnalyzer.FIT_METHOD_PEAK
+        self.fitBackend = SpectrumAnalyzer.FIT_BACKEND_LMFIT
+        self.spectrumFormat = SPECTRUM_FORMAT_EMSA
+        self.headless = True
+        self.hasDoubleCarbonPeak = False
+        self.maximumEnergy_keV = None
+        self.fitResultCachePath = None
+        self.fitResultCacheMaximumSize_MB = 100.0
+
+        self._elements = []
+        self._rois = []
+        self._requiredPeaks = []
+        self._omittedPeaks = []
+        self._detector = None
+
+        self._errors = {}
+
+    def addElement(self, symbol):
+        self._elements.append(symbol)
+
+    def addRequiredPeak(self, symbol, peakLabel):
+        self._requiredPeaks.append((symbol, peakLabel))
+
+    def addOmittedPeak(self, symbol, peakLabel):
+        self._omittedPeaks.append((symbol, peakLabel))
+
+    def addRoi(self, label, energyRange_keV, no_background=False):
+        self._rois.append((label, energyRange_keV, no_background))
+
+    def setDetector(self, electronicNoise_eV, FanoFactor):
+        self._detector = (electronicNoise_eV, FanoFactor)
+
+    def getConfiguration(self):
+        """
+        Return the configuration sent to the workers, a dictionary of picklable values.
+        """
+        configuration = {}
+        configuration["outputPath"] = self._outputPath
+        configuration["elements"] = list(self._elements)
+        configuration["rois"] = list(self._rois)
+        configuration["requiredPeaks"] = list(self._requiredPeaks)
+        configuration["omittedPeaks"] = list(self._omittedPeaks)
+        configuration["detector"] = self._detector
+        configuration["fitMethod"] = self.fitMethod
+        configuration["fitBackend"] = self.fitBackend
+        configuration["spectrumFormat"] = self.spectrumFormat
+        configuration["headless"] = self.headless
+        configuration["hasDoubleCarbonPeak"] = self.hasDoubleCarbonPeak
+        configuration["maximumEnergy_keV"] = self.maximumEnergy_keV
+        configuration["fitResultCachePath"] = self.fitResultCachePath
+        configuration["fitResultCacheMaximumSize_MB"] = self.fitResultCacheMaximumSize_MB
+
+        return configuration
+
+    def analyze(self, spectrumFilepaths, resultsFilename="PeakIntensities.csv"):
+        """
+        Analyze the spectra and save all the peak intensities in one file.
+
+        `spectrumFilepaths` is a list of files or a glob pattern. A spectrum that fails is
+        skipped and its error is kept in :attr:`errors` and saved in `Errors.csv`.
+
+        :return: the rows of the results file, the spectrum filepath followed by the peak intensity values.
+        """
+        rows = []
+        for spectrumFilepath, peakIntensityTable, _error in self.analyzeIter(spectrumFilepaths, resultsFilename):
+            for peakIntensityRow in peakIntensityTable.getRows():
+                rows.append([spectrumFilepath] + peakIntensityRow)
+
+        return rows
+
+    def analyzeIter(self, spectrumFilepaths, resultsFilename="PeakIntensities.csv"):
+        """
+        Analyze the spectra and yield the (spectrum filepath, :class:`PeakIntensityTable`, error) of each spectrum.
+
+        The spectra are yielded in order, the rows of each spectrum are appended to the results file before it is
+        yielded. The errors are saved when all the spectra are analyzed.
+        """
+        if isinstance(spectrumFilepaths, str):
+            spectrumFilepaths = sorted(glob.glob(spectrumFilepaths))
+        assert self._detector is not None, "setDetector() must be called before analyze()"
+
+        configuration = self.getConfiguration()
+        configuration["roiFitPlans"] = self._compileRoiFitPlans(configuration)
+        logging.info("Batch analysis of %i spectra", len(spectrumFilepaths))
+
+        self._errors = {}
+        resultsFilepath = os.path.join(self._outputPath, resultsFilename)
+        with SpectrumAnalyzer.PeakIntensityWriter(resultsFilepath, ["Spectrum"] + SpectrumAnalyzer.PEAK_INTENSITIES_HEADER) as writer:
+            for spectrumFilepath, (peakIntensityTable, error) in zip(spectrumFilepaths, self._analyzeSpectra(configuration, spectrumFilepaths)):
+                if error is not None:
+                    self._errors[spectrumFilepath] = error
+                writer.writeRows([spectrumFilepath] + peakIntensityRow for peakIntensityRow in peakIntensityTable.getRows())
+                yield spectrumFilepath, peakIntensityTable, error
+
+        if len(self._errors) > 0:
+            logging.warning("Batch analysis failed for %i of %i spectra", len(self._errors), len(spectrumFilepaths))
+            errorRows = [[spectrumFilepath, self._errors[spectrumFilepath]] for spectrumFilepath in spectrumFilepaths if spectrumFilepath in self._errors]
+            self._saveRows("Errors.csv", ["Spectrum", "Error"], errorRows)
+
+    def _compileRoiFitPlans(self, configuration):
+        """
+        Return the ROI fit plans compiled once for all the spectra.
+
+        If the compilation fails, the plans are compiled for each spectrum and the error is reported for each one.
+        """
+        try:
+            return createSpectrumAnalyzer(configuration).getRoiFitPlans()
+        except Exception as message:
+            logging.warning("ROI fit plans not compiled: %s", message)
+            return {}
+
+    def _analyzeSpectra(self, configuration, spectrumFilepaths):
+        """
+        Yield the (peak intensity table, error) of each spectrum, in the order of `spectrumFilepaths`.
+
+        The analyzer is created once by each worker. At most :data:`PENDING_SPECTRA_PER_WORKER` spectra
+        per worker are submitted ahead of the spectrum yielded.
+        """
+        if self.numberWorkers == 1:
+            spectrumAnalyzer = _createBatchAnalyzer(configuration)
+            for spectrumFilepath in spectrumFilepaths:
+                yield analyzeSpectrum(configuration, spectrumFilepath, spectrumAnalyzer)
+            return
+
+        numberWorkers = self.numberWorkers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=numberWorkers, initializer=_initializeBatchWorker, initargs=(configuration,)) as executor:
+            def submit(spectrumFilepath):
+                try:
+                    return executor.submit(_analyzeSpectrumWorker, spectrumFilepath)
+                except Exception as message:
+                    # The pool is broken, the spectrum fails as the ones already submitted.
+                    future = Future()
+                    future.set_exception(message)
+                    return future
+
+            spectrumFilepathsIter = iter(spectrumFilepaths)
+            futures = deque()
+            for spectrumFilepath in spectrumFilepathsIter:
+                futures.append((spectrumFilepath, submit(spectrumFilepath)))
+                if len(futures) >= numberWorkers*PENDING_SPECTRA_PER_WORKER:
+                    break
+
+            while len(futures) > 0:
+                spectrumFilepath, future = futures.popleft()
+                # A worker that dies (e.g. out of memory) raises here instead of in analyzeSpectrum().
+                try:
+                    result = future.result()
+                except Exception as message:
+                    logging.error("Analysis failed for %s: %s", spectrumFilepath, message)
+                    result = (SpectrumAnalyzer.PeakIntensityTable(), "%s: %s" % (type(message).__name__, message))
+                del future
+
+                for nextSpectrumFilepath in spectrumFilepathsIter:
+                    futures.append((nextSpectrumFilepath, submit(nextSpectrumFilepath)))
+                    break
+
+                yield result
+
+    def _saveRows(self, filename, rowHeader, rows):
+        filepath = os.path.join(self._outputPath, filename)
+        with open(filepath, 'w', newline='\n') as outputFile:
+            writer = csv.writer(outputFile)
+            writer.writerow(rowHeader)
+            writer.writerows(rows)
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def numberWorkers(self):
+        return self._numberWorkers
+    @numberWorkers.setter
+    def numberWorkers(self, numberWorkers):
+        self._numberWorkers = numberWorkers
+
+    @property
+    def fitMethod(self):
+        return self._fitMethod
+    @fitMethod.setter
+    def fitMethod(self, fitMethod):
+        self._fitMethod = fitMethod
+
+    @property
+    def fitBackend(self):
+        return self._fitBackend
+    @fitBackend.setter
+    def fitBackend(self, fitBackend):
+        self._fitBackend = fitBackend
+
+    @property
+    def spectrumFormat(self):
+        return self._spectrumFormat
+    @spectrumFormat.setter
+    def spectrumFormat(self, spectrumFormat):
+        self._spectrumFormat = spectrumFormat
+
+    @property
+    def headless(self):
+        return self._headless
+    @headless.setter
+    def headless(self, headless):
+        self._headless = headless
+
+    @property
+    def hasDoubleCarbonPeak(self):
+        return self._hasDoubleCarbonPeak
+    @hasDoubleCarbonPeak.setter
+    def hasDoubleCarbonPeak(self, hasDoubleCarbonPeak):
+        self._hasDoubleCarbonPeak = hasDoubleCarbonPeak
+
+    @property
+    def maximumEnergy_keV(self):
+        return self._maximumEnergy_keV
+    @maximumEnergy_keV.setter
+    def maximumEnergy_keV(self, maximumEnergy_keV):
+        self._maximumEnergy_keV = maximumEnergy_keV
+
+    @property
+    def fitResultCachePath(self):
+        return self._fitResultCachePath
+    @fitResultCachePath.setter
+    def fitResultCachePath(self, fitResultCachePath):
+        self._fitResultCachePath = fitResultCachePath
+
+    @property
+    def fitResultCacheMaximumSize_MB(self):
+        return self._fitResultCacheMaximumSize_MB
+    @fitResultCacheMaximumSize_MB.setter
+    def fitResultCacheMaximumSize_MB(self, fitResultCacheMaximumSize_MB):
+        self._fitResultCacheMaximumSize_MB = fitResultCacheMaximumSize_MB
@@ -27,14 +27,12 @@ import logging
 import os.path
 import math
 import csv
+import copy
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Third party modules.
-#import matplotlib
-#matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.text import OffsetFrom
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.optimize import least_squares, lsq_linear
 
 from lmfit import minimize, Parameters
 
@@ -46,8 +44,12 @@ import pySpectrumFileFormat.Bruker.ExportedCsvFile as ExportedCsvFile
 from xrayspectrumanalyzer import get_current_module_path, createPath
 from xrayspectrumanalyzer import saveFigureData
 
-from xrayspectrumanalyzer.tools.FitPolynomialFunction import PolynomialFirstDegreeFunction
-from xrayspectrumanalyzer.tools.FitGaussianFunction import GaussianFunction
+from xrayspectrumanalyzer.tools.FitMultiGaussianFunction import MultiGaussianFunction, BatchMultiGaussianFunction
+from xrayspectrumanalyzer.tools.FitSparseSpectrumFunction import SparseSpectrumFunction
+import xrayspectrumanalyzer.tools.EnergyAxis as EnergyAxis
+import xrayspectrumanalyzer.tools.FitLeastSquares as FitLeastSquares
+import xrayspectrumanalyzer.tools.SpectrumCube as SpectrumCube
+import xrayspectrumanalyzer.tools.FitResultCache as FitResultCache
 
 # Project modules
 import xrayspectrumanalyzer.ui.console.XrayLineReferenceManager as XrayLineReferenceManager
@@ -56,59 +58,206 @@ import xrayspectrumanalyzer.ui.console.XrayLineReferenceManager as XrayLineRefer
 DEBUG = False
 
 FIT_METHOD_PEAK = "fitMethodPeak"
+FIT_METHOD_PEAK_PROJECTION = "fitMethodPeakProjection"
 FIT_METHOD_PEAK_FAMILY = "fitMethodPeakFamily"
 FIT_METHOD_ROI = "fitMethodRoi"
 FIT_METHOD_SPECTRUM = "fitMethodSpectrum"
 
+FIT_BACKEND_LMFIT = "fitBackendLmfit"
+FIT_BACKEND_LEAST_SQUARES = "fitBackendLeastSquares"
+FIT_BACKEND_BATCH = "fitBackendBatch"
+
 ROI_CARBON_DOUBLE_PEAKS = "Roi DC K"
+ROI_SPECTRUM = "Spectrum"
+
+WARM_START_BOUND_MARGIN = 0.05
+
+PEAK_INTENSITIES_HEADER = ["Line", "Counts", "Background", "Position (keV)", "FWHM (eV)", "Counts (1.2*FWHM)", "Background (1.2*FWHM)"]
+
+_roiWorker = None
+_cubeWorker = None
+
+def _initializeRoiWorker(spectrumAnalyzer):
+    global _roiWorker
+
+    _roiWorker = spectrumAnalyzer
+
+def _fitRoiWorker(roi, plan, xRoi, yRoi, warmStartFit):
+    spectrumAnalyzer = _roiWorker
+    spectrumAnalyzer._roiFitPlans[roi.label] = plan
+    spectrumAnalyzer._warmStartFits.pop(roi.label, None)
+    if warmStartFit is not None:
+        spectrumAnalyzer._warmStartFits[roi.label] = warmStartFit
+
+    # The ROI fits are returned without their figure file, the parent process saves or keeps them.
+    spectrumAnalyzer._roiFits = []
+    spectrumAnalyzer._cachedRoiFits = []
+    try:
+        peakIntensities = spectrumAnalyzer._fitRoiData(roi, None, None, xRoi, yRoi)
+        roiFits = spectrumAnalyzer._cachedRoiFits
+    finally:
+        spectrumAnalyzer._cachedRoiFits = None
+
+    return peakIntensities, roiFits, spectrumAnalyzer._warmStartFits.get(roi.label)
+
+def _initializeCubeWorker(spectrumAnalyzer, rplFilepath, rawFilepath, binning, name, shape, labels):
+    global _cubeWorker
+
+    spectrumAnalyzer.numberRoiWorkers = 1
+    cube = SpectrumCube.SpectrumCube(rplFilepath, rawFilepath)
+    # The maps are created by the parent process, each worker writes its tiles in them.
+    peakIntensityMaps = PeakIntensityMaps(spectrumAnalyzer._outputPath, name, shape, labels, isResumed=True)
+    _cubeWorker = (spectrumAnalyzer, cube, binning, peakIntensityMaps)
+
+def _fitTileWorker(tile):
+    spectrumAnalyzer, cube, binning, peakIntensityMaps = _cubeWorker
+    spectrumAnalyzer._fitSpectrumCubeTile(cube, tile, binning, peakIntensityMaps)
+
+    return tile
+
+def _getParameterValues(parameters):
+    return np.array([parameter.value for parameter in parameters.values()])
+
+def computeLinearBackgroundGuess(xRoi, yRoi):
+    x1 = xRoi[0]
+    x2 = xRoi[-1]
+    y1 = yRoi[0]
+    y2 = yRoi[-1]
+
+    bGuess = (y2 - y1)/(x2 - x1)
+    aGuess = y1 - bGuess*x1
+
+    return aGuess, bGuess
+
+def _minimizeModel(parameters, functionModel, functionJacobian, x, data, maximumEvaluations=None):
+    """
+    Least-squares fit of `data` with an analytic Jacobian.
+
+    `functionModel(values, x)` returns the model and `functionJacobian(values, x)` its
+    (nparameters x nchannels) derivatives, where `values` holds all the parameters in
+    the order of `parameters`. The fit is aborted, and not successful, after `maximumEvaluations`.
+    """
+    varyIndices = np.array([index for index, parameter in enumerate(parameters.values()) if parameter.vary], dtype=int)
+
+    def residual(parameters, x, data):
+        model = functionModel(_getParameterValues(parameters), x)
+        return (data-model)
+
+    def jacobian(parameters, x, data):
+        return -functionJacobian(_getParameterValues(parameters), x)[varyIndices]
+
+    return minimize(residual, parameters, args=(x, data), Dfun=jacobian, col_deriv=1, max_nfev=maximumEvaluations)
+
+class RoiPeakCurves(object):
+    """
+    Fitted curves of a ROI shared by the :class:`PeakIntensity` of its peaks.
+
+    Only the axis, the background and the fitted `model` (a :class:`MultiGaussianFunction`) are kept,
+    the curve of a peak is evaluated when it is needed.
+    """
+    __slots__ = ('xData', 'yBackground', 'model', '_windowIntegrator')
+
+    def __init__(self, xData, yBackground, model):
+        self.xData = xData
+        self.yBackground = yBackground
+        self.model = model
+        self._windowIntegrator = None
+
+    def getPeak(self, index):
+        return self.model.peak(self.xData, index)
+
+    def getWindowIntegrator(self):
+        """
+        Return the :class:`WindowIntegrator` of the peaks with the background on the last row.
+        """
+        if self._windowIntegrator is None:
+            curves = np.vstack((self.model.peaks(self.xData), self.yBackground))
+            self._windowIntegrator = EnergyAxis.WindowIntegrator(self.xData, curves)
+        return self._windowIntegrator
 
 class PeakIntensity(object):
+    """
+    Intensity of a fitted peak.
+
+    The arrays are kept by reference, the peaks of a ROI share its axis and background. With `peakCurves`,
+    a :class:`RoiPeakCurves`, `yData` can be None and the peak curve is evaluated from the fitted model when used.
+    """
+    __slots__ = ('_xData', '_yData', '_yBackground', '_position_keV', '_sigma_keV', '_label',
+                 '_windowSlices', '_peakCurves', '_peakIndex')
+
     _numericFactor = 2.0 * math.sqrt(2.0 * math.log(2.0))
 
-    def __init__(self, xData, yData, yBackground, position_keV, sigma_keV, label):
+    def __init__(self, xData, yData, yBackground, position_keV, sigma_keV, label, peakCurves=None, peakIndex=None):
+        self._windowSlices = EnergyAxis.EnergySliceCache()
+        self._peakCurves = None
         self.xData = xData
         self.yData = yData
         self.yBackground = yBackground
         self.position_keV = position_keV
         self.sigma_keV = sigma_keV
         self.label = label
+        self._peakCurves = peakCurves
+        self._peakIndex = peakIndex
 
     def countsFromFixedWidth(self, width_keV):
-        v1 = self.position_keV - width_keV/2.0
-        v2 = self.position_keV + width_keV/2.0
-        maskArray = np.ma.masked_outside(self.xData, v1, v2)
+        if self._peakCurves is not None:
+            v1, v2 = self._getWindow_keV(width_keV)
+            return self._peakCurves.getWindowIntegrator().integrate(v1, v2, index=self._peakIndex)
 
-        counts = np.sum(self.yData[~maskArray.mask])
+        counts = np.sum(self.yData[self._getWindowSlice(width_keV)])
         return counts
 
     def countsBackgroundFromFixedWidth(self, width_keV):
+        if self._peakCurves is not None:
+            v1, v2 = self._getWindow_keV(width_keV)
+            return self._peakCurves.getWindowIntegrator().integrate(v1, v2, index=-1)
+
+        counts = np.sum(self.yBackground[self._getWindowSlice(width_keV)])
+        return counts
+
+    def _getWindow_keV(self, width_keV):
         v1 = self.position_keV - width_keV/2.0
         v2 = self.position_keV + width_keV/2.0
-        maskArray = np.ma.masked_outside(self.xData, v1, v2)
+        return v1, v2
 
-        counts = np.sum(self.yBackground[~maskArray.mask])
-        return counts
+    def _getWindowSlice(self, width_keV):
+        v1, v2 = self._getWindow_keV(width_keV)
+        return self._windowSlices.getSlice(self.xData, v1, v2)
+
+    def _detachPeakCurves(self):
+        """
+        Keep the peak curve before one of the curves is changed, the shared curves of the ROI are not valid anymore.
+        """
+        if self._peakCurves is not None:
+            if self._yData is None:
+                self._yData = self._peakCurves.getPeak(self._peakIndex)
+            self._peakCurves = None
 
     @property
     def xData(self):
         return self._xData
     @xData.setter
     def xData(self, xData):
-        self._xData = np.array(xData)
+        self._detachPeakCurves()
+        self._xData = np.asarray(xData)
 
     @property
     def yData(self):
+        if self._yData is None and self._peakCurves is not None:
+            return self._peakCurves.getPeak(self._peakIndex)
         return self._yData
     @yData.setter
     def yData(self, yData):
-        self._yData = np.array(yData)
+        self._detachPeakCurves()
+        self._yData = None if yData is None else np.asarray(yData)
 
     @property
     def yBackground(self):
         return self._yBackground
     @yBackground.setter
     def yBackground(self, yBackground):
-        self._yBackground = np.array(yBackground)
+        self._detachPeakCurves()
+        self._yBackground = np.asarray(yBackground)
 
     @property
     def counts(self):
@@ -149,6 +298,12 @@ class PeakIntensity(object):
 
 
 class DetectorFunction(object):
+    """
+    Resolution of the detector.
+
+    The x-ray energies, the electronic noise and the Fano factor can be scalars or arrays,
+    the arrays are broadcast together, e.g. a table of sigma for many energies and detector parameters.
+    """
     def __init__(self, electronicNoise_eV, FanoFactor):
         self._electronicNoise_eV = electronicNoise_eV
         self._FanoFactor = FanoFactor
@@ -158,7 +313,7 @@ class DetectorFunction(object):
     def getFwhm_eV(self, xrayEnergy_eV):
         term1 = self._electronicNoise_eV**2
         term2 = self._numericFactor*self._numericFactor*self._electronHolePair_eV*self._FanoFactor*xrayEnergy_eV
-        fwhm_eV = math.sqrt(term1 + term2)
+        fwhm_eV = np.sqrt(term1 + term2)
 
         return fwhm_eV
 
@@ -171,11 +326,31 @@ class DetectorFunction(object):
 
         return sigma_keV
 
+    def getSigmaDerivatives_keV(self, xrayEnergy_keV):
+        """
+        Return the derivatives of the sigma (keV) with respect to the electronic noise (eV),
+        the Fano factor and the x-ray energy (keV).
+        """
+        xrayEnergy_eV = xrayEnergy_keV*1.0e3
+        fwhm_eV = self.getFwhm_eV(xrayEnergy_eV)
+        factor = 1.0/(fwhm_eV*1.0e3*self._numericFactor)
+        term = self._numericFactor*self._numericFactor*self._electronHolePair_eV
+
+        derivativeElectronicNoise = self._electronicNoise_eV*factor
+        derivativeFanoFactor = 0.5*term*xrayEnergy_eV*factor
+        derivativeEnergy = 0.5*term*self._FanoFactor*1.0e3*factor
+
+        return derivativeElectronicNoise, derivativeFanoFactor, derivativeEnergy
+
     def getElectronicNoise_eV(self):
         return self._electronicNoise_eV
 
+    def getFanoFactor(self):
+        return self._FanoFactor
+
 class Roi(object):
     def __init__(self, label, energyRange_keV, no_background=False):
+        self._roiSlices = EnergyAxis.EnergySliceCache()
         self.label = label
         self.energyRange_keV = energyRange_keV
         self.no_background = no_background
@@ -189,17 +364,27 @@ class Roi(object):
         color = 'g'
         yMin = 0.0
 
+        import matplotlib.pyplot as plt
         plt.axvspan(eMin_keV, eMax_keV, ymin=yMin, ymax=1.0, transform=plt.gca().transData,
                     color=color, linewidth=2, zorder=-20, alpha=0.2)
 
     def getRoiData(self, xData, yData):
-        eMin_keV, eMax_keV = self.energyRange_keV
-        maskArray = np.ma.masked_outside(xData, eMin_keV, eMax_keV)
-        xRoi = xData[~maskArray.mask].copy()
-        yRoi = yData[~maskArray.mask].copy()
+        """
+        Return views of the ROI channels of the increasing energy axis `xData` and of `yData`.
+        """
+        roiSlice = self.getRoiSlice(xData)
+        xRoi = xData[roiSlice]
+        yRoi = yData[roiSlice]
 
         return xRoi, yRoi
 
+    def getRoiSlice(self, xData):
+        """
+        Return the slice of the ROI channels, the slice of the previous axis is reused if it is still valid.
+        """
+        eMin_keV, eMax_keV = self.energyRange_keV
+        return self._roiSlices.getSlice(xData, eMin_keV, eMax_keV)
+
     @property
     def label(self):
         return self._label
@@ -214,8 +399,133 @@ class Roi(object):
     def energyRange_keV(self, energyRange_keV):
         self._energyRange_keV = energyRange_keV
 
+class RoiFitPlan(object):
+    """
+    Peaks and parameters of the fit of a ROI, prepared once for a configuration and used for each spectrum.
+
+    Only the guesses that depend on the spectrum, the linear background and the peak areas or heights,
+    are set by :meth:`getParameters` or :meth:`getValues`. The plan can be pickled, the lmfit parameters
+    are created again after unpickling. The plan is valid while the :attr:`dependencies` of its ROI do not change.
+    """
+    def __init__(self, roi, fitMethod, roiPeaks):
+        self.roi = roi
+        self.fitMethod = fitMethod
+        self.roiPeaks = roiPeaks
+        self.labels = [label for _position_keV, _fraction, label in roiPeaks]
+        self.baseKeys = [label.replace(' ', '_') for label in self.labels]
+        self.dependencies = None
+
+        self._parameterRows = []
+        self._parameterIndices = {}
+        self._hasBackground = False
+        self._areaGuesses = []
+        self._heightKeys = []
+        self._parameters = None
+        self._parameterArrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_parameters'] = None
+        return state
+
+    def add(self, name, value=None, vary=True, min=-np.inf, max=np.inf):
+        """
+        Add a parameter, same arguments as :meth:`lmfit.Parameters.add`.
+        """
+        self._parameterIndices[name] = len(self._parameterRows)
+        self._parameterRows.append((name, value, vary, min, max))
+        self._parameters = None
+        self._parameterArrays = None
+
+    def addBackground(self, vary=True):
+        self.add('lb_a', value=0.0, vary=vary)
+        self.add('lb_b', value=0.0, vary=vary)
+        self._hasBackground = True
+
+    def addArea(self, name, fraction, sigma_keV):
+        """
+        Add a peak area, its guess is the area of a gaussian with a height of `fraction` times the maximum of the ROI data.
+        """
+        self.add(name, value=0.0, min=0.0)
+        self._areaGuesses.append((name, fraction, sigma_keV))
+
+    def addHeight(self, name):
+        """
+        Add a peak height, its guess is the maximum of the ROI data.
+        """
+        self.add(name, value=0.0, min=0.0)
+        self._heightKeys.append(name)
+
+    def getIndices(self, names):
+        return np.array([self._parameterIndices[name] for name in names], dtype=int)
+
+    def getParameterArrays(self):
+        """
+        Return the names of the parameters and the arrays of their initial values, vary flags and bounds.
+        """
+        if self._parameterArrays is None:
+            names = tuple(name for name, _value, _vary, _minimum, _maximum in self._parameterRows)
+            values = np.array([value for _name, value, _vary, _minimum, _maximum in self._parameterRows], dtype=np.float64)
+            vary = np.array([vary for _name, _value, vary, _minimum, _maximum in self._parameterRows], dtype=bool)
+            lowerBounds = np.array([minimum for _name, _value, _vary, minimum, _maximum in self._parameterRows], dtype=np.float64)
+            upperBounds = np.array([maximum for _name, _value, _vary, _minimum, maximum in self._parameterRows], dtype=np.float64)
+            self._parameterArrays = (names, values, vary, lowerBounds, upperBounds)
+
+        return self._parameterArrays
+
+    def getValues(self, xRoi, yRoi, values=None):
+        """
+        Return the values of the parameters with the guesses for the ROI data, clipped to their bounds.
+
+        If `values` is given, e.g. the values of a previous fit, the parameters that vary start from them instead.
+        """
+        _names, guesses, vary, lowerBounds, upperBounds = self.getParameterArrays()
+        guesses = guesses.copy()
+
+        if self._hasBackground:
+            guesses[[self._parameterIndices['lb_a'], self._parameterIndices['lb_b']]] = computeLinearBackgroundGuess(xRoi, yRoi)
+
+        roiMax = np.max(yRoi)
+        for name, fraction, sigma_keV in self._areaGuesses:
+            guesses[self._parameterIndices[name]] = roiMax*fraction*sigma_keV*np.sqrt(2.0 * np.pi)
+        for name in self._heightKeys:
+            guesses[self._parameterIndices[name]] = roiMax
+
+        guesses = np.clip(guesses, lowerBounds, upperBounds)
+
+        # The bounds transformation of lmfit is flat near the bounds, the guess is a better start there.
+        if values is not None:
+            values = np.asarray(values)
+            isBounded = np.logical_and(np.isfinite(lowerBounds), np.isfinite(upperBounds))
+            margins = np.zeros_like(guesses)
+            margins[isBounded] = WARM_START_BOUND_MARGIN*(upperBounds[isBounded] - lowerBounds[isBounded])
+            isWarm = vary & (lowerBounds + margins < values) & (values < upperBounds - margins)
+            guesses[isWarm] = values[isWarm]
+
+        return guesses
+
+    def getParameters(self, xRoi, yRoi, values=None):
+        """
+        Return the parameters with the values of :meth:`getValues`.
+
+        The same :class:`lmfit.Parameters` is returned by each call, lmfit copies it before the fit.
+        """
+        if self._parameters is None:
+            self._parameters = Parameters()
+            for name, value, vary, minimum, maximum in self._parameterRows:
+                self._parameters.add(name, value=value, vary=vary, min=minimum, max=maximum)
+
+        for parameter, value in zip(self._parameters.values(), self.getValues(xRoi, yRoi, values)):
+            parameter.value = value
+
+        return self._parameters
+
+    @property
+    def parameterIndices(self):
+        return self._parameterIndices
+
 class SpectrumAnalyzer(object):
-    def __init__(self, outputPath=None, configurationFilepath=None, keepGraphic=True):
+    def __init__(self, outputPath=None, configurationFilepath=None, keepGraphic=True, headless=False):
         if outputPath is not None:
             self._outputPath = createPath(outputPath)
 
@@ -223,6 +533,9 @@ class SpectrumAnalyzer(object):
         self._keepGraphic = keepGraphic
 
         self._lineRefManager = XrayLineReferenceManager.XrayLineReferenceManager()
+        self._roiFitPlans = {}
+        self._roiDependencies = {}
+        self._detector = None
 
         self.showEdgeMarkers = False
         self.showMajorLineMarkers = True
@@ -234,8 +547,13 @@ class SpectrumAnalyzer(object):
         self.exportRois = False
         self.hasDoubleCarbonPeak = False
         self.maximumEnergy_keV = None
+        self.headless = headless
 
         self.fitMethod = FIT_METHOD_PEAK
+        self.fitBackend = FIT_BACKEND_LMFIT
+        self.numberRoiWorkers = 1
+        self._roiExecutor = None
+        self._roiExecutorConfiguration = None
 
         self._rois = {}
 
@@ -244,33 +562,75 @@ class SpectrumAnalyzer(object):
 
         self._spectrumFilepath = None
         self._spectrum = None
+        self._spectrumReader = "readSpectrum"
+
+        self._roiFits = []
+        # The fits of spectra given as arrays, e.g. the pixels of a cube, have no figure.
+        self._isRoiFitKept = True
+
+        self.fitResultCache = None
+        self._cachedRoiFits = None
+        self.incrementalAnalysis = False
+        self._roiFitResults = {}
+
+        self.warmStart = False
+        self.warmStartMaximumChi2Ratio = 4.0
+        self._warmStartFits = {}
+        self._isWarmStartReferenceFixed = False
 
         self._maximumPositionError_keV = 0.010
 
+        self.spectrumKnotSpacing_keV = 0.5
+        self._spectrumPeakWindowSigmas = 5.0
+        self._spectrumFitTolerance = 1.0e-6
+        self._spectrumLsmrIterations = 50
+
+    def __getstate__(self):
+        # The pool of the ROI workers stays in this process.
+        state = self.__dict__.copy()
+        state['_roiExecutor'] = None
+        state['_roiExecutorConfiguration'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.closeRoiWorkers()
+
     def addElement(self, symbol):
         self._lineRefManager.addElement(symbol)
+        self._resetRoiDependencies()
 
     def addRequiredPeak(self, symbol, peakLabel):
         self._requiredPeaks.append((symbol, peakLabel))
+        self._resetRoiDependencies()
 
     def addOmittedPeak(self, symbol, peakLabel):
         self._omittedPeaks.append((symbol, peakLabel))
+        self._resetRoiDependencies()
 
     def addRoi(self, label, energyRange_keV, no_background=False):
+        # The plan of a ROI added again is kept if its range did not change, see getRoiFitPlan().
         if self.maximumEnergy_keV is not None and energyRange_keV[0] > self.maximumEnergy_keV:
             logging.info("Roi not added, energy range greater than the primary energy")
         else:
             roi = Roi(label, energyRange_keV, no_background)
             self._rois[label] = roi
 
+    def clearRois(self):
+        """
+        Remove all the ROIs, their fit plans are kept for ROIs added again.
+        """
+        self._rois = {}
+
     def readSpectrum(self, spectrumFilepath):
         logging.info("Read spectrum file: %s", spectrumFilepath)
 
-        self._spectrumFilepath = spectrumFilepath
-        self._spectrum = emsaFormat.EmsaFormat(spectrumFilepath)
+        spectrum = emsaFormat.EmsaFormat(spectrumFilepath)
+        self._setSpectrum(spectrumFilepath, spectrum, "readSpectrum")
 
     def readExportedMcXraySpectrum(self, spectrumFilepath):
-        self._spectrumFilepath = spectrumFilepath
         lines = open(spectrumFilepath, 'rb').readlines()
 
         xdata = []
@@ -282,22 +642,38 @@ class SpectrumAnalyzer(object):
             xdata.append(float(items[0]))
             ydata.append(float(items[1]))
 
-        self._spectrum = emsa.EmsaReader()
-        self._spectrum.xdata = xdata
-        self._spectrum.ydata = ydata
+        spectrum = emsa.EmsaReader()
+        spectrum.xdata = xdata
+        spectrum.ydata = ydata
+        self._setSpectrum(spectrumFilepath, spectrum, "readExportedMcXraySpectrum")
 
     def readExportedBrukerSpectrum(self, spectrumFilepath):
         logging.info("Reading spectrum: %s", spectrumFilepath)
 
-        self._spectrumFilepath = spectrumFilepath
+        spectrumBruker = ExportedCsvFile.readSpectrum(spectrumFilepath)
+
+        spectrum = emsa.EmsaReader()
+        spectrum.xdata = spectrumBruker.energies_keV
+        spectrum.ydata = spectrumBruker.countsList
+        self._setSpectrum(spectrumFilepath, spectrum, "readExportedBrukerSpectrum")
 
-        spectrum = ExportedCsvFile.readSpectrum(spectrumFilepath)
+        self.maximumEnergy_keV = spectrumBruker.primaryEnergy_keV
 
-        self._spectrum = emsa.EmsaReader()
-        self._spectrum.xdata = spectrum.energies_keV
-        self._spectrum.ydata = spectrum.countsList
+    def _setSpectrum(self, spectrumFilepath, spectrum, spectrumReader):
+        # Set only when the file was read, a file that cannot be read keeps the previous spectrum.
+        self._spectrumFilepath = spectrumFilepath
+        self._spectrum = spectrum
+        self._spectrumReader = spectrumReader
+
+    def _loadSpectrum(self, spectrumFilepath):
+        """
+        Read the spectrum file, with the reader of the last spectrum read, unless it is the spectrum already read.
+        """
+        if self._spectrum is not None and spectrumFilepath in (None, self._spectrumFilepath):
+            return
 
-        self.maximumEnergy_keV = spectrum.primaryEnergy_keV
+        readSpectrum = getattr(self, self._spectrumReader)
+        readSpectrum(spectrumFilepath)
 
     def plotSpectrum(self, figure=None, yLog=False):
         xData = np.array(self._spectrum.getDataX())
@@ -306,6 +682,7 @@ class SpectrumAnalyzer(object):
 
         yData = np.array(self._spectrum.getDataY())
 
+        import matplotlib.pyplot as plt
         if figure is None:
             figure = plt.figure()
         else:
@@ -346,35 +723,264 @@ class SpectrumAnalyzer(object):
             axes.set_xlim((xMin, self.maximumEnergy_keV))
 
     def fitRoi(self, roiName):
-        xData = np.array(self._spectrum.xdata)
-        yData = np.array(self._spectrum.ydata)
+        """
+        Fit the ROI `roiName` of the spectrum read and return its peak intensities.
+        """
+        xData, yData = self._getSpectrumData()
         roi = self._rois[roiName]
-        self._fitRoi(roi, xData, yData)
+        return self._fitRoi(roi, xData, yData)
 
     def analyze(self, spectrumFilepath):
+        for _roiLabel, _peakIntensities in self.analyzeIter(spectrumFilepath):
+            pass
+
+    def analyzeSeries(self, spectrumFilepaths):
+        """
+        Analyze the spectra of a series in order, each one as with :meth:`analyze`.
+
+        With :attr:`warmStart`, the fits of each spectrum start from the fits of the previous spectrum,
+        see :meth:`setWarmStartReference`.
+        """
+        for spectrumFilepath in spectrumFilepaths:
+            self.analyze(spectrumFilepath)
+
+    def analyzeIter(self, spectrumFilepath):
+        """
+        Fit the ROIs of a spectrum and yield the (ROI label, peak intensities) of each ROI when its fit is done.
+
+        The peak intensities of each ROI are appended to the results file before they are yielded.
+        """
+        self._loadSpectrum(spectrumFilepath)
+
+        with PeakIntensityWriter(self._getPeakIntensitiesFilepath()) as writer:
+            for roiLabel, peakIntensities in self.fitSpectrumIter(spectrumFilepath):
+                writer.writePeakIntensities(peakIntensities)
+                yield roiLabel, peakIntensities
+
+    def fitSpectrum(self, spectrumFilepath):
+        """
+        Fit the ROIs of a spectrum and return the peak intensities without saving them.
+        """
+        peakIntensities = []
+        for _roiLabel, peakIntensitiesRoi in self.fitSpectrumIter(spectrumFilepath):
+            peakIntensities.extend(peakIntensitiesRoi)
+
+        return peakIntensities
+
+    def fitSpectrumIter(self, spectrumFilepath):
+        """
+        Fit the ROIs of a spectrum and yield the (ROI label, peak intensities) of each ROI when its fit is done.
+
+        With :data:`FIT_METHOD_SPECTRUM`, all the peaks are yielded once with the label :data:`ROI_SPECTRUM`.
+
+        The spectrum is read if it is not the spectrum already read, see :meth:`readSpectrum`, and kept for
+        the next analysis, e.g. after a change of the configuration.
+        """
         logging.info("Analyze spectrum: %s", spectrumFilepath)
 
-        if self._spectrumFilepath is None:
-            self.readSpectrum(spectrumFilepath)
+        self._loadSpectrum(spectrumFilepath)
 
         #self.plotSpectrum()
 
+        xData, yData = self._getSpectrumData()
+        self._roiFits = []
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            yield ROI_SPECTRUM, self._fitWholeSpectrum(xData, yData)
+        else:
+            roiNames = list(self._rois)
+            for roiName, peakIntensitiesRoi in zip(roiNames, self._iterFitRois(roiNames, xData, yData)):
+                yield roiName, peakIntensitiesRoi
+
+    def _getSpectrumData(self):
         xData = np.array(self._spectrum.getDataX())
         if self._spectrum.getXUnits() == 'eV':
             xData *= 1.0e-3
         yData = np.array(self._spectrum.getDataY())
-        peakIntensities = []
-        for roiName in self._rois:
-            roi = self._rois[roiName]
-            peakIntensitiesRoi = self._fitRoi(roi, xData, yData)
-            peakIntensities.extend(peakIntensitiesRoi)
-
-        self.savePeakIntensities(peakIntensities)
 
-        del peakIntensitiesRoi
-        del self._spectrum
-        del xData
-        del yData
+        return xData, yData
+
+    def fitSpectrumData(self, xData, yData):
+        """
+        Fit the ROIs of the spectrum `yData` on the energy axis `xData` (keV) in this process and return the peak intensities.
+
+        The spectrum is not read from a file, the figures of the fits are not saved or kept.
+        """
+        self._roiFits = []
+        isRoiFitKept = self._isRoiFitKept
+        self._isRoiFitKept = False
+        try:
+            if self.fitMethod == FIT_METHOD_SPECTRUM:
+                return self._fitWholeSpectrum(xData, yData)
+
+            peakIntensities = []
+            for roi in self._rois.values():
+                peakIntensities.extend(self._fitRoi(roi, xData, yData))
+
+            return peakIntensities
+        finally:
+            self._isRoiFitKept = isRoiFitKept
+
+    def fitSpectraData(self, xData, yDatas):
+        """
+        Fit the ROIs of the spectra, the rows of `yDatas`, on the same energy axis `xData` (keV) and return
+        the peak intensities of each spectrum.
+
+        With :data:`FIT_BACKEND_BATCH` and :data:`FIT_METHOD_PEAK`, each ROI of all the spectra is fitted as
+        one batch by :func:`FitLeastSquares.minimizeBatch`, without warm start, fit result cache and figures of the fits.
+        Otherwise, each spectrum is fitted by :meth:`fitSpectrumData`.
+        """
+        yDatas = np.asarray(yDatas, dtype=np.float64)
+        if self.fitBackend != FIT_BACKEND_BATCH or self.fitMethod != FIT_METHOD_PEAK:
+            return [self.fitSpectrumData(xData, yData) for yData in yDatas]
+
+        self._roiFits = []
+        isRoiFitKept = self._isRoiFitKept
+        self._isRoiFitKept = False
+        try:
+            return self._fitSpectraDataBatch(xData, yDatas)
+        finally:
+            self._isRoiFitKept = isRoiFitKept
+
+    def _fitSpectraDataBatch(self, xData, yDatas):
+        peakIntensitiesSpectra = [[] for _yData in yDatas]
+        for roi in self._rois.values():
+            roiSlice = roi.getRoiSlice(xData)
+            xRoi = xData[roiSlice]
+            if len(xRoi) <= 0:
+                logging.warning("No experimental data for roi: %s", roi.label)
+                continue
+
+            plan = self.getRoiFitPlan(roi)
+            for peakIntensities, peakIntensitiesRoi in zip(peakIntensitiesSpectra, self._fitPeaksBatch(xRoi, yDatas[:, roiSlice], plan)):
+                peakIntensities.extend(peakIntensitiesRoi)
+
+        return peakIntensitiesSpectra
+
+    def analyzeSpectrumCube(self, rplFilepath, binning=1, rawFilepath=None, tileSize=None, numberWorkers=1, maximumMemory_MB=256.0):
+        """
+        Fit the ROIs of each pixel of a RAW/RPL spectrum cube, or of each `binning` x `binning` super-pixel,
+        and save a map of the counts of each line.
+
+        The cube is memory-mapped and processed in square tiles of `tileSize` super-pixels, by `numberWorkers`
+        processes. Without `tileSize`, the tiles read by all the workers fit in `maximumMemory_MB`, see
+        :func:`SpectrumCube.computeTileSize`. The maps are pre-allocated in the output path, see
+        :class:`PeakIntensityMaps`, and the figures of the fits are not kept.
+
+        The tiles done are saved in the checkpoint `<name>_tiles.json`, a job restarted with the same cube,
+        binning, tile size, lines, ROIs and fit configuration only fits the remaining tiles. Otherwise all
+        the tiles are fitted again.
+        """
+        logging.info("Analyze spectrum cube: %s", rplFilepath)
+
+        cube = SpectrumCube.SpectrumCube(rplFilepath, rawFilepath)
+        xData = cube.getEnergies_keV()
+        name, _extension = os.path.splitext(os.path.basename(rplFilepath))
+        shape = cube.getMapShape(binning)
+        if tileSize is None:
+            tileSize = SpectrumCube.computeTileSize(shape, cube.numberChannels, binning, numberWorkers, maximumMemory_MB)
+        labels = self.getPeakLabels(xData)
+
+        description = {"cube": os.path.abspath(rplFilepath), "binning": binning, "shape": shape,
+                       "tileSize": tileSize, "labels": labels, "fitConfiguration": self.getFitConfiguration(),
+                       "rois": sorted([roi.label, list(roi.energyRange_keV), roi.no_background] for roi in self._rois.values())}
+        manifest = SpectrumCube.TileManifest(os.path.join(self._outputPath, "%s_tiles.json" % (name)), description)
+        peakIntensityMaps = PeakIntensityMaps(self._outputPath, name, shape, labels, isResumed=manifest.isResumed)
+        peakIntensityMaps.flush()
+
+        tiles = [tile for tile in SpectrumCube.getTiles(shape, tileSize) if not manifest.isDone(tile)]
+        logging.info("Spectrum cube tiles: %i remaining, %i done", len(tiles), len(manifest.doneTiles))
+
+        if numberWorkers is not None and numberWorkers <= 1:
+            for tile in tiles:
+                self._fitSpectrumCubeTile(cube, tile, binning, peakIntensityMaps)
+                manifest.addTile(tile)
+                logging.info("Spectrum cube tile %i done", len(manifest.doneTiles))
+        else:
+            initargs = (self, rplFilepath, rawFilepath, binning, name, shape, labels)
+            with ProcessPoolExecutor(max_workers=numberWorkers, initializer=_initializeCubeWorker, initargs=initargs) as executor:
+                futures = [executor.submit(_fitTileWorker, tile) for tile in tiles]
+                for future in as_completed(futures):
+                    manifest.addTile(future.result())
+                    logging.info("Spectrum cube tile %i done", len(manifest.doneTiles))
+
+        return peakIntensityMaps
+
+    def getLineWindows_keV(self, widthFactor=1.2):
+        """
+        Return the (label, e1, e2) window of each line of the ROIs, `widthFactor` times the FWHM of the detector wide.
+
+        A line in more than one ROI has only one window.
+        """
+        windows_keV = []
+        labels = set()
+        for roi in self._rois.values():
+            for position_keV, _fraction, label in self.getRoiPeaks(roi):
+                if label in labels:
+                    continue
+                labels.add(label)
+
+                width_keV = widthFactor*self._detector.getFwhm_eV(position_keV*1.0e3)*1.0e-3
+                windows_keV.append((label, position_keV - width_keV/2.0, position_keV + width_keV/2.0))
+
+        return windows_keV
+
+    def integrateWindows(self, xData, yData, windows_keV, fractional=False):
+        """
+        Return the counts of the measured spectra `yData` in each (label, e1, e2) window, on a new last axis.
+
+        The cumulative sums of the spectra are computed once, see :class:`EnergyAxis.WindowIntegrator`.
+        """
+        windowIntegrator = EnergyAxis.WindowIntegrator(xData, yData)
+        e1s_keV = np.array([e1_keV for _label, e1_keV, _e2_keV in windows_keV])
+        e2s_keV = np.array([e2_keV for _label, _e1_keV, e2_keV in windows_keV])
+
+        return windowIntegrator.integrate(e1s_keV, e2s_keV, fractional=fractional)
+
+    def analyzeSpectrumCubeWindows(self, rplFilepath, windows_keV=None, binning=1, rawFilepath=None, tileSize=None,
+                                   fractional=False, maximumMemory_MB=256.0):
+        """
+        Save a map of the measured counts in each (label, e1, e2) window of each pixel, or `binning` x `binning`
+        super-pixel, of a RAW/RPL spectrum cube. No fit is done.
+
+        Without `windows_keV`, the windows of :meth:`getLineWindows_keV` are used. The maps are saved as
+        `<name>_window_<line>.npy` in the output path, see :class:`PeakIntensityMaps`. The cube is read
+        in square tiles, as in :meth:`analyzeSpectrumCube`.
+        """
+        logging.info("Analyze spectrum cube windows: %s", rplFilepath)
+
+        if windows_keV is None:
+            windows_keV = self.getLineWindows_keV()
+        labels = [label for label, _e1_keV, _e2_keV in windows_keV]
+
+        cube = SpectrumCube.SpectrumCube(rplFilepath, rawFilepath)
+        xData = cube.getEnergies_keV()
+        name, _extension = os.path.splitext(os.path.basename(rplFilepath))
+        shape = cube.getMapShape(binning)
+        if tileSize is None:
+            tileSize = SpectrumCube.computeTileSize(shape, cube.numberChannels, binning, 1, maximumMemory_MB)
+
+        peakIntensityMaps = PeakIntensityMaps(self._outputPath, "%s_window" % (name), shape, labels)
+        for tile in SpectrumCube.getTiles(shape, tileSize):
+            counts = self.integrateWindows(xData, cube.getBinnedTile(tile, binning), windows_keV, fractional)
+            for index, label in enumerate(labels):
+                peakIntensityMaps.setTile(tile, label, counts[..., index])
+        peakIntensityMaps.flush()
+
+        return peakIntensityMaps
+
+    def _fitSpectrumCubeTile(self, cube, tile, binning, peakIntensityMaps):
+        rowStart, _rowStop, columnStart, _columnStop = tile
+        xData = cube.getEnergies_keV()
+
+        spectra = cube.getBinnedTile(tile, binning)
+        numberRows, numberColumns, numberChannels = spectra.shape
+        peakIntensitiesSpectra = self.fitSpectraData(xData, spectra.reshape(numberRows*numberColumns, numberChannels))
+        for index, peakIntensities in enumerate(peakIntensitiesSpectra):
+            rowIndex, columnIndex = divmod(index, numberColumns)
+            peakIntensityMaps.setPixel(rowStart + rowIndex, columnStart + columnIndex, peakIntensities)
+
+        # The tile is on disk before it is recorded as done.
+        peakIntensityMaps.flush()
 
     def saveSpectrum(self, isLogScale=False):
         logging.info("Save spectrum")
@@ -384,6 +990,7 @@ class SpectrumAnalyzer(object):
             xData *= 1.0e-3
         yData = np.array(self._spectrum.getDataY())
 
+        import matplotlib.pyplot as plt
         figure = plt.figure()
 
         if isLogScale:
@@ -445,6 +1052,7 @@ class SpectrumAnalyzer(object):
             self._saveRoi(roi, xRoi, yRoi, roiName)
 
     def _saveRoi(self, roi, xData, yData, roiName, isLogScale=False):
+        import matplotlib.pyplot as plt
         figure = plt.figure()
 
         if isLogScale:
@@ -494,6 +1102,8 @@ class SpectrumAnalyzer(object):
         color = 'r'
         yFraction = 0.2
 
+        import matplotlib.pyplot as plt
+        from matplotlib.text import OffsetFrom
         for position_keV, label in self._lineRefManager.getAbsorptionEdges():
             xMin, xMax = plt.xlim()
             if xMin <= position_keV and position_keV <= xMax:
@@ -527,6 +1137,8 @@ class SpectrumAnalyzer(object):
         color = 'g'
         yFraction = 0.2
 
+        import matplotlib.pyplot as plt
+        from matplotlib.text import OffsetFrom
         peaks = self._lineRefManager.getSiEscapePeaks()
         for position_keV, label in peaks:
             xMin, xMax = plt.xlim()
@@ -542,6 +1154,8 @@ class SpectrumAnalyzer(object):
     def _plotFixScale(self, position_keV, fraction, label, color):
             #yMin, yMax = plt.ylim()
             #yFraction = yMax*fraction
+            import matplotlib.pyplot as plt
+            from matplotlib.text import OffsetFrom
             xMin, xMax = plt.xlim()
             if xMin <= position_keV and position_keV <= xMax:
 #                t = plt.axvspan(xmin=position_keV, xmax=position_keV, ymin=0, ymax=yFraction, color=color,
@@ -558,48 +1172,494 @@ class SpectrumAnalyzer(object):
             roi = self._rois[roiName]
             roi.displayRoi(xData, yData)
 
-    def _fitRoi(self, roi, xData, yData):
+    def _fitRois(self, roiNames, xData, yData):
+        """
+        Return the peak intensities of each ROI, in the order of `roiNames`.
+        """
+        return list(self._iterFitRois(roiNames, xData, yData))
+
+    def _iterFitRois(self, roiNames, xData, yData):
+        """
+        Yield the peak intensities of each ROI, in the order of `roiNames`.
+
+        The key of each ROI in the fit result cache and in the incremental analysis is computed once.
+        With more than one ROI worker, the plan and the data of each ROI to fit are sent to the pool of
+        :meth:`getRoiExecutor` and the figures are saved, or kept if headless, by this process.
+        The pool is not used if less than two ROIs have to be fitted.
+        """
+        keys = dict((roiName, self._getRoiFitResultKey(self._rois[roiName], xData, yData)) for roiName in roiNames)
+
+        # The ROIs of the whole spectrum fit share one fit, see :meth:`_fitWholeSpectrum`.
+        if (self.numberRoiWorkers == 1 or self.fitMethod == FIT_METHOD_SPECTRUM or
+                len(self._getChangedRoiNames(roiNames, keys)) < 2):
+            for roiName in roiNames:
+                yield self._fitRoi(self._rois[roiName], xData, yData, keys[roiName])
+            return
+
+        # The fits kept by the incremental analysis or in the cache are not sent to the workers.
+        fitResults = {}
+        fitRoiNames = []
+        for roiName in roiNames:
+            if len(xData[self._rois[roiName].getRoiSlice(xData)]) <= 0:
+                continue
+            if keys[roiName] is not None:
+                fitResults[roiName] = self._getRoiFitResult(roiName, keys[roiName])
+            if fitResults.get(roiName) is None:
+                fitRoiNames.append(roiName)
+
+        executor = self.getRoiExecutor()
+        futures = {}
+        for roiName in fitRoiNames:
+            roi = self._rois[roiName]
+            xRoi, yRoi = roi.getRoiData(xData, yData)
+            futures[roiName] = executor.submit(_fitRoiWorker, roi, self.getRoiFitPlan(roi), xRoi, yRoi, self._warmStartFits.get(roiName))
+
+        for roiName in roiNames:
+            if roiName not in futures:
+                yield self._fitRoi(self._rois[roiName], xData, yData, keys[roiName], fitResults.get(roiName))
+                continue
+
+            peakIntensitiesRoi, roiFits, warmStartFit = futures[roiName].result()
+            if warmStartFit is not None:
+                self._warmStartFits[roiName] = warmStartFit
+            self._setRoiFitResult(roiName, keys[roiName], (peakIntensitiesRoi, roiFits))
+            yield self._addRoiFitResult((peakIntensitiesRoi, roiFits))
+
+    def getRoiExecutor(self):
+        """
+        Return the pool of the :attr:`numberRoiWorkers` ROI workers, kept for the next spectra.
+
+        Each worker receives a copy of the analyzer once, without its fits, plans and cache. The pool is
+        created again when the fit configuration changed. Call :meth:`closeRoiWorkers`, or use the analyzer
+        in a `with` statement, to stop the workers.
+        """
+        configuration = self.getFitConfiguration()
+        configuration["numberRoiWorkers"] = self.numberRoiWorkers
+        configuration["warmStart"] = [self.warmStart, self.warmStartMaximumChi2Ratio, self._isWarmStartReferenceFixed]
+
+        if self._roiExecutor is not None and configuration != self._roiExecutorConfiguration:
+            self.closeRoiWorkers()
+
+        if self._roiExecutor is None:
+            self._roiExecutor = ProcessPoolExecutor(max_workers=self.numberRoiWorkers, initializer=_initializeRoiWorker,
+                                                    initargs=(self._createRoiWorker(),))
+            self._roiExecutorConfiguration = configuration
+
+        return self._roiExecutor
+
+    def closeRoiWorkers(self):
+        """
+        Stop the pool of the ROI workers, the next fit with ROI workers starts a new pool.
+        """
+        if self._roiExecutor is not None:
+            self._roiExecutor.shutdown()
+            self._roiExecutor = None
+            self._roiExecutorConfiguration = None
+
+    def _createRoiWorker(self):
+        # The figures are saved, and the fits kept or cached, by this process.
+        spectrumAnalyzer = copy.copy(self)
+        spectrumAnalyzer.headless = True
+        spectrumAnalyzer.numberRoiWorkers = 1
+        spectrumAnalyzer.fitResultCache = None
+        spectrumAnalyzer.incrementalAnalysis = False
+        spectrumAnalyzer._rois = {}
+        spectrumAnalyzer._roiFits = []
+        spectrumAnalyzer._roiFitPlans = {}
+        spectrumAnalyzer._roiFitResults = {}
+        spectrumAnalyzer._roiDependencies = dict(self._roiDependencies)
+        spectrumAnalyzer._warmStartFits = {}
+        spectrumAnalyzer._spectrum = None
+
+        return spectrumAnalyzer
+
+    def _fitRoi(self, roi, xData, yData, key=None, fitResult=None):
+        """
+        Return the peak intensities of a ROI, fitted or reused from the incremental analysis or the fit result cache.
+
+        `key` is the key of the ROI from :meth:`getFitResultKey`, computed if it is not given. `fitResult` is
+        the fit result already read for this key.
+        """
         xRoi, yRoi = roi.getRoiData(xData, yData)
         if len(xRoi) <= 0:
             logging.warning("No experimental data for roi: %s", roi.label)
             return []
 
-        roiPeaks = self.getRoiPeaks(roi)
+        if key is None:
+            key = self._getRoiFitResultKey(roi, xData, yData)
+
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            eMin_keV, eMax_keV = roi.energyRange_keV
+            return [peakIntensity for peakIntensity in self._fitWholeSpectrum(xData, yData, key)
+                    if eMin_keV <= peakIntensity.position_keV <= eMax_keV]
+
+        if key is None:
+            return self._fitRoiData(roi, xData, yData, xRoi, yRoi)
+
+        if fitResult is None:
+            fitResult = self._getRoiFitResult(roi.label, key)
+        if fitResult is not None:
+            return self._addRoiFitResult(fitResult)
+
+        self._cachedRoiFits = []
+        try:
+            fitResult = (self._fitRoiData(roi, xData, yData, xRoi, yRoi), self._cachedRoiFits)
+        finally:
+            self._cachedRoiFits = None
+        self._setRoiFitResult(roi.label, key, fitResult)
+
+        return list(fitResult[0])
+
+    def _fitWholeSpectrum(self, xData, yData, key=None):
+        """
+        Return the peak intensities of all the lines of :meth:`_fitSpectrumPeaks`, or of its fit with the same
+        key in the incremental analysis or the fit result cache.
+
+        The fit is kept once per spectrum, with the key of :meth:`getSpectrumFitResultKey`, for all the ROIs.
+        """
+        if key is None and (self.fitResultCache is not None or self.incrementalAnalysis):
+            key = self.getSpectrumFitResultKey(xData, yData)
+        if key is None:
+            return self._fitSpectrumPeaks(xData, yData)
+
+        fitResult = self._getRoiFitResult(ROI_SPECTRUM, key)
+        if fitResult is not None:
+            return self._addRoiFitResult(fitResult)
+
+        self._cachedRoiFits = []
+        try:
+            fitResult = (self._fitSpectrumPeaks(xData, yData), self._cachedRoiFits)
+        finally:
+            self._cachedRoiFits = None
+        self._setRoiFitResult(ROI_SPECTRUM, key, fitResult)
+
+        return list(fitResult[0])
+
+    def _getRoiFitResultKey(self, roi, xData, yData):
+        """
+        Return the key of the ROI, or None if neither the fit result cache nor the incremental analysis is used.
+        """
+        if self.fitResultCache is None and not self.incrementalAnalysis:
+            return None
+
+        return self.getFitResultKey(roi, xData, yData)
+
+    def _addRoiFitResult(self, fitResult):
+        """
+        Add the ROI fits of a fit result, as if it was fitted, and return its peak intensities.
+        """
+        peakIntensities, roiFits = fitResult
+        for roiFit in roiFits:
+            self._addRoiFit(*roiFit)
+
+        return list(peakIntensities)
+
+    def _setRoiFitResult(self, roiLabel, key, fitResult):
+        if self.incrementalAnalysis:
+            self._roiFitResults[roiLabel] = (key, fitResult)
+        if self.fitResultCache is not None:
+            self.fitResultCache.set(key, fitResult)
+
+    def _getRoiFitResult(self, roiLabel, key):
+        """
+        Return the (peak intensities, ROI fits) of the last fit of the ROI, if its key did not change, or of the cache.
+
+        Return None if the ROI has to be fitted.
+        """
+        if self.incrementalAnalysis:
+            keyLast, fitResult = self._roiFitResults.get(roiLabel, (None, None))
+            if keyLast == key:
+                logging.debug("Fit of %s reused, its dependencies did not change", roiLabel)
+                return fitResult
+
+        if self.fitResultCache is not None:
+            fitResult = self.fitResultCache.get(key)
+            if fitResult is not None:
+                logging.debug("Fit result of %s from the cache", roiLabel)
+                if self.incrementalAnalysis:
+                    self._roiFitResults[roiLabel] = (key, fitResult)
+                return fitResult
+
+        return None
+
+    def _getChangedRoiNames(self, roiNames, keys):
+        """
+        Return the ROIs that are fitted again by the incremental analysis, all the ROIs if it is not used.
+
+        `keys` are the keys of the ROIs from :meth:`getFitResultKey`.
+        """
+        if not self.incrementalAnalysis:
+            return list(roiNames)
+
+        changedRoiNames = []
+        for roiName in roiNames:
+            keyLast, _fitResult = self._roiFitResults.get(roiName, (None, None))
+            if keyLast is None or keyLast != keys[roiName]:
+                changedRoiNames.append(roiName)
+
+        return changedRoiNames
+
+    def resetIncrementalAnalysis(self):
+        """
+        Forget the last fits of the ROIs, the next incremental analysis fits all the ROIs.
+        """
+        self._roiFitResults = {}
+
+    def _fitRoiData(self, roi, xData, yData, xRoi, yRoi):
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            return self._fitSpectrumPeaks(xData, yData, roi)
+
+        plan = self.getRoiFitPlan(roi)
 
         if self.fitMethod == FIT_METHOD_PEAK:
-            peakIntensities = self._fitPeaks(xRoi, yRoi, roiPeaks, roi.label, no_background=roi.no_background)
+            peakIntensities = self._fitPeaks(xRoi, yRoi, plan)
+        elif self.fitMethod == FIT_METHOD_PEAK_PROJECTION:
+            peakIntensities = self._fitPeaksProjection(xRoi, yRoi, plan)
         elif self.fitMethod == FIT_METHOD_PEAK_FAMILY:
-            peakIntensities = self._fitPeaksFamily(xRoi, yRoi, roiPeaks, roi.label, no_background=roi.no_background)
+            peakIntensities = self._fitPeaksFamily(xRoi, yRoi, plan)
         elif self.fitMethod == FIT_METHOD_ROI:
-            peakIntensities = self._fitRoiPeaks(xRoi, yRoi, roiPeaks, roi.label)
-        elif self.fitMethod == FIT_METHOD_SPECTRUM:
-            peakIntensities = self._fitSpectrumPeaks(xRoi, yRoi, roiPeaks, roi.label)
+            peakIntensities = self._fitRoiPeaks(xRoi, yRoi, plan)
 
         return peakIntensities
 
+    def getFitConfiguration(self):
+        """
+        Return the configuration of the analyzer that changes the fits, a dictionary of json values.
+        """
+        configuration = {}
+        configuration["elements"] = self._lineRefManager.elementSymbols
+        configuration["requiredPeaks"] = [list(peak) for peak in self._requiredPeaks]
+        configuration["omittedPeaks"] = [list(peak) for peak in self._omittedPeaks]
+        if self._detector is not None:
+            configuration["detector"] = [self._detector.getElectronicNoise_eV(), self._detector.getFanoFactor()]
+        else:
+            configuration["detector"] = None
+        configuration["fitMethod"] = self.fitMethod
+        configuration["fitBackend"] = self.fitBackend
+        configuration["hasDoubleCarbonPeak"] = self.hasDoubleCarbonPeak
+        configuration["maximumEnergy_keV"] = self.maximumEnergy_keV
+        configuration["maximumPositionError_keV"] = self._maximumPositionError_keV
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            configuration["spectrumKnotSpacing_keV"] = self.spectrumKnotSpacing_keV
+
+        return configuration
+
+    def getRoiDependencies(self, roi):
+        """
+        Return the inputs of the fit of a ROI, a dictionary of json values.
+
+        They are the ROI, the lines in its energy range from :meth:`getRoiPeaks`, the detector and the fit settings.
+        A change of the configuration that does not change them, e.g. an element without lines in the ROI,
+        does not change the fit of the ROI. With :data:`FIT_METHOD_SPECTRUM`, the fit depends on all the lines
+        and the dependencies are the ones of :meth:`getFitConfiguration`.
+
+        The dependencies are computed once after each change of the configuration, the returned dictionary
+        must not be modified.
+        """
+        roiKey = (roi.label, tuple(roi.energyRange_keV), roi.no_background)
+        if roiKey not in self._roiDependencies:
+            self._roiDependencies[roiKey] = self._computeRoiDependencies(roi)
+
+        return self._roiDependencies[roiKey]
+
+    def _resetRoiDependencies(self):
+        # The plans are kept, each one is compared with the new dependencies of its ROI at its next use.
+        self._roiDependencies = {}
+
+    def _computeRoiDependencies(self, roi):
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            dependencies = self.getFitConfiguration()
+            dependencies["roi"] = [roi.label, list(roi.energyRange_keV), roi.no_background]
+            return dependencies
+
+        roiPeaks = self.getRoiPeaks(roi)
+        isCarbonDoublePeak = self.hasDoubleCarbonPeak and (roi.label == ROI_CARBON_DOUBLE_PEAKS or
+                                                          any(label.startswith("C K") or label == "CD" for _position_keV, _fraction, label in roiPeaks))
+
+        dependencies = {}
+        dependencies["roi"] = [roi.label, list(roi.energyRange_keV), roi.no_background]
+        dependencies["roiPeaks"] = [list(roiPeak) for roiPeak in roiPeaks]
+        if self._detector is not None:
+            dependencies["detector"] = [self._detector.getElectronicNoise_eV(), self._detector.getFanoFactor()]
+        else:
+            dependencies["detector"] = None
+        dependencies["fitMethod"] = self.fitMethod
+        dependencies["fitBackend"] = self.fitBackend
+        dependencies["hasDoubleCarbonPeak"] = isCarbonDoublePeak
+        dependencies["maximumPositionError_keV"] = self._maximumPositionError_keV
+
+        return dependencies
+
+    def getFitResultKey(self, roi, xData, yData):
+        """
+        Return the key of the fit of a ROI in the :attr:`fitResultCache` and in the incremental analysis.
+
+        The key is the hash of :meth:`getRoiDependencies` and of the ROI channels. For :data:`FIT_METHOD_SPECTRUM`,
+        all the ROIs share the fit of the spectrum and its key from :meth:`getSpectrumFitResultKey`.
+        """
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            return self.getSpectrumFitResultKey(xData, yData)
+
+        xRoi, yRoi = roi.getRoiData(xData, yData)
+        return FitResultCache.createKey(self.getRoiDependencies(roi), xRoi, yRoi)
+
+    def getSpectrumFitResultKey(self, xData, yData):
+        """
+        Return the key of the fit of the whole spectrum, the hash of :meth:`getFitConfiguration` and of the spectrum.
+        """
+        return FitResultCache.createKey(self.getFitConfiguration(), xData, yData)
+
+    def getRoiFitPlan(self, roi):
+        """
+        Return the fit plan of a ROI, compiled again only when the dependencies of the ROI changed.
+
+        The dependencies are looked up again only after a change of the configuration, see :meth:`getRoiDependencies`.
+        """
+        plan = self._roiFitPlans.get(roi.label)
+        dependencies = self.getRoiDependencies(roi)
+        if plan is not None and plan.dependencies is not dependencies:
+            if plan.dependencies == dependencies:
+                # Same dependencies, the next lookups only compare the objects.
+                plan.dependencies = dependencies
+            else:
+                plan = None
+
+        if plan is None:
+            plan = self.compileRoiFitPlan(roi)
+            self._roiFitPlans[roi.label] = plan
+
+        return plan
+
+    def getRoiFitPlans(self):
+        """
+        Return the fit plans of all the ROIs, to be used by other analyzers with the same configuration.
+        """
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            return {}
+
+        return dict((roiName, self.getRoiFitPlan(roi)) for roiName, roi in self._rois.items())
+
+    def setRoiFitPlans(self, roiFitPlans):
+        """
+        Use fit plans compiled by an analyzer with the same configuration.
+
+        A plan is compiled again if the dependencies of its ROI are not the ones of this analyzer.
+        """
+        self._roiFitPlans = dict(roiFitPlans)
+
+    def compileRoiFitPlan(self, roi):
+        """
+        Return a new :class:`RoiFitPlan` of the ROI for the current fit method.
+        """
+        plan = RoiFitPlan(roi, self.fitMethod, self.getRoiPeaks(roi))
+        plan.dependencies = self.getRoiDependencies(roi)
+
+        if self.fitMethod in (FIT_METHOD_PEAK, FIT_METHOD_PEAK_PROJECTION):
+            self._compilePeaksPlan(plan)
+        elif self.fitMethod == FIT_METHOD_PEAK_FAMILY:
+            self._compilePeaksFamilyPlan(plan)
+        elif self.fitMethod == FIT_METHOD_ROI:
+            self._compileRoiPeaksPlan(plan)
+        else:
+            raise ValueError("No fit plan for the fit method: %s" % (self.fitMethod))
+
+        return plan
+
+    def _minimizeRoiModel(self, plan, functionModel, functionJacobian, xRoi, yRoi):
+        """
+        Fit the ROI model from the guesses of the plan or, with warm start, from the values of the previous fit of the ROI.
+
+        A warm fit is rejected, and the fit done again from the guesses, if it fails, if it needs more than twice the
+        evaluations of the last fit from the guesses or if its quality is worse than `warmStartMaximumChi2Ratio` times
+        the one of the previous fit. The quality is the reduced chi-square over the mean counts of the ROI.
+        """
+        roiLabel = plan.roi.label
+        names = tuple(plan.parameterIndices)
+        meanCounts = max(np.mean(yRoi), 1.0)
+
+        warmStartFit = self._warmStartFits.get(roiLabel) if self.warmStart else None
+        if warmStartFit is not None and warmStartFit[0] == names:
+            _names, values, quality, numberColdEvaluations = warmStartFit
+            result = self._minimizePlan(plan, values, functionModel, functionJacobian, xRoi, yRoi, 2*numberColdEvaluations)
+            if result.success and result.redchi/meanCounts <= self.warmStartMaximumChi2Ratio*quality:
+                logging.debug("Warm start fit of %s: %i evaluations", roiLabel, result.nfev)
+                self._updateWarmStartFit(roiLabel, names, result, result.redchi/meanCounts, numberColdEvaluations)
+                return result
+
+            logging.info("Warm start fit of %s rejected after %i evaluations, reduced chi-square %g", roiLabel, result.nfev, result.redchi)
+
+        result = self._minimizePlan(plan, None, functionModel, functionJacobian, xRoi, yRoi)
+        if self.warmStart:
+            self._updateWarmStartFit(roiLabel, names, result, result.redchi/meanCounts, result.nfev)
+
+        return result
+
+    def _minimizePlan(self, plan, values, functionModel, functionJacobian, xRoi, yRoi, maximumEvaluations=None):
+        """
+        Fit the ROI model with the backend of :attr:`fitBackend`, starting from :meth:`RoiFitPlan.getValues`.
+
+        :data:`FIT_BACKEND_LEAST_SQUARES` fits the flat parameter vector with :func:`scipy.optimize.least_squares`,
+        its result has the same attributes as the lmfit result. :data:`FIT_BACKEND_BATCH` fits one spectrum
+        the same way, the spectra are fitted together only by :meth:`fitSpectraData`.
+        """
+        if self.fitBackend in (FIT_BACKEND_LEAST_SQUARES, FIT_BACKEND_BATCH):
+            names, _values, vary, lowerBounds, upperBounds = plan.getParameterArrays()
+            return FitLeastSquares.minimize(names, plan.getValues(xRoi, yRoi, values), vary, lowerBounds, upperBounds,
+                                            functionModel, functionJacobian, xRoi, yRoi, maximumEvaluations)
+
+        parameters = plan.getParameters(xRoi, yRoi, values)
+        return _minimizeModel(parameters, functionModel, functionJacobian, xRoi, yRoi, maximumEvaluations)
+
+    def _updateWarmStartFit(self, roiLabel, names, result, quality, numberColdEvaluations):
+        if self._isWarmStartReferenceFixed and roiLabel in self._warmStartFits:
+            return
+
+        self._warmStartFits[roiLabel] = (names, _getParameterValues(result.params), quality, numberColdEvaluations)
+
+    def setWarmStartReference(self):
+        """
+        Start all the next warm fits from the fits of the last spectrum, instead of the fits of the previous spectrum.
+        """
+        self._isWarmStartReferenceFixed = True
+
+    def resetWarmStart(self):
+        """
+        Forget the previous fits, the next fits start from the guesses.
+        """
+        self._warmStartFits = {}
+        self._isWarmStartReferenceFixed = False
+
+    def _compilePeaksPlan(self, plan):
+        isProjection = self.fitMethod == FIT_METHOD_PEAK_PROJECTION
+
+        if not isProjection:
+            isBackgroundFixed = self.hasDoubleCarbonPeak and plan.roi.label == ROI_CARBON_DOUBLE_PEAKS
+            plan.addBackground(vary=not isBackgroundFixed)
+
+        for position_keV, fraction, label in plan.roiPeaks:
+            sigmaGuess = self._addPeakShapeParameters(plan, position_keV, label)
+
+            if not isProjection:
+                key = "%s_%s" % (label.replace(' ', '_'), "area")
+                plan.addArea(key, fraction, sigmaGuess)
+
+        if not isProjection:
+            plan.areaIndices = plan.getIndices(["%s_%s" % (baseKey, "area") for baseKey in plan.baseKeys])
+        plan.positionIndices = plan.getIndices(["%s_%s" % (baseKey, "position") for baseKey in plan.baseKeys])
+        plan.sigmaIndices = plan.getIndices(["%s_%s" % (baseKey, "sigma") for baseKey in plan.baseKeys])
+
     def getRoiPeaks(self, roi):
         eMin_keV, eMax_keV = roi.energyRange_keV
 
-        lines = self._lineRefManager.getMajorLines()
-        lines.extend(self._lineRefManager.getLines(self._requiredPeaks))
-        omittedLines = self._lineRefManager.getLines(self._omittedPeaks)
-
-        for omittedLine in omittedLines:
-            try:
-                lines.remove(omittedLine)
-            except ValueError as message:
-                logging.info(omittedLine)
-                logging.warning(message)
+        roiLines = self._lineRefManager.getPeakLinesInEnergyRange(eMin_keV, eMax_keV, self._requiredPeaks, self._omittedPeaks)
 
         fractionTotal = 0.0
-        for position_keV, fraction, label in lines:
-            if eMin_keV <= position_keV <= eMax_keV:
-                fractionTotal += fraction
+        for position_keV, fraction, label in roiLines:
+            fractionTotal += fraction
 
         roiPeaks = []
-        for position_keV, fraction, label in lines:
-            if eMin_keV <= position_keV <= eMax_keV:
-                roiPeaks.append((position_keV, fraction/fractionTotal, label))
+        for position_keV, fraction, label in roiLines:
+            roiPeaks.append((position_keV, fraction/fractionTotal, label))
 
         # Add strobed noise peak
         if eMin_keV <= 0.0 <= eMax_keV:
@@ -613,84 +1673,50 @@ class SpectrumAnalyzer(object):
 
         return roiPeaks
 
-    def _fitPeaks(self, xRoi, yRoi, roiPeaks, roiLabel, no_background=False):
-        parameters = Parameters()
+    def _fitPeaks(self, xRoi, yRoi, plan):
+        roiLabel = plan.roi.label
 
         assert len(xRoi) > 0, roiLabel
         assert len(yRoi) > 0, roiLabel
 
-        aGuess, bGuess = self._computeLinearBackgroundGuess(xRoi, yRoi)
-        if self.hasDoubleCarbonPeak and roiLabel == ROI_CARBON_DOUBLE_PEAKS:
-            parameters.add('lb_a', value=aGuess, vary=False)
-            parameters.add('lb_b', value=bGuess, vary=False)
-        else:
-            parameters.add('lb_a', value=aGuess, vary=True)
-            parameters.add('lb_b', value=bGuess, vary=True)
-            
-        roiMax = np.max(yRoi)
-
-        for position_keV, fraction, label in roiPeaks:
-            sigmaGuess = self._detector.getSigma_keV(position_keV)
-            key = "%s_%s" % (label.replace(' ', '_'), "sigma")
-            if label == 'n':
-                parameters.add(key, value=sigmaGuess, min=0.0)
-            elif self.hasDoubleCarbonPeak and (label.startswith("C K") or label == "CD"):
-                parameters.add(key, value=sigmaGuess, min=sigmaGuess*0.9)
-            else:
-                parameters.add(key, value=sigmaGuess, min=sigmaGuess*0.8, max=sigmaGuess*1.2)
-
-            areaGuess = roiMax*fraction*sigmaGuess*np.sqrt(2.0 * np.pi)
-            key = "%s_%s" % (label.replace(' ', '_'), "area")
-            parameters.add(key, value=areaGuess, min=0.0)
-
-            key = "%s_%s" % (label.replace(' ', '_'), "position")
-            if label == 'n':
-                parameters.add(key, value=position_keV)
-            else:
-                positionMin_keV = position_keV - self._maximumPositionError_keV
-                positionMax_keV = position_keV + self._maximumPositionError_keV
-                parameters.add(key, value=position_keV, min=positionMin_keV, max=positionMax_keV)
+        parameterIndices = plan.parameterIndices
+        areaIndices = plan.areaIndices
+        positionIndices = plan.positionIndices
+        sigmaIndices = plan.sigmaIndices
 
-        def functionBackground(parameters, x):
-            a = parameters['lb_a'].value
-            b = parameters['lb_b'].value
-            linearBackground = PolynomialFirstDegreeFunction(a=a, b=b)
+        numberPeaks = len(plan.labels)
+        model = MultiGaussianFunction(np.zeros(numberPeaks), np.zeros(numberPeaks), np.ones(numberPeaks))
 
-            return linearBackground(x)
+        def updateModel(values):
+            model.a = values[parameterIndices['lb_a']]
+            model.b = values[parameterIndices['lb_b']]
+            model.areas[:] = values[areaIndices]
+            model.positions[:] = values[positionIndices]
+            model.sigmas[:] = values[sigmaIndices]
 
-        def peakFunction(parameters, x, baseKey):
-            key = "%s_%s" % (baseKey, "area")
-            area = parameters[key].value
-
-            key = "%s_%s" % (baseKey, "position")
-            mu = parameters[key].value
-
-            key = "%s_%s" % (baseKey, "sigma")
-            sigma = parameters[key].value
-
-            peakFunction = GaussianFunction(area=area, mu=mu, sigma=sigma)
-
-            return peakFunction(x)
+            return model
 
-        def functionModel(parameters, x):
-            model = functionBackground(parameters, x)
+        def functionModel(values, x):
+            return updateModel(values)(x)
 
-            for position_keV, fraction, label in roiPeaks:
-                baseKey = label.replace(' ', '_')
-                model += peakFunction(parameters, x, baseKey)
+        def functionJacobian(values, x):
+            derivativeAreas, derivativePositions, derivativeSigmas = updateModel(values).derivatives(x)
 
-            return model
+            jacobian = np.zeros((len(values), len(x)))
+            jacobian[parameterIndices['lb_a']] = 1.0
+            jacobian[parameterIndices['lb_b']] = x
+            np.add.at(jacobian, areaIndices, derivativeAreas)
+            np.add.at(jacobian, positionIndices, derivativePositions)
+            np.add.at(jacobian, sigmaIndices, derivativeSigmas)
 
-        def residual(parameters, x, data):
-            model = functionModel(parameters, x)
-            return (data-model)
+            return jacobian
 
-        result  = minimize(residual, parameters, args=(xRoi, yRoi))
+        result = self._minimizeRoiModel(plan, functionModel, functionJacobian, xRoi, yRoi)
 
         #result  = minimize(residual, parameters, args=(xRoi, yRoi))
 
         xFit = xRoi
-        yFit = functionModel(result.params, xFit)
+        yFit = functionModel(_getParameterValues(result.params), xFit)
 
         #logging.info("Fit succes?: %s", result.success)
         #logging.info("Number evaluation: %i", result.nfev)
@@ -703,159 +1729,359 @@ class SpectrumAnalyzer(object):
         for name, par in result.params.items():
             logging.info('  %s = %.4f +/- %.4f', name, par.value, par.stderr)
 
-        left= 0.1
-        width = 1.0 - 2.0 * left
+        yFitLB = model.background(xFit)
+        yFitPeaks = model.peaks(xFit)
 
-        bottom_h = 0.1
-        height_h = 0.1
-        bottom = bottom_h + height_h + 0.02
-        height = 1.0 - bottom - 0.1
+        labels = plan.labels
+        self._addRoiFit(roiLabel, xRoi, yRoi, xFit, yFit, yFitLB, yFitPeaks, labels)
 
-        assert (left + width) <= 1.0
-        assert (bottom + height) <= 1.0
+        return self._getPeakIntensities(model, xFit, yFitLB, labels)
 
-        rectA_profile = [left, bottom, width, height]
-        rectA_residual = [left, bottom_h, width, height_h]
+    def _fitPeaksBatch(self, xRoi, yRois, plan):
+        """
+        Fit the ROI of many spectra, the rows of `yRois`, together and return the peak intensities of each spectrum.
 
-        figure = plt.figure()
-        #figure.clf()
-        figure.suptitle(roiLabel, fontsize=16)
-        axScatter = figure.add_axes(rectA_profile)
+        Same model as :meth:`_fitPeaks`, evaluated for all the spectra at once by :class:`BatchMultiGaussianFunction`.
+        The spectra whose batch fit failed are fitted again one by one with :func:`FitLeastSquares.minimize`.
+        """
+        parameterIndices = plan.parameterIndices
+        indexA = parameterIndices['lb_a']
+        indexB = parameterIndices['lb_b']
+        areaIndices = plan.areaIndices
+        positionIndices = plan.positionIndices
+        sigmaIndices = plan.sigmaIndices
 
-        axScatter.plot(xRoi, yRoi, '.', label='Data')
-        axScatter.plot(xFit, yFit, label='Fit')
+        def getModel(values):
+            return BatchMultiGaussianFunction(values[:, areaIndices], values[:, positionIndices], values[:, sigmaIndices],
+                                              values[:, indexA], values[:, indexB])
 
-        yFitLB = functionBackground(result.params, xFit)
-        axScatter.plot(xFit, yFitLB, label='Fit LB')
+        def functionModel(values, x):
+            return getModel(values)(x)
 
-        for position_keV, fraction, label in roiPeaks:
-            baseKey = label.replace(' ', '_')
-            yFitP = peakFunction(result.params, xFit, baseKey)
-            axScatter.plot(xFit, yFitP, label='Fit %s' % (label))
+        def functionJacobian(values, x):
+            derivativeAreas, derivativePositions, derivativeSigmas = getModel(values).derivatives(x)
 
-        axScatter.set_xlim(xRoi[0], xRoi[-1])
-        axScatter.set_xticks([])
+            # Each peak has its own parameters, the indices do not repeat.
+            jacobian = np.zeros(values.shape + (len(x),))
+            jacobian[:, indexA] = 1.0
+            jacobian[:, indexB] = x
+            jacobian[:, areaIndices] = derivativeAreas
+            jacobian[:, positionIndices] = derivativePositions
+            jacobian[:, sigmaIndices] = derivativeSigmas
 
-        axScatter.legend(loc='best')
+            return jacobian
 
-        residual = yRoi - yFit
-        axHistx = figure.add_axes(rectA_residual)
-        axHistx.plot(xFit, residual, label='Residual')
-        axHistx.set_xlim(xRoi[0], xRoi[-1])
-        axHistx.locator_params(axis='y', tight=True, nbins=4)
+        names, _values, vary, lowerBounds, upperBounds = plan.getParameterArrays()
+        values = np.array([plan.getValues(xRoi, yRoi) for yRoi in yRois])
+        results = FitLeastSquares.minimizeBatch(names, values, vary, lowerBounds, upperBounds,
+                                                functionModel, functionJacobian, xRoi, yRois)
 
-        basefilepath, _extension = os.path.splitext(self._spectrumFilepath)
-        _path, basename = os.path.split(basefilepath)
-        basefilepath = os.path.join(self._outputPath, basename)
-        roiFitFigureFilepath = basefilepath + '_' + roiLabel.replace(" ", '_')
-        for extension in ['.png']:
-            figure.savefig(roiFitFigureFilepath+extension)
+        failedIndices = [index for index, result in enumerate(results) if not result.success]
+        if len(failedIndices) > 0:
+            logging.info("Batch fit of %s: %i of %i fits failed, fitted again one by one", plan.roi.label, len(failedIndices), len(results))
 
-        if self.exportRois:
-            saveFigureData(roiFitFigureFilepath+".csv")
+            def functionModelSpectrum(values, x):
+                return functionModel(values[np.newaxis], x)[0]
 
-        plt.clf()
-        plt.close()
-        del figure
+            def functionJacobianSpectrum(values, x):
+                return functionJacobian(values[np.newaxis], x)[0]
 
-        peakIntensities = []
+            for index in failedIndices:
+                result = FitLeastSquares.minimize(names, values[index], vary, lowerBounds, upperBounds,
+                                                  functionModelSpectrum, functionJacobianSpectrum, xRoi, yRois[index])
+                if result.success or result.chisqr < results[index].chisqr:
+                    results[index] = result
 
-        for _position_keV, _fraction, label in roiPeaks:
-            baseKey = label.replace(' ', '_')
-            yFitP = peakFunction(result.params, xFit, baseKey)
-            yBackground = functionBackground(result.params, xFit)
+            numberFailures = sum(1 for result in results if not result.success)
+            if numberFailures > 0:
+                logging.warning("Batch fit of %s: %i of %i fits failed", plan.roi.label, numberFailures, len(results))
 
-            key = "%s_%s" % (baseKey, "position")
-            position_keV = result.params[key].value
-            key = "%s_%s" % (baseKey, "sigma")
-            sigma_keV = result.params[key].value
+        models = getModel(np.array([_getParameterValues(result.params) for result in results]))
+        yBackgrounds = models.background(xRoi)
 
-            peakIntensity = PeakIntensity(xFit, yFitP, yBackground, position_keV, sigma_keV, label)
-            peakIntensities.append(peakIntensity)
+        peakIntensitiesSpectra = []
+        for index in range(models.numberSpectra):
+            peakIntensitiesSpectra.append(self._getPeakIntensities(models.getFunction(index), xRoi, yBackgrounds[index], plan.labels))
 
-        return peakIntensities
+        return peakIntensitiesSpectra
 
-    def _fitPeaksFamily(self, xRoi, yRoi, roiPeaks, roiLabel, no_background=False):
-        parameters = Parameters()
+    def _fitPeaksProjection(self, xRoi, yRoi, plan):
+        """
+        Fit the ROI by variable projection: the optimizer only sees the positions and sigmas.
+
+        For each trial of the nonlinear parameters, the peak areas and the linear background
+        are solved exactly with a non-negative least-squares solve, once for the model and its Jacobian.
+        """
+        roiLabel = plan.roi.label
 
         assert len(xRoi) > 0, roiLabel
         assert len(yRoi) > 0, roiLabel
 
-        if not no_background:
-            aGuess, bGuess = self._computeLinearBackgroundGuess(xRoi, yRoi)
-            parameters.add('lb_a', value=aGuess, vary=True)
-            parameters.add('lb_b', value=bGuess, vary=True)
+        baseKeys = plan.baseKeys
+        positionIndices = plan.positionIndices
+        sigmaIndices = plan.sigmaIndices
 
-        roiMax = np.max(yRoi)
+        numberPeaks = len(baseKeys)
+        model = MultiGaussianFunction(np.zeros(numberPeaks), np.zeros(numberPeaks), np.ones(numberPeaks))
 
-        peak_family_list = self._get_peak_family_list(roiPeaks)
+        isBackgroundFixed = self.hasDoubleCarbonPeak and roiLabel == ROI_CARBON_DOUBLE_PEAKS
+        if isBackgroundFixed:
+            model.a, model.b = computeLinearBackgroundGuess(xRoi, yRoi)
 
-        for peak_family_label in peak_family_list:
-            print(peak_family_label)
+        solvedValues = []
 
-            family_position_keV = None
-            for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                if label.endswith('a1') or peak_family_label == 'n':
-                    family_position_keV = position_keV
-                    family_height = interp1d(xRoi, yRoi)(position_keV)
+        def updateModel(values, x):
+            positions = values[positionIndices]
+            sigmas = values[sigmaIndices]
+            # The optimizer asks for the model and the Jacobian of the same trial, the linear solve is done once.
+            if len(solvedValues) == 0 or not (np.array_equal(positions, solvedValues[0]) and np.array_equal(sigmas, solvedValues[1])):
+                model.positions[:] = positions
+                model.sigmas[:] = sigmas
+                model.solveLinearParameters(x, yRoi, isBackgroundFixed)
+                solvedValues[:] = [positions, sigmas]
 
-            parameters.add(peak_family_label+"_height", value=roiMax, min=0.0)
-
-            if peak_family_label == 'n':
-                parameters.add(peak_family_label+"_position", value=position_keV)
-            else:
-                positionMin_keV = family_position_keV - self._maximumPositionError_keV
-                positionMax_keV = family_position_keV + self._maximumPositionError_keV
-                parameters.add(peak_family_label+"_position", value=family_position_keV, min=positionMin_keV, max=positionMax_keV)
-
-        def functionBackground(parameters, x):
-            a = parameters['lb_a'].value
-            b = parameters['lb_b'].value
-            linearBackground = PolynomialFirstDegreeFunction(a=a, b=b)
+            return model
 
-            return linearBackground(x)
+        def functionModel(values, x):
+            return updateModel(values, x)(x)
 
-        def functionModel(parameters, x):
-            if not no_background:
-                model = functionBackground(parameters, x)
-            else:
-                model = None
-
-            for peak_family_label in peak_family_list:
-                family_height = parameters[peak_family_label+"_height"]
-                family_position_keV = parameters[peak_family_label+"_position"]
-
-                family_positionRef_keV = None
-                for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                    if label.endswith('a1') or peak_family_label == 'n':
-                        family_positionRef_keV = position_keV
-
-                delta_position = family_positionRef_keV - family_position_keV
-                for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                    mu = position_keV - delta_position
-                    sigma = self._detector.getSigma_keV(position_keV)
-                    area = family_height*fraction*sigma*np.sqrt(2.0 * np.pi)
-                    peakFunction = GaussianFunction(area=area, mu=mu, sigma=sigma)
-                    if model is not None:
-                        model += peakFunction(x)
-                    else:
-                        model = peakFunction(x)
+        def functionJacobian(values, x):
+            derivativePositions, derivativeSigmas = updateModel(values, x).projectedDerivatives(x, isBackgroundFixed)
 
-            return model
+            jacobian = np.zeros((len(values), len(x)))
+            np.add.at(jacobian, positionIndices, derivativePositions)
+            np.add.at(jacobian, sigmaIndices, derivativeSigmas)
 
-        def residual(parameters, x, data):
-            model = functionModel(parameters, x)
-            return (data-model)
+            return jacobian
 
-        result  = minimize(residual, parameters, args=(xRoi, yRoi))
+        result = self._minimizeRoiModel(plan, functionModel, functionJacobian, xRoi, yRoi)
 
         xFit = xRoi
-        yFit = functionModel(result.params, xFit)
+        yFit = functionModel(_getParameterValues(result.params), xFit)
 
         logging.info('Best-Fit Values:')
+        logging.info('  lb_a = %.4f', model.a)
+        logging.info('  lb_b = %.4f', model.b)
+        for baseKey, area in zip(baseKeys, model.areas):
+            logging.info('  %s_area = %.4f', baseKey, area)
         for name, par in result.params.items():
             logging.info('  %s = %.4f +/- %.4f', name, par.value, par.stderr)
 
+        yFitLB = model.background(xFit)
+        yFitPeaks = model.peaks(xFit)
+
+        labels = plan.labels
+        self._addRoiFit(roiLabel, xRoi, yRoi, xFit, yFit, yFitLB, yFitPeaks, labels)
+
+        return self._getPeakIntensities(model, xFit, yFitLB, labels)
+
+    def _getSpectrumNumberChannels(self, xData):
+        numberChannels = len(xData)
+        if self.maximumEnergy_keV is not None:
+            numberChannels = np.searchsorted(xData, self.maximumEnergy_keV, side='right')
+        return numberChannels
+
+    def _getSpectrumPeaks(self, xSpectrum):
+        """
+        Return the ROI of the whole spectrum and its peaks, each label once.
+        """
+        spectrumRoi = Roi(ROI_SPECTRUM, (xSpectrum[0], xSpectrum[-1]))
+        spectrumPeaks = []
+        labels = set()
+        for position_keV, fraction, label in self.getRoiPeaks(spectrumRoi):
+            if label not in labels:
+                spectrumPeaks.append((position_keV, fraction, label))
+                labels.add(label)
+
+        return spectrumRoi, spectrumPeaks
+
+    def getPeakLabels(self, xData):
+        """
+        Return the labels of the peak intensities returned by :meth:`fitSpectrumData` for the energy axis `xData`.
+        """
+        if self.fitMethod == FIT_METHOD_SPECTRUM:
+            xSpectrum = xData[:self._getSpectrumNumberChannels(xData)]
+            _spectrumRoi, spectrumPeaks = self._getSpectrumPeaks(xSpectrum)
+            return [label for _position_keV, _fraction, label in spectrumPeaks]
+
+        labels = []
+        for roi in self._rois.values():
+            if self.fitMethod == FIT_METHOD_ROI or len(xData[roi.getRoiSlice(xData)]) <= 0:
+                continue
+
+            plan = self.getRoiFitPlan(roi)
+            if self.fitMethod == FIT_METHOD_PEAK_FAMILY:
+                labels.extend(plan.lineLabels)
+            else:
+                labels.extend(plan.labels)
+
+        return labels
+
+    def _fitSpectrumPeaks(self, xData, yData, roi=None):
+        """
+        Fit every line of every element over the whole spectrum as one problem.
+
+        The background is piecewise linear with knots every `spectrumKnotSpacing_keV`. Each
+        peak only covers the channels within a few sigmas of its position bounds, so the
+        Jacobian is sparse and the trust region solver works on it with LSMR. If `roi` is
+        given, only the peaks inside the ROI are returned.
+        """
+        numberChannels = self._getSpectrumNumberChannels(xData)
+        xSpectrum = xData[:numberChannels]
+        ySpectrum = yData[:numberChannels]
+        assert len(xSpectrum) > 1
+
+        spectrumRoi, spectrumPeaks = self._getSpectrumPeaks(xSpectrum)
+
+        parameters = Parameters()
+        positions = []
+        positionsBounds = []
+        sigmas = []
+        sigmasBounds = []
+        for position_keV, _fraction, label in spectrumPeaks:
+            sigmaGuess = self._addPeakShapeParameters(parameters, position_keV, label)
+
+            # The peak windows need finite bounds.
+            baseKey = label.replace(' ', '_')
+            parameter = parameters["%s_%s" % (baseKey, "position")]
+            positions.append(parameter.value)
+            positionsBounds.append((max(parameter.min, position_keV - sigmaGuess), min(parameter.max, position_keV + sigmaGuess)))
+            parameter = parameters["%s_%s" % (baseKey, "sigma")]
+            sigmas.append(parameter.value)
+            sigmasBounds.append((parameter.min, min(parameter.max, 2.0*sigmaGuess)))
+
+        numberPeaks = len(spectrumPeaks)
+        positionsBounds = np.array(positionsBounds).reshape(-1, 2)
+        sigmasBounds = np.array(sigmasBounds).reshape(-1, 2)
+        windowHalfWidths_keV = self._spectrumPeakWindowSigmas*sigmasBounds[:, 1]
+
+        numberKnots = max(2, int(np.ceil((xSpectrum[-1] - xSpectrum[0])/self.spectrumKnotSpacing_keV)) + 1)
+        knots = np.linspace(xSpectrum[0], xSpectrum[-1], numberKnots)
+        model = SparseSpectrumFunction(xSpectrum, knots,
+                                       positionsBounds[:, 0] - windowHalfWidths_keV,
+                                       positionsBounds[:, 1] + windowHalfWidths_keV)
+
+        # The background and the areas are linear: start from their least-squares values.
+        values = np.concatenate((np.zeros(numberKnots + numberPeaks), positions, sigmas))
+        linearDesign = model.jacobian(values)[:, :numberKnots + numberPeaks]
+        linearBounds = (np.concatenate((np.full(numberKnots, -np.inf), np.zeros(numberPeaks))), np.inf)
+        values[:numberKnots + numberPeaks] = lsq_linear(linearDesign, ySpectrum, bounds=linearBounds, tol=self._spectrumFitTolerance,
+                                                        lsmr_maxiter=self._spectrumLsmrIterations).x
+
+        lowerBounds = np.concatenate((linearBounds[0], positionsBounds[:, 0], sigmasBounds[:, 0]))
+        upperBounds = np.concatenate((np.full(numberKnots + numberPeaks, np.inf), positionsBounds[:, 1], sigmasBounds[:, 1]))
+        values = np.clip(values, lowerBounds, upperBounds)
+
+        def residual(values):
+            return model(values) - ySpectrum
+
+        result = least_squares(residual, values, jac=model.jacobian, bounds=(lowerBounds, upperBounds),
+                               method='trf', x_scale='jac', ftol=self._spectrumFitTolerance,
+                               tr_solver='lsmr', tr_options={'maxiter': self._spectrumLsmrIterations})
+
+        logging.info("Spectrum fit: %i peaks, %i knots, %i evaluations, cost %.4f", numberPeaks, numberKnots, result.nfev, result.cost)
+
+        values = result.x
+        _knotValues, _areas, positions, sigmas = model.splitParameters(values)
+        yBackground = model.background(values)
+        yFit = yBackground + model.peaks(values)
+
+        symbols = []
+        for _position_keV, _fraction, label in spectrumPeaks:
+            symbol = label.split()[0]
+            if symbol not in symbols:
+                symbols.append(symbol)
+        yFitElements = np.zeros((len(symbols), len(xSpectrum)))
+
+        peakIntensities = []
+        for indexPeak, (_position_keV, _fraction, label) in enumerate(spectrumPeaks):
+            window, yFitP = model.peak(values, indexPeak)
+            yFitElements[symbols.index(label.split()[0]), window] += yFitP
+
+            if roi is not None:
+                eMin_keV, eMax_keV = roi.energyRange_keV
+                if not eMin_keV <= positions[indexPeak] <= eMax_keV:
+                    continue
+
+            peakIntensity = PeakIntensity(xSpectrum[window], yFitP, yBackground[window], positions[indexPeak], sigmas[indexPeak], label)
+            peakIntensities.append(peakIntensity)
+
+        self._addRoiFit(spectrumRoi.label, xSpectrum, ySpectrum, xSpectrum, yFit, yBackground, yFitElements, symbols)
+
+        return peakIntensities
+
+    def _addPeakShapeParameters(self, parameters, position_keV, label):
+        sigmaGuess = self._detector.getSigma_keV(position_keV)
+        key = "%s_%s" % (label.replace(' ', '_'), "sigma")
+        if label == 'n':
+            parameters.add(key, value=sigmaGuess, min=0.0)
+        elif self.hasDoubleCarbonPeak and (label.startswith("C K") or label == "CD"):
+            parameters.add(key, value=sigmaGuess, min=sigmaGuess*0.9)
+        else:
+            parameters.add(key, value=sigmaGuess, min=sigmaGuess*0.8, max=sigmaGuess*1.2)
+
+        key = "%s_%s" % (label.replace(' ', '_'), "position")
+        if label == 'n':
+            parameters.add(key, value=position_keV)
+        else:
+            positionMin_keV = position_keV - self._maximumPositionError_keV
+            positionMax_keV = position_keV + self._maximumPositionError_keV
+            parameters.add(key, value=position_keV, min=positionMin_keV, max=positionMax_keV)
+
+        return sigmaGuess
+
+    def _getPeakIntensities(self, model, xFit, yBackground, labels):
+        peakIntensities = []
+        peakCurves = RoiPeakCurves(xFit, yBackground, model)
+
+        for indexPeak, label in enumerate(labels):
+            position_keV = model.positions[indexPeak]
+            sigma_keV = model.sigmas[indexPeak]
+
+            peakIntensity = PeakIntensity(xFit, None, yBackground, position_keV, sigma_keV, label, peakCurves, indexPeak)
+            peakIntensities.append(peakIntensity)
+
+        return peakIntensities
+
+    def _addRoiFit(self, roiLabel, xRoi, yRoi, xFit, yFit, yBackground, yFitPeaks, labels, exportData=None):
+        """
+        Save the figure of a ROI fit, or keep the fit for :meth:`saveFitFigures` if the analyzer is headless.
+        """
+        if self._cachedRoiFits is not None:
+            self._cachedRoiFits.append((roiLabel, xRoi, yRoi, xFit, yFit, yBackground, yFitPeaks, labels, exportData))
+
+        if not self._isRoiFitKept:
+            return
+
+        roiFitFigureFilepath = self._getRoiFitFigureFilepath(roiLabel)
+        roiFit = (roiFitFigureFilepath, roiLabel, xRoi, yRoi, xFit, yFit, yBackground, yFitPeaks, labels, exportData)
+
+        if self.headless:
+            self._roiFits.append(roiFit)
+        else:
+            self._saveRoiFitFigure(*roiFit)
+
+    def saveFitFigures(self):
+        """
+        Save the figures of the ROI fits done in headless mode.
+        """
+        for roiFit in self._roiFits:
+            self._saveRoiFitFigure(*roiFit)
+
+    def _getRoiFitFigureFilepath(self, roiLabel):
+        basefilepath, _extension = os.path.splitext(self._spectrumFilepath)
+        _path, basename = os.path.split(basefilepath)
+        basefilepath = os.path.join(self._outputPath, basename)
+        roiFitFigureFilepath = basefilepath + '_' + roiLabel.replace(" ", '_')
+
+        return roiFitFigureFilepath
+
+    def _saveRoiFitFigure(self, roiFitFigureFilepath, roiLabel, xRoi, yRoi, xFit, yFit, yBackground, yFitPeaks, labels, exportData=None):
+        if exportData is None:
+            exportData = self.exportRois
+
+        import matplotlib.pyplot as plt
+
         left= 0.1
         width = 1.0 - 2.0 * left
 
@@ -878,29 +2104,11 @@ class SpectrumAnalyzer(object):
         axScatter.plot(xRoi, yRoi, '.', label='Data')
         axScatter.plot(xFit, yFit, label='Fit')
 
-        if not no_background:
-            yFitLB = functionBackground(result.params, xFit)
-            axScatter.plot(xFit, yFitLB, label='Fit LB')
-
-        for peak_family_label in peak_family_list:
-            family_height = result.params[peak_family_label+"_height"]
-            family_position_keV = result.params[peak_family_label+"_position"]
+        if yBackground is not None:
+            axScatter.plot(xFit, yBackground, label='Fit LB')
 
-            yFitP = np.zeros_like(xFit)
-            family_positionRef_keV = None
-            for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                if label.endswith('a1') or peak_family_label == 'n':
-                    family_positionRef_keV = position_keV
-
-            delta_position = family_positionRef_keV - family_position_keV
-            for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                mu = position_keV - delta_position
-                sigma = self._detector.getSigma_keV(position_keV)
-                area = family_height*fraction*sigma*np.sqrt(2.0 * np.pi)
-                peakFunction = GaussianFunction(area=area, mu=mu, sigma=sigma)
-                yFitP += peakFunction(xFit)
-
-            axScatter.plot(xFit, yFitP, label='Fit %s' % (peak_family_label))
+        for yFitP, label in zip(yFitPeaks, labels):
+            axScatter.plot(xFit, yFitP, label='Fit %s' % (label))
 
         axScatter.set_xlim(xRoi[0], xRoi[-1])
         axScatter.set_xticks([])
@@ -913,46 +2121,140 @@ class SpectrumAnalyzer(object):
         axHistx.set_xlim(xRoi[0], xRoi[-1])
         axHistx.locator_params(axis='y', tight=True, nbins=4)
 
-        basefilepath, _extension = os.path.splitext(self._spectrumFilepath)
-        _path, basename = os.path.split(basefilepath)
-        basefilepath = os.path.join(self._outputPath, basename)
-        roiFitFigureFilepath = basefilepath + '_' + roiLabel.replace(" ", '_')
         for extension in ['.png']:
             figure.savefig(roiFitFigureFilepath+extension)
 
-        if self.exportRois:
+        if exportData:
             saveFigureData(roiFitFigureFilepath+".csv")
 
         plt.clf()
         plt.close()
         del figure
 
+    def _fitPeaksFamily(self, xRoi, yRoi, plan):
+        roiLabel = plan.roi.label
+        no_background = plan.roi.no_background
+
+        assert len(xRoi) > 0, roiLabel
+        assert len(yRoi) > 0, roiLabel
+
+        parameterIndices = plan.parameterIndices
+
+        familyLabels = plan.familyLabels
+        lineFamilyIndices = plan.lineFamilyIndices
+        lineOffsets_keV = plan.lineOffsets_keV
+        lineSigmas_keV = plan.lineSigmas_keV
+        lineAreaFactors = plan.lineAreaFactors
+        lineLabels = plan.lineLabels
+        heightIndices = plan.heightIndices
+        positionIndices = plan.positionIndices
+
+        model = MultiGaussianFunction(np.zeros(len(lineLabels)), np.zeros(len(lineLabels)), lineSigmas_keV)
+
+        def updateModel(values):
+            if not no_background:
+                model.a = values[parameterIndices['lb_a']]
+                model.b = values[parameterIndices['lb_b']]
+            model.areas[:] = values[heightIndices]*lineAreaFactors
+            model.positions[:] = values[positionIndices] + lineOffsets_keV
+
+            return model
+
+        def functionModel(values, x):
+            return updateModel(values)(x)
+
+        def functionJacobian(values, x):
+            derivativeAreas, derivativePositions, _derivativeSigmas = updateModel(values).derivatives(x)
+
+            jacobian = np.zeros((len(values), len(x)))
+            if not no_background:
+                jacobian[parameterIndices['lb_a']] = 1.0
+                jacobian[parameterIndices['lb_b']] = x
+            np.add.at(jacobian, heightIndices, derivativeAreas*lineAreaFactors[:, np.newaxis])
+            np.add.at(jacobian, positionIndices, derivativePositions)
+
+            return jacobian
+
+        result = self._minimizeRoiModel(plan, functionModel, functionJacobian, xRoi, yRoi)
+
+        xFit = xRoi
+        yFit = functionModel(_getParameterValues(result.params), xFit)
+        yFitPeaks = model.peaks(xFit)
+
+        logging.info('Best-Fit Values:')
+        for name, par in result.params.items():
+            logging.info('  %s = %.4f +/- %.4f', name, par.value, par.stderr)
+
+        yFitFamilies = [np.sum(yFitPeaks[lineFamilyIndices == familyIndex], axis=0) for familyIndex in range(len(familyLabels))]
+        yFitLB = None if no_background else model.background(xFit)
+        self._addRoiFit(roiLabel, xRoi, yRoi, xFit, yFit, yFitLB, yFitFamilies, familyLabels)
+
+        if not no_background:
+            yBackground = model.background(xFit)
+        else:
+            yBackground = np.zeros_like(xFit)
+
         peakIntensities = []
+        peakCurves = RoiPeakCurves(xFit, yBackground, model)
+        for indexLine, label in enumerate(lineLabels):
+            mu = model.positions[indexLine]
+            sigma_keV = model.sigmas[indexLine]
+
+            peakIntensity = PeakIntensity(xFit, None, yBackground, mu, sigma_keV, label, peakCurves, indexLine)
+            peakIntensities.append(peakIntensity)
+
+        return peakIntensities
+
+    def _compilePeaksFamilyPlan(self, plan):
+        if not plan.roi.no_background:
+            plan.addBackground(vary=True)
+
+        peak_family_list = self._get_peak_family_list(plan.roiPeaks)
+
         for peak_family_label in peak_family_list:
-            family_height = result.params[peak_family_label+"_height"]
-            family_position_keV = result.params[peak_family_label+"_position"]
+            logging.debug("Peak family: %s", peak_family_label)
+
+            family_position_keV = None
+            for position_keV, fraction, label in peak_family_list[peak_family_label]:
+                if label.endswith('a1') or peak_family_label == 'n':
+                    family_position_keV = position_keV
+
+            plan.addHeight(peak_family_label+"_height")
 
+            if peak_family_label == 'n':
+                plan.add(peak_family_label+"_position", value=position_keV)
+            else:
+                positionMin_keV = family_position_keV - self._maximumPositionError_keV
+                positionMax_keV = family_position_keV + self._maximumPositionError_keV
+                plan.add(peak_family_label+"_position", value=family_position_keV, min=positionMin_keV, max=positionMax_keV)
+
+        familyLabels = list(peak_family_list)
+        lineFamilyIndices = []
+        lineOffsets_keV = []
+        lineFractions = []
+        linePositions_keV = []
+        lineLabels = []
+        for familyIndex, peak_family_label in enumerate(familyLabels):
             family_positionRef_keV = None
             for position_keV, fraction, label in peak_family_list[peak_family_label]:
                 if label.endswith('a1') or peak_family_label == 'n':
                     family_positionRef_keV = position_keV
 
-            delta_position = family_positionRef_keV - family_position_keV
             for position_keV, fraction, label in peak_family_list[peak_family_label]:
-                mu = position_keV - delta_position
-                sigma_keV = self._detector.getSigma_keV(position_keV)
-                area = family_height*fraction*sigma*np.sqrt(2.0 * np.pi)
-                yFitP = GaussianFunction(area=area, mu=mu, sigma=sigma_keV)(xFit)
-
-                if not no_background:
-                    yBackground = functionBackground(result.params, xFit)
-                else:
-                    yBackground = np.zeros_like(xFit)
-
-                peakIntensity = PeakIntensity(xFit, yFitP, yBackground, mu, sigma_keV, label)
-                peakIntensities.append(peakIntensity)
-
-        return peakIntensities
+                lineFamilyIndices.append(familyIndex)
+                lineOffsets_keV.append(position_keV - family_positionRef_keV)
+                lineFractions.append(fraction)
+                linePositions_keV.append(position_keV)
+                lineLabels.append(label)
+
+        plan.familyLabels = familyLabels
+        plan.lineFamilyIndices = np.array(lineFamilyIndices, dtype=int)
+        plan.lineOffsets_keV = np.array(lineOffsets_keV)
+        plan.lineSigmas_keV = np.asarray(self._detector.getSigma_keV(np.array(linePositions_keV)), dtype=np.float64)
+        plan.lineAreaFactors = np.array(lineFractions)*plan.lineSigmas_keV*np.sqrt(2.0 * np.pi)
+        plan.lineLabels = lineLabels
+        plan.heightIndices = plan.getIndices([label+"_height" for label in familyLabels])[plan.lineFamilyIndices]
+        plan.positionIndices = plan.getIndices([label+"_position" for label in familyLabels])[plan.lineFamilyIndices]
 
     def _get_peak_family_list(self, roiPeaks):
         peak_family_list = {}
@@ -962,75 +2264,88 @@ class SpectrumAnalyzer(object):
 
         return peak_family_list
 
-    def _fitRoiPeaks(self, xRoi, yRoi, roiPeaks, roiLabel):
-        from lmfit import minimize, Parameters
+    def _compileRoiPeaksPlan(self, plan):
+        plan.addBackground(vary=True)
 
-        parameters = Parameters()
-
-        aGuess, bGuess = self._computeLinearBackgroundGuess(xRoi, yRoi)
-        parameters.add('lb_a', value=aGuess, vary=True)
-        parameters.add('lb_b', value=bGuess, vary=True)
-
-        parameters.add('detector_Dn', value=40.0, min=0.0)
-        parameters.add('detector_F', value=0.12, vary=False, min=0.0)
+        plan.add('detector_Dn', value=40.0, min=0.0)
+        plan.add('detector_F', value=0.12, vary=False, min=0.0)
 
-        positionRef_keV, fraction, label = roiPeaks[0]
-        parameters.add('position', value=positionRef_keV)
+        positionRef_keV, fraction, label = plan.roiPeaks[0]
+        plan.add('position', value=positionRef_keV)
 
-        roiMax = np.max(yRoi)
-
-        for position_keV, fraction, label in roiPeaks:
-            electronicNoise_eV = parameters['detector_Dn'].value
-            FanoFactor = parameters['detector_F'].value
-            detector = DetectorFunction(electronicNoise_eV, FanoFactor)
-            sigmaGuess = detector.getSigma_keV(position_keV)
-
-            areaGuess = roiMax*fraction*sigmaGuess*np.sqrt(2.0 * np.pi)
+        positions_keV = np.array([position_keV for position_keV, _fraction, _label in plan.roiPeaks])
+        sigmaGuesses = DetectorFunction(40.0, 0.12).getSigma_keV(positions_keV)
+        for (position_keV, fraction, label), sigmaGuess in zip(plan.roiPeaks, sigmaGuesses):
             key = "%s_%s" % (label.replace(' ', '_'), "area")
-            parameters.add(key, value=areaGuess, min=0.0)
-
-        def functionBackground(parameters, x):
-            a = parameters['lb_a'].value
-            b = parameters['lb_b'].value
-            linearBackground = PolynomialFirstDegreeFunction(a=a, b=b)
-
-            return linearBackground(x)
-
-        def peakFunction(parameters, x, baseKey, difference_keV):
-            key = "%s_%s" % (baseKey, "area")
-            area = parameters[key].value
-
-            mu = parameters["position"].value + difference_keV
-
-            electronicNoise_eV = parameters['detector_Dn'].value
-            FanoFactor = parameters['detector_F'].value
-            detector = DetectorFunction(electronicNoise_eV, FanoFactor)
-            sigma = detector.getSigma_keV(mu)
+            plan.addArea(key, fraction, sigmaGuess)
+
+        plan.areaIndices = plan.getIndices(["%s_%s" % (baseKey, "area") for baseKey in plan.baseKeys])
+        plan.differences_keV = np.array([positionRef_keV - position_keV for position_keV, _fraction, _label in plan.roiPeaks])
+
+    def _fitRoiPeaks(self, xRoi, yRoi, plan):
+        roiLabel = plan.roi.label
+
+        parameterIndices = plan.parameterIndices
+        baseKeys = plan.baseKeys
+        areaIndices = plan.areaIndices
+        differences_keV = plan.differences_keV
+
+        numberPeaks = len(baseKeys)
+        model = MultiGaussianFunction(np.zeros(numberPeaks), np.zeros(numberPeaks), np.ones(numberPeaks))
+
+        detectorIndices = [parameterIndices['detector_Dn'], parameterIndices['detector_F'], parameterIndices['position']]
+        sigmaTable = {}
+
+        def getSigmaTable(values):
+            """
+            Return the sigmas of the peaks and their derivatives, computed again only when the detector parameters
+            or the position change.
+            """
+            key = tuple(values[detectorIndices])
+            if sigmaTable.get('key') != key:
+                electronicNoise_eV, FanoFactor, position_keV = key
+                detector = DetectorFunction(electronicNoise_eV, FanoFactor)
+                positions_keV = position_keV + differences_keV
+                sigmaTable['key'] = key
+                sigmaTable['sigmas'] = detector.getSigma_keV(positions_keV)
+                sigmaTable['derivatives'] = detector.getSigmaDerivatives_keV(positions_keV)
+
+            return sigmaTable['sigmas'], sigmaTable['derivatives']
+
+        def updateModel(values):
+            sigmas_keV, _sigmaDerivatives = getSigmaTable(values)
+            model.a = values[parameterIndices['lb_a']]
+            model.b = values[parameterIndices['lb_b']]
+            model.areas[:] = values[areaIndices]
+            model.positions[:] = values[parameterIndices['position']] + differences_keV
+            model.sigmas[:] = sigmas_keV
 
-            peakFunction = GaussianFunction(area=area, mu=mu, sigma=sigma)
+            return model
 
-            return peakFunction(x)
+        def functionModel(values, x):
+            return updateModel(values)(x)
 
-        def functionModel(parameters, x):
-            model = functionBackground(parameters, x)
+        def functionJacobian(values, x):
+            derivativeAreas, derivativePositions, derivativeSigmas = updateModel(values).derivatives(x)
 
-            for position_keV, fraction, label in roiPeaks:
-                difference_keV = positionRef_keV - position_keV
-                baseKey = label.replace(' ', '_')
-                model += peakFunction(parameters, x, baseKey, difference_keV)
+            _sigmas_keV, (derivativeElectronicNoise, derivativeFanoFactor, derivativeEnergy) = getSigmaTable(values)
 
-            return model
+            jacobian = np.zeros((len(values), len(x)))
+            jacobian[parameterIndices['lb_a']] = 1.0
+            jacobian[parameterIndices['lb_b']] = x
+            np.add.at(jacobian, areaIndices, derivativeAreas)
+            jacobian[parameterIndices['position']] = np.sum(derivativePositions + derivativeSigmas*derivativeEnergy[:, np.newaxis], axis=0)
+            jacobian[parameterIndices['detector_Dn']] = np.sum(derivativeSigmas*derivativeElectronicNoise[:, np.newaxis], axis=0)
+            jacobian[parameterIndices['detector_F']] = np.sum(derivativeSigmas*derivativeFanoFactor[:, np.newaxis], axis=0)
 
-        def residual(parameters, x, data):
-            model = functionModel(parameters, x)
-            return (data-model)
+            return jacobian
 
-        result  = minimize(residual, parameters, args=(xRoi, yRoi))
+        result = self._minimizeRoiModel(plan, functionModel, functionJacobian, xRoi, yRoi)
 
         #result  = minimize(residual, parameters, args=(xRoi, yRoi))
 
         xFit = xRoi
-        yFit = functionModel(parameters, xFit)
+        yFit = functionModel(_getParameterValues(result.params), xFit)
 
         #logging.info("Fit succes?: %s", result.success)
         #logging.info("Number evaluation: %i", result.nfev)
@@ -1040,101 +2355,33 @@ class SpectrumAnalyzer(object):
         #logging.info("reduced chi2: %s", result.redchi)
 
         logging.info('Best-Fit Values:')
-        for name, par in parameters.items():
+        for name, par in result.params.items():
             logging.info('  %s = %.4f +/- %.4f', name, par.value, par.stderr)
 
         peakIntensities = []
 
-        left= 0.1
-        width = 1.0 - 2.0 * left
-
-        bottom_h = 0.1
-        height_h = 0.1
-        bottom = bottom_h + height_h + 0.02
-        height = 1.0 - bottom - 0.1
-
-        assert (left + width) <= 1.0
-        assert (bottom + height) <= 1.0
-
-        rectA_profile = [left, bottom, width, height]
-        rectA_residual = [left, bottom_h, width, height_h]
-
-        figure = plt.figure()
-        #figure.clf()
-        figure.suptitle(roiLabel, fontsize=16)
-        axScatter = figure.add_axes(rectA_profile)
-
-        axScatter.plot(xRoi, yRoi, '.', label='Data')
-        axScatter.plot(xFit, yFit, label='Fit')
-
-        yFitLB = functionBackground(parameters, xFit)
-        axScatter.plot(xFit, yFitLB, label='Fit LB')
-
-        for position_keV, fraction, label in roiPeaks:
-            difference_keV = positionRef_keV - position_keV
-            baseKey = label.replace(' ', '_')
-            yFitP = peakFunction(parameters, xFit, baseKey, difference_keV)
-            axScatter.plot(xFit, yFitP, label='Fit %s' % (label))
-
-
-        axScatter.set_xlim(xRoi[0], xRoi[-1])
-        axScatter.set_xticks([])
-
-        axScatter.legend(loc='best')
-
-        residual = yRoi - yFit
-        axHistx = figure.add_axes(rectA_residual)
-        axHistx.plot(xFit, residual, label='Residual')
-        axHistx.set_xlim(xRoi[0], xRoi[-1])
-        axHistx.locator_params(axis='y', tight=True, nbins=4)
-
-        basefilepath, _extension = os.path.splitext(self._spectrumFilepath)
-        _path, basename = os.path.split(basefilepath)
-        basefilepath = os.path.join(self._outputPath, basename)
-        roiFitFigureFilepath = basefilepath + '_' + roiLabel.replace(" ", '_')
-        for extension in ['.png']:
-            figure.savefig(roiFitFigureFilepath+extension)
-
-        plt.clf()
-        plt.close()
-        del figure
+        yFitLB = model.background(xFit)
+        labels = plan.labels
+        self._addRoiFit(roiLabel, xRoi, yRoi, xFit, yFit, yFitLB, model.peaks(xFit), labels, exportData=False)
 
         return peakIntensities
 
     def _computeLinearBackgroundGuess(self, xRoi, yRoi):
-        x1 = xRoi[0]
-        x2 = xRoi[-1]
-        y1 = yRoi[0]
-        y2 = yRoi[-1]
-
-        bGuess = (y2 - y1)/(x2 - x1)
-        aGuess = y1 - bGuess*x1
-
-        return aGuess, bGuess
+        return computeLinearBackgroundGuess(xRoi, yRoi)
 
     def savePeakIntensities(self, peakIntensities):
+        with PeakIntensityWriter(self._getPeakIntensitiesFilepath()) as writer:
+            writer.writePeakIntensities(peakIntensities)
+
+    def _getPeakIntensitiesFilepath(self):
         spectrumFilename = os.path.basename(self._spectrumFilepath)
         filename, _extension = os.path.splitext(spectrumFilename)
         intensitiesFilepath = os.path.join(self._outputPath, filename+'.csv')
-        writer = csv.writer(open(intensitiesFilepath, 'w', newline='\n'))
-
-        rowHeader = ["Line", "Counts", "Background", "Position (keV)", "FWHM (eV)", "Counts (1.2*FWHM)", "Background (1.2*FWHM)"]
-        writer.writerow(rowHeader)
-
-        for peakIntensity in peakIntensities:
-            optimumWidth_keV = 1.2 * peakIntensity.fwhm_keV
-            row = []
-            row.append(peakIntensity.label)
-            row.append(peakIntensity.counts)
-            row.append(peakIntensity.countsBackground)
-            row.append(peakIntensity.position_keV)
-            row.append(peakIntensity.fwhm_eV)
-            row.append(peakIntensity.countsFromFixedWidth(optimumWidth_keV))
-            row.append(peakIntensity.countsBackgroundFromFixedWidth(optimumWidth_keV))
-            writer.writerow(row)
+        return intensitiesFilepath
 
     def setDetector(self, electronicNoise_eV, FanoFactor):
         self._detector = DetectorFunction(electronicNoise_eV, FanoFactor)
+        self._resetRoiDependencies()
 
     @property
     def showEdgeMarkers(self):
@@ -1198,6 +2445,65 @@ class SpectrumAnalyzer(object):
     @fitMethod.setter
     def fitMethod(self, fitMethod):
         self._fitMethod = fitMethod
+        self._resetRoiDependencies()
+
+    @property
+    def fitBackend(self):
+        return self._fitBackend
+    @fitBackend.setter
+    def fitBackend(self, fitBackend):
+        self._fitBackend = fitBackend
+        self._resetRoiDependencies()
+
+    @property
+    def spectrumKnotSpacing_keV(self):
+        return self._spectrumKnotSpacing_keV
+    @spectrumKnotSpacing_keV.setter
+    def spectrumKnotSpacing_keV(self, spectrumKnotSpacing_keV):
+        self._spectrumKnotSpacing_keV = spectrumKnotSpacing_keV
+        self._resetRoiDependencies()
+
+    @property
+    def numberRoiWorkers(self):
+        return self._numberRoiWorkers
+    @numberRoiWorkers.setter
+    def numberRoiWorkers(self, numberRoiWorkers):
+        self._numberRoiWorkers = numberRoiWorkers
+
+    @property
+    def fitResultCache(self):
+        return self._fitResultCache
+    @fitResultCache.setter
+    def fitResultCache(self, fitResultCache):
+        self._fitResultCache = fitResultCache
+
+    @property
+    def incrementalAnalysis(self):
+        return self._incrementalAnalysis
+    @incrementalAnalysis.setter
+    def incrementalAnalysis(self, incrementalAnalysis):
+        self._incrementalAnalysis = incrementalAnalysis
+
+    @property
+    def warmStart(self):
+        return self._warmStart
+    @warmStart.setter
+    def warmStart(self, warmStart):
+        self._warmStart = warmStart
+
+    @property
+    def warmStartMaximumChi2Ratio(self):
+        return self._warmStartMaximumChi2Ratio
+    @warmStartMaximumChi2Ratio.setter
+    def warmStartMaximumChi2Ratio(self, warmStartMaximumChi2Ratio):
+        self._warmStartMaximumChi2Ratio = warmStartMaximumChi2Ratio
+
+    @property
+    def headless(self):
+        return self._headless
+    @headless.setter
+    def headless(self, headless):
+        self._headless = headless
 
     @property
     def hasDoubleCarbonPeak(self):
@@ -1205,6 +2511,7 @@ class SpectrumAnalyzer(object):
     @hasDoubleCarbonPeak.setter
     def hasDoubleCarbonPeak(self, hasDoubleCarbonPeak):
         self._hasDoubleCarbonPeak = hasDoubleCarbonPeak
+        self._resetRoiDependencies()
 
     @property
     def maximumEnergy_keV(self):
@@ -1212,9 +2519,182 @@ class SpectrumAnalyzer(object):
     @maximumEnergy_keV.setter
     def maximumEnergy_keV(self, maximumEnergy_keV):
         self._maximumEnergy_keV = maximumEnergy_keV
+        self._resetRoiDependencies()
+
+def getPeakIntensityRow(peakIntensity):
+    """
+    Return the values of a peak intensity in the order of :data:`PEAK_INTENSITIES_HEADER`.
+    """
+    optimumWidth_keV = 1.2 * peakIntensity.fwhm_keV
+    row = []
+    row.append(peakIntensity.label)
+    row.append(peakIntensity.counts)
+    row.append(peakIntensity.countsBackground)
+    row.append(peakIntensity.position_keV)
+    row.append(peakIntensity.fwhm_eV)
+    row.append(peakIntensity.countsFromFixedWidth(optimumWidth_keV))
+    row.append(peakIntensity.countsBackgroundFromFixedWidth(optimumWidth_keV))
+
+    return row
+
+class PeakIntensityTable(object):
+    """
+    Peak intensities kept as one array per column of :data:`PEAK_INTENSITIES_HEADER`.
+
+    The rows are filled from the :class:`PeakIntensity` with :meth:`setRow`, the fitted curves are not kept.
+    """
+    def __init__(self, numberRows=0):
+        self.labels = np.empty(numberRows, dtype=object)
+        self.counts = np.zeros(numberRows)
+        self.countsBackground = np.zeros(numberRows)
+        self.positions_keV = np.zeros(numberRows)
+        self.fwhms_eV = np.zeros(numberRows)
+        self.countsWindow = np.zeros(numberRows)
+        self.countsBackgroundWindow = np.zeros(numberRows)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _getValueColumns(self):
+        return (self.counts, self.countsBackground, self.positions_keV, self.fwhms_eV,
+                self.countsWindow, self.countsBackgroundWindow)
+
+    def setRow(self, index, peakIntensity):
+        row = getPeakIntensityRow(peakIntensity)
+        self.labels[index] = row[0]
+        for column, value in zip(self._getValueColumns(), row[1:]):
+            column[index] = value
+
+    def getRow(self, index):
+        return [self.labels[index]] + [float(column[index]) for column in self._getValueColumns()]
+
+    def getRows(self):
+        return [self.getRow(index) for index in range(len(self))]
+
+def createPeakIntensityTable(peakIntensities):
+    table = PeakIntensityTable(len(peakIntensities))
+    for index, peakIntensity in enumerate(peakIntensities):
+        table.setRow(index, peakIntensity)
+
+    return table
+
+class PeakIntensityMaps(object):
+    """
+    Maps of the counts of each line, saved as memory-mapped `<name>_<line>.npy` files in `outputPath`.
+
+    With `labels`, the maps of these lines are pre-allocated and the other lines are not saved, otherwise
+    the map of a line is created the first time the line is fitted. The pixels without a fit are NaN.
+    With `isResumed`, the maps already saved are opened and kept.
+
+    A line fitted in two ROIs would write the same map, a :class:`ValueError` is raised instead.
+    """
+    def __init__(self, outputPath, name, shape, labels=None, isResumed=False):
+        self._outputPath = outputPath
+        self._name = name
+        self._shape = tuple(shape)
+        self._isResumed = isResumed
+        self._maps = {}
+
+        self._labels = None
+        if labels is not None:
+            _checkUniqueLabels(labels)
+            for label in labels:
+                self.getMap(label)
+            self._labels = set(labels)
+
+    def getFilepath(self, label):
+        return os.path.join(self._outputPath, "%s_%s.npy" % (self._name, label.replace(' ', '_')))
+
+    def getMap(self, label):
+        if label not in self._maps:
+            filepath = self.getFilepath(label)
+            intensityMap = None
+            if self._isResumed and os.path.isfile(filepath):
+                intensityMap = np.lib.format.open_memmap(filepath, mode='r+')
+                if intensityMap.shape != self._shape:
+                    intensityMap = None
+            if intensityMap is None:
+                intensityMap = np.lib.format.open_memmap(filepath, mode='w+', dtype=np.float64, shape=self._shape)
+                intensityMap[...] = np.nan
+            self._maps[label] = intensityMap
+
+        return self._maps[label]
+
+    def setPixel(self, row, column, peakIntensities):
+        _checkUniqueLabels([peakIntensity.label for peakIntensity in peakIntensities])
+        for peakIntensity in peakIntensities:
+            if self._labels is not None and peakIntensity.label not in self._labels:
+                logging.warning("No map for the line %s", peakIntensity.label)
+                continue
+            self.getMap(peakIntensity.label)[row, column] = peakIntensity.counts
+
+    def setTile(self, tile, label, values):
+        """
+        Set the pixels of a tile, (first row, last row + 1, first column, last column + 1), of the map of a line.
+        """
+        rowStart, rowStop, columnStart, columnStop = tile
+        self.getMap(label)[rowStart:rowStop, columnStart:columnStop] = values
+
+    def flush(self):
+        for intensityMap in self._maps.values():
+            intensityMap.flush()
+
+    @property
+    def labels(self):
+        return list(self._maps)
+
+    @property
+    def shape(self):
+        return self._shape
+
+def _checkUniqueLabels(labels):
+    duplicateLabels = sorted(set(label for label in labels if labels.count(label) > 1))
+    if len(duplicateLabels) > 0:
+        raise ValueError("Lines fitted in more than one ROI, their maps would be overwritten: %s" % (", ".join(duplicateLabels)))
+
+class PeakIntensityWriter(object):
+    """
+    Write the peak intensity rows in a csv file as they are computed.
+
+    The file is flushed after each write, the rows written can be read before the analysis is done.
+    """
+    def __init__(self, filepath, header=PEAK_INTENSITIES_HEADER):
+        self._file = open(filepath, 'w', newline='\n')
+        self._writer = csv.writer(self._file)
+        self._numberRows = 0
+
+        self._writer.writerow(header)
+        self._file.flush()
+
+    def writeRows(self, rows):
+        for row in rows:
+            self._writer.writerow(row)
+            self._numberRows += 1
+        self._file.flush()
+
+    def writePeakIntensities(self, peakIntensities, prefix=()):
+        """
+        Write a row for each peak intensity, the values of `prefix` added at the start of each row.
+        """
+        rows = createPeakIntensityTable(peakIntensities).getRows()
+        self.writeRows([list(prefix) + row for row in rows])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+    @property
+    def numberRows(self):
+        return self._numberRows
 
 def showGraphics():
     logging.info("Display graphics")
+    import matplotlib.pyplot as plt
     plt.show()
 
 def run():
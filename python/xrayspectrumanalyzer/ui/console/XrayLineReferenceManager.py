@@ -23,8 +23,11 @@ X-ray lines reference manager
 ###############################################################################
 
 # Standard library modules.
+import bisect
+import logging
 
 # Third party modules.
+import numpy as np
 
 # Local modules.
 import xrayspectrumanalyzer.tools.XRayTransitionData as XRayTransitionData
@@ -34,18 +37,40 @@ import xrayspectrumanalyzer.tools.ElementProperties as ElementProperties
 
 # Globals and constants variables.
 FRACTION_MINOR_MAJOR = 0.05
+MINIMUM_POSITION_DIFFERENCE_keV = 0.01
 
 class XrayLineReferenceManager(object):
     def __init__(self):
         self._xrayData = XRayTransitionData.XRayTransitionData()
-        self._xrayData.readFiles()
 
         self._elementSymbols = []
+        self._cache = {}
 
     def addElement(self, symbol):
         self._elementSymbols.append(symbol)
+        self._cache = {}
+
+    @property
+    def elementSymbols(self):
+        return list(self._elementSymbols)
+
+    def _getCached(self, key, computeValue):
+        """
+        Return the value of `computeValue()` for the current elements, computed once per `key`.
+
+        The cache is cleared by :meth:`addElement`.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = computeValue()
+            self._cache[key] = value
+            return value
 
     def getAbsorptionEdges(self):
+        return list(self._getCached(("absorptionEdges",), self._computeAbsorptionEdges))
+
+    def _computeAbsorptionEdges(self):
         absorptionEdges = []
 
         for symbol in self._elementSymbols:
@@ -60,10 +85,13 @@ class XrayLineReferenceManager(object):
         return absorptionEdges
 
     def getMajorLines(self):
+        return list(self._getCached(("majorLines",), self._computeMajorLines))
+
+    def _computeMajorLines(self):
         majorLines = []
 
         for symbol in self._elementSymbols:
-            positions_keV = set()
+            sortedPositions_keV = []
             atomicNumber = ElementProperties.getAtomicNumberBySymbol(symbol)
             transitions = self._xrayData.getTransition(atomicNumber, restricted=False)
             for transition in transitions:
@@ -71,20 +99,70 @@ class XrayLineReferenceManager(object):
                 fraction = self._xrayData.getTransitionFraction(atomicNumber, transition)
                 position_keV = position_eV/1.0e3
                 label = "%s %s" % (symbol, transition)
-                if (fraction > FRACTION_MINOR_MAJOR and self.notSamePosition_keV(position_keV, positions_keV)):
+                if (fraction > FRACTION_MINOR_MAJOR and self._notSamePosition_keV(position_keV, sortedPositions_keV)):
                     majorLines.append((position_keV, fraction, label))
-                    positions_keV.add(position_keV)
+                    bisect.insort(sortedPositions_keV, position_keV)
 
         return majorLines
 
+    def _notSamePosition_keV(self, position_keV, sortedPositions_keV):
+        """
+        Same as :meth:`notSamePosition_keV`, but only the neighbors in the sorted positions are compared.
+        """
+        index = bisect.bisect_left(sortedPositions_keV, position_keV)
+        for positionRef_keV in sortedPositions_keV[max(0, index - 1):index + 1]:
+            if abs(position_keV - positionRef_keV) < MINIMUM_POSITION_DIFFERENCE_keV:
+                return False
+
+        return True
+
     def notSamePosition_keV(self, position_keV, positions_keV):
         for positionRef_keV in positions_keV:
-            if abs(position_keV - positionRef_keV) < 0.01:
+            if abs(position_keV - positionRef_keV) < MINIMUM_POSITION_DIFFERENCE_keV:
                 return False
 
         return True
 
+    def getPeakLines(self, requiredPeaks=(), omittedPeaks=()):
+        """
+        Return the major lines and the lines of the required peaks, without the lines of the omitted peaks.
+        """
+        key = ("peakLines", tuple(requiredPeaks), tuple(omittedPeaks))
+        lines, _order, _sortedPositions_keV = self._getCached(key, lambda: self._computePeakLines(requiredPeaks, omittedPeaks))
+        return list(lines)
+
+    def getPeakLinesInEnergyRange(self, eMin_keV, eMax_keV, requiredPeaks=(), omittedPeaks=()):
+        """
+        Return the lines of :meth:`getPeakLines` with a position in [eMin, eMax], in the same order.
+        """
+        key = ("peakLines", tuple(requiredPeaks), tuple(omittedPeaks))
+        lines, order, sortedPositions_keV = self._getCached(key, lambda: self._computePeakLines(requiredPeaks, omittedPeaks))
+
+        start = np.searchsorted(sortedPositions_keV, eMin_keV, side='left')
+        stop = np.searchsorted(sortedPositions_keV, eMax_keV, side='right')
+        return [lines[index] for index in np.sort(order[start:stop])]
+
+    def _computePeakLines(self, requiredPeaks, omittedPeaks):
+        lines = self.getMajorLines()
+        lines.extend(self.getLines(requiredPeaks))
+        omittedLines = self.getLines(omittedPeaks)
+
+        for omittedLine in omittedLines:
+            try:
+                lines.remove(omittedLine)
+            except ValueError as message:
+                logging.info(omittedLine)
+                logging.warning(message)
+
+        positions_keV = np.array([position_keV for position_keV, _fraction, _label in lines])
+        order = np.argsort(positions_keV, kind='stable')
+
+        return lines, order, positions_keV[order]
+
     def getLines(self, peaks):
+        return list(self._getCached(("lines", tuple(peaks)), lambda: self._computeLines(peaks)))
+
+    def _computeLines(self, peaks):
         lines = []
 
         for peak in peaks:
@@ -103,6 +181,9 @@ class XrayLineReferenceManager(object):
         return lines
 
     def getMinorLines(self):
+        return list(self._getCached(("minorLines",), self._computeMinorLines))
+
+    def _computeMinorLines(self):
         minorLines = []
 
         for symbol in self._elementSymbols:
@@ -119,6 +200,9 @@ class XrayLineReferenceManager(object):
         return minorLines
 
     def getSatelliteLines(self):
+        return list(self._getCached(("satelliteLines",), self._computeSatelliteLines))
+
+    def _computeSatelliteLines(self):
         satelliteLines = []
         for symbol in self._elementSymbols:
             atomicNumber = ElementProperties.getAtomicNumberBySymbol(symbol)
@@ -134,6 +218,9 @@ class XrayLineReferenceManager(object):
         return satelliteLines
 
     def getSiEscapePeaks(self):
+        return list(self._getCached(("siEscapePeaks",), self._computeSiEscapePeaks))
+
+    def _computeSiEscapePeaks(self):
         siKaLineEnergy_keV = self._xrayData.getTransitionEnergy_eV(14, 'Ka1')/1.0e3
 
         escapePeaks = []